@@ -7,6 +7,7 @@ from flask import Flask, jsonify, url_for, request, \
 from .. import statsd
 from ..core import cache_control, log_handler, database
 from ..core.bucket import Bucket
+from ..core.database import BulkSaveError
 from ..core.errors import ParseError, ValidationError
 from ..core.log_handler \
     import create_request_logger, create_response_logger
@@ -202,12 +203,20 @@ def upload(bucket_name):
 def _store_data(bucket_config):
     parse_file = create_parser(bucket_config)
     bucket = Bucket(db, bucket_config)
-    expected_errors = (FileUploadError, ParseError, ValidationError)
+    expected_errors = (FileUploadError, ParseError, ValidationError,
+                       BulkSaveError)
 
     try:
         with UploadedFile(request.files['file']) as uploaded_file:
-            raw_data = parse_file(uploaded_file.file_stream())
-            bucket.parse_and_store(raw_data)
+            with uploaded_file.file_stream() as file_stream:
+                # Every row is checked before any are stored. Each pass
+                # reads the file a row at a time, so memory use does not
+                # grow with the size of the file.
+                for _ in bucket.parse_stream(parse_file(file_stream)):
+                    pass
+                file_stream.seek(0)
+                bucket.store_stream(
+                    bucket.parse_stream(parse_file(file_stream)))
     except expected_errors as e:
         app.logger.error('Upload error: {}'.format(e.message))
         return render_template('upload_error.html',
@@ -1,6 +1,12 @@
-import hashlib
-import subprocess
 import os
+import socket
+import struct
+
+# Where clamd listens, either the path of a unix socket or host:port
+DEFAULT_CLAMD_SOCKET = '/var/run/clamav/clamd.ctl'
+
+# Bytes sent to clamd in each chunk of a stream
+CHUNK_SIZE = 64 * 1024
 
 
 class VirusSignatureError(StandardError):
@@ -8,41 +14,83 @@ class VirusSignatureError(StandardError):
         self.message = message
 
 
+class StreamTooLargeError(StandardError):
+    """The file is over the StreamMaxLength clamd is configured with"""
+    def __init__(self, message):
+        self.message = message
+
+
+def clamd_address():
+    address = os.getenv('CLAMD_SOCKET', DEFAULT_CLAMD_SOCKET)
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        return host, int(port)
+    return address
+
+
+def _connect(address):
+    if isinstance(address, tuple):
+        connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    else:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(address)
+    return connection
+
+
+def _read_reply(connection):
+    reply = ''
+    while not reply.endswith('\0'):
+        received = connection.recv(4096)
+        if not received:
+            break
+        reply += received
+    return reply.rstrip('\0').strip()
+
+
 class ScannedFile(object):
-    def __init__(self, file_object):
+    """A file scanned for viruses by clamd
+
+    The file is sent to clamd over its socket with the INSTREAM command, so
+    it is not copied anywhere and no scanner process is started.
+    """
+    def __init__(self, file_object, address=None):
         self.file_object = file_object
-        self._virus_signature = False
-        self._file_path = '/tmp/{0}'.format(
-            os.path.basename(self.file_object.filename))
+        self.address = address or clamd_address()
 
     @property
     def has_virus_signature(self):
-        self._save_file_to_disk()
-        self._scan_file()
-        self._clean_up()
-        return self._virus_signature
-
-    def _save_file_to_disk(self):
-        self.file_object.save(self._file_path)
-
-    def _scan_file(self):
-        self._virus_signature = (self._virus_signature or
-                                 self._clamscan(self._file_path))
-
-    def _clamscan(self, filename):
-        retcode = subprocess.call(["clamdscan", filename])
-        # 0 : No virus found.
-        # 1 : Virus(es) found.
-        # 2 : An error occured.
-        if retcode == 0:
-            return False
-        elif retcode == 1:
+        return self._clamscan(self.file_object)
+
+    def _clamscan(self, stream):
+        connection = _connect(self.address)
+        try:
+            connection.sendall('zINSTREAM\0')
+            try:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), ''):
+                    connection.sendall(struct.pack('!L', len(chunk)) + chunk)
+                connection.sendall(struct.pack('!L', 0))
+            except socket.error:
+                # clamd replies and closes the connection as soon as a
+                # stream is over its StreamMaxLength, the reply says why
+                reply = _read_reply(connection)
+                if not reply:
+                    raise
+            else:
+                reply = _read_reply(connection)
+        finally:
+            connection.close()
+
+        # stream: OK
+        # stream: <signature> FOUND
+        # INSTREAM size limit exceeded. ERROR
+        # <reason> ERROR
+        if reply.endswith('FOUND'):
             return True
-        elif retcode == 2:
-            raise SystemError('Error running the clamdscan virus scanner')
-
-    def _clean_up(self):
-        # Remove temporary file
-        os.remove(self._file_path)
-        # Reset stream position on file_object so that it can be read again
-        self.file_object.seek(0)
+        elif reply.endswith('OK'):
+            return False
+        elif 'size limit exceeded' in reply:
+            raise StreamTooLargeError(
+                'File is too big for the clamd virus scanner: {0}'.format(
+                    reply))
+        raise SystemError(
+            'Error running the clamd virus scanner: {0}'.format(reply))
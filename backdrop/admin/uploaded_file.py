@@ -1,23 +1,64 @@
-from .scanned_file import ScannedFile, VirusSignatureError
+from .scanned_file import ScannedFile, StreamTooLargeError, \
+    VirusSignatureError
 from backdrop import statsd
 
-import mimetypes
+import hashlib
+import logging
 import os
 from werkzeug.utils import secure_filename
 
 
+log = logging.getLogger(__name__)
+
+# Bytes read from an upload at a time
+CHUNK_SIZE = 64 * 1024
+
+# Bytes at the start of an upload its type is worked out from
+SNIFF_SIZE = 512
+
+XLS_MAGIC = '\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+XLSX_MAGIC = 'PK\x03\x04'
+UTF8_BOM = '\xef\xbb\xbf'
+
+
+def sniff_mimetype(head):
+    """Return the mimetype of a file from its first bytes
+
+    Spreadsheets are told apart by their magic numbers. Anything else is
+    text, unless it has NUL bytes in it.
+
+    >>> sniff_mimetype('PK\\x03\\x04\\x14\\x00')
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    >>> sniff_mimetype('{"a": 1}')
+    'application/json'
+    >>> sniff_mimetype('a,b\\n1,2\\n')
+    'text/csv'
+    >>> sniff_mimetype('MZ\\x90\\x00')
+    'application/octet-stream'
+    """
+    if head.startswith(XLS_MAGIC):
+        return "application/vnd.ms-excel"
+    if head.startswith(XLSX_MAGIC):
+        return ("application/vnd.openxmlformats-officedocument."
+                "spreadsheetml.sheet")
+    if '\0' in head:
+        return "application/octet-stream"
+    if head.lstrip(UTF8_BOM).lstrip()[:1] in ('{', '['):
+        return "application/json"
+    return "text/csv"
+
+
 class FileUploadError(IOError):
     def __init__(self, message):
         self.message = message
 
 
-def _size_of_file_on_disk(filename):
-    return os.path.getsize(filename)
-
-
 class UploadedFile(object):
-    # This is ~ 1mb in octets
-    MAX_FILE_SIZE = 1000000  # exclusive, so anything >= to this is invalid
+    # This is ~ 1gb in octets, uploads are parsed and stored a chunk at a
+    # time so memory use does not depend on it. clamd needs a StreamMaxLength
+    # as big, files over its limit (25M by default) are rejected as too big
+    # to scan.
+    MAX_FILE_SIZE = 1000000000  # exclusive, so anything >= to this is invalid
 
     def __init__(self, file_storage):
         self.server_filename = os.path.join(
@@ -25,12 +66,29 @@ class UploadedFile(object):
             secure_filename(file_storage.filename))
         self.file_storage = file_storage
         try:
-            self.file_storage.save(self.server_filename)
+            # we don't trust the browser's content_length or content_type
+            self.file_size, self.sha256, self.guessed_mimetype = self._spool()
         except IOError as e:
             raise FileUploadError(e.message)
-        # we don't trust the browser's content_length or content_type
-        self.file_size = _size_of_file_on_disk(self.server_filename)
-        self.guessed_mimetype, _ = mimetypes.guess_type(self.server_filename)
+        self._virus_signature = None
+        self._too_big_to_scan = False
+        log.info(u"Received {0} ({1} bytes, sha256 {2})".format(
+            self.file_storage.filename, self.file_size, self.sha256))
+
+    def _spool(self):
+        """Save the upload to disk, returning its size, hash and mimetype"""
+        size = 0
+        digest = hashlib.sha256()
+        head = ''
+        stream = self.file_storage.stream
+        with open(self.server_filename, 'wb') as spooled:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), ''):
+                spooled.write(chunk)
+                size += len(chunk)
+                digest.update(chunk)
+                if len(head) < SNIFF_SIZE:
+                    head += chunk[:SNIFF_SIZE - len(head)]
+        return size, digest.hexdigest(), sniff_mimetype(head)
 
     def __enter__(self):
         return self
@@ -50,7 +108,6 @@ class UploadedFile(object):
 
     def _is_strange_content_type(self):
         return self.guessed_mimetype not in [
-            "text/plain",  # guess_type() says csv files are 'text/plain'
             "text/csv",
             "application/json",
             "application/vnd.ms-excel",
@@ -62,7 +119,20 @@ class UploadedFile(object):
         if os.getenv('SKIP_VIRUS_SCAN'):
             return False
 
-        return ScannedFile(self.file_storage).has_virus_signature
+        if self._virus_signature is None:
+            with open(self.server_filename, 'rb') as spooled:
+                try:
+                    self._virus_signature = ScannedFile(
+                        spooled).has_virus_signature
+                except StreamTooLargeError as e:
+                    log.warning(e.message)
+                    self._virus_signature = False
+                    self._too_big_to_scan = True
+        return self._virus_signature
+
+    def _is_too_big_to_scan(self):
+        self._is_potential_virus()
+        return self._too_big_to_scan
 
     def validate(self):
         problems = []
@@ -75,6 +145,8 @@ class UploadedFile(object):
                 self.guessed_mimetype)]
         if self._is_potential_virus():
             problems += ['file may contain a virus']
+        if self._is_too_big_to_scan():
+            problems += ['file too big to scan for viruses']
         if problems:
             raise FileUploadError('Invalid file upload {0} - {1}'.format(
                 self.file_storage.filename,
@@ -86,5 +158,6 @@ class UploadedFile(object):
             self._is_empty(),
             self._is_too_big(),
             self._is_strange_content_type(),
-            self._is_potential_virus()
+            self._is_potential_virus(),
+            self._is_too_big_to_scan()
         ])
@@ -0,0 +1,239 @@
+"""
+Build mongo aggregation pipelines for grouped queries
+
+Group keys and collect fields are given positional aliases inside the
+pipeline because mongo does not allow arbitrary field names (eg. names
+containing dots or starting with a dollar) as keys in a $group stage. The
+aliases are mapped back to the original names when the results are read.
+
+Collect methods are reduced by the database. Each group comes back with a
+partial value per collect method (see read_partial) that nested_merge can
+combine across subgroups and turn into the final value.
+"""
+from bson.son import SON
+
+from backdrop.core.nested_merge import collect_key, replace_default_method, \
+    InvalidOperationError
+
+SORT_DIRECTIONS = {
+    "ascending": 1,
+    "descending": -1,
+}
+
+
+def group_key_alias(index):
+    return "k{0}".format(index)
+
+
+def collect_field_alias(index):
+    return "c{0}".format(index)
+
+
+def field_path(field):
+    """Return a mongo field path expression for a field name
+
+    >>> field_path('name')
+    '$name'
+    """
+    return "${0}".format(field)
+
+
+def unique_collects(collect):
+    """Return the distinct (field, method) pairs to be reduced
+
+    The default method is the same as set, so they are only reduced once.
+
+    >>> unique_collects([('a', 'default'), ('a', 'set'), ('b', 'sum')])
+    [('a', 'set'), ('b', 'sum')]
+    """
+    unique = []
+    for field, method in collect:
+        pair = (field, replace_default_method(method))
+        if pair not in unique:
+            unique.append(pair)
+    return unique
+
+
+def build_group_pipeline(keys, query, collect, sort=None, limit=None):
+    """Return an aggregation pipeline grouping documents by keys
+
+    keys: a list of field names to group by
+    query: a mongo query used to filter documents before grouping
+    collect: a list of (field name, collect method) tuples
+    sort, limit: if both are given only the first limit groups in the
+                 order of sort are returned (see build_top_stages)
+
+    Only the fields that are grouped on or collected are passed from the
+    $match stage to the $group stage.
+    """
+    pipeline = [{"$match": query}]
+    projection = build_projection(
+        list(keys) + [field for field, _ in collect])
+    if projection:
+        pipeline.append({"$project": projection})
+    pipeline.append({"$group": build_group_stage(keys, collect)})
+    if sort and limit:
+        pipeline += build_top_stages(keys, sort, limit)
+
+    return pipeline
+
+
+def build_top_stages(keys, sort, limit):
+    """Return the stages keeping the first groups in the order of a sort
+
+    sort is a [field, direction] pair naming a field of the $group stage.
+    Groups that tie are ordered by their keys, as they are by nested_merge.
+
+    >>> build_top_stages(['a'], ['_count', 'descending'], 2) == [
+    ...     {'$sort': SON([('_count', -1), ('_id.k0', 1)])},
+    ...     {'$limit': 2}]
+    True
+    """
+    order = SON([(sort[0], SORT_DIRECTIONS[sort[1]])])
+    for index in range(len(keys)):
+        order["_id." + group_key_alias(index)] = 1
+
+    return [{"$sort": order}, {"$limit": limit}]
+
+
+def build_projection(fields):
+    """Return a $project stage body keeping only the given fields
+
+    >>> build_projection(['a', 'b', 'a']) == {'a': 1, 'b': 1}
+    True
+    """
+    return dict((field, 1) for field in fields)
+
+
+def build_group_stage(keys, collect):
+    """Return the body of a $group stage
+
+    >>> build_group_stage(['a'], [('b', 'set')]) == {
+    ...     '_id': {'k0': '$a'},
+    ...     '_count': {'$sum': 1},
+    ...     'c0': {'$addToSet': '$b'}}
+    True
+    >>> build_group_stage([], []) == {'_id': None, '_count': {'$sum': 1}}
+    True
+    """
+    stage = {
+        "_id": build_group_id(keys),
+        "_count": {"$sum": 1},
+    }
+    for index, (field, method) in enumerate(unique_collects(collect)):
+        accumulators = collect_accumulators(method)(field_path(field))
+        stage.update(
+            (collect_field_alias(index) + suffix, accumulator)
+            for suffix, accumulator in accumulators.items())
+
+    return stage
+
+
+def build_group_id(keys):
+    if not keys:
+        return None
+
+    return dict((group_key_alias(index), field_path(key))
+                for index, key in enumerate(keys))
+
+
+def count_where(condition):
+    return {"$sum": {"$cond": [condition, 1, 0]}}
+
+
+def is_present(path):
+    return {"$gt": [path, None]}
+
+
+def is_numeric(path):
+    # Numbers sort after null and before every string in BSON order
+    return {"$and": [{"$gt": [path, None]}, {"$lt": [path, ""]}]}
+
+
+def is_not_numeric(path):
+    return {"$gte": [path, ""]}
+
+
+def collect_accumulators(method):
+    """Return a function building the accumulators for a collect method
+
+    The function takes a field path and returns a dictionary of alias
+    suffix to $group accumulator.
+    """
+    try:
+        return globals()['collect_accumulators_{}'.format(method)]
+    except KeyError:
+        raise ValueError(
+            "Unknown collection method {}".format(method))
+
+
+def collect_accumulators_sum(path):
+    return {
+        "": {"$sum": path},
+        "_invalid": count_where(is_not_numeric(path)),
+    }
+
+
+def collect_accumulators_count(path):
+    return {
+        "": count_where(is_present(path)),
+    }
+
+
+def collect_accumulators_set(path):
+    return {
+        "": {"$addToSet": path},
+    }
+
+
+def collect_accumulators_mean(path):
+    return {
+        "": {"$sum": path},
+        "_values": count_where(is_numeric(path)),
+        "_invalid": count_where(is_not_numeric(path)),
+    }
+
+
+def read_partial(method, alias, result):
+    """Return the partial collect value for a method from a group result
+
+    sum: the sum of the values
+    count: the number of values
+    set: a list of the distinct values
+    mean: a tuple of the sum and the number of values
+    """
+    if result.get(alias + "_invalid"):
+        if method == "sum":
+            raise InvalidOperationError("Unable to sum that data")
+        raise InvalidOperationError("Unable to find the mean of that data")
+
+    if method == "mean":
+        return result[alias], result[alias + "_values"]
+
+    return result[alias]
+
+
+def unwrap_group_results(keys, collect, results):
+    """Map aggregation results back to the shape nested_merge expects"""
+    return [unwrap_group_result(keys, collect, result)
+            for result in results]
+
+
+def unwrap_group_result(keys, collect, result):
+    """Map a single aggregation result back to the original field names
+
+    >>> unwrap_group_result(['a'], [('b', 'sum')], {
+    ...     '_id': {'k0': 'foo'}, '_count': 2, 'c0': 3, 'c0_invalid': 0}) == {
+    ...     'a': 'foo', '_count': 2, 'b:sum': 3}
+    True
+    """
+    group_id = result["_id"] or {}
+
+    doc = dict((key, group_id.get(group_key_alias(index)))
+               for index, key in enumerate(keys))
+    doc["_count"] = result["_count"]
+    for index, (field, method) in enumerate(unique_collects(collect)):
+        doc[collect_key(field, method)] = read_partial(
+            method, collect_field_alias(index), result)
+
+    return doc
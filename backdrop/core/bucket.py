@@ -1,9 +1,15 @@
 from base64 import b64encode
 from collections import namedtuple
+from itertools import islice
 from flask import logging
 from backdrop.core import records
-from backdrop.core.errors import ValidationError
+from backdrop.core.database import BULK_SAVE_CHUNK_SIZE, BulkSaveError, \
+    Repository
+from backdrop.core.errors import ParseError, ValidationError
+from backdrop.core.indexes import index_spec_is_valid
+from backdrop.core.rollups import BucketRollups, rollup_spec_is_valid
 from backdrop.core.validation import bucket_is_valid
+from backdrop.core.versions import BucketVersions
 
 import timeutils
 import datetime
@@ -19,8 +25,13 @@ class Bucket(object):
         self.auto_id_keys = config.auto_ids
         self.config = config
         self.db = db
+        self.rollups = BucketRollups(db, config.name, config.rollups)
 
     def is_recent_enough(self):
+        return self.was_updated_recently(self.get_last_updated())
+
+    def was_updated_recently(self, last_updated):
+        """Return whether last_updated is within max_age_expected of now"""
         if self.config.max_age_expected is None:
             return True
 
@@ -28,7 +39,6 @@ class Bucket(object):
             seconds=self.config.max_age_expected)
 
         now = timeutils.now()
-        last_updated = self.get_last_updated()
 
         if not last_updated:
             return False
@@ -42,22 +52,100 @@ class Bucket(object):
         if last_updated.get('_updated_at') is not None:
             return timeutils.utc(last_updated.get('_updated_at'))
 
-    def parse_and_store(self, data):
-        log.info("received %s documents" % len(data))
-
+    def parse(self, data):
+        """Return the records in data, raising an error if any are invalid
+        """
         if self.auto_id_keys:
             data = [self._add_id(d) for d in data]
 
-        self.store(records.parse_all(data))
+        return records.parse_all(data)
+
+    def parse_and_store(self, data):
+        log.info("received %s documents" % len(data))
+
+        self.store(self.parse(data))
+
+    def parse_stream(self, data):
+        """Yield the records in an iterable of data one at a time
+
+        Errors give the number of the invalid datum, counting from 1.
+        """
+        for number, datum in enumerate(data, start=1):
+            try:
+                if self.auto_id_keys:
+                    datum = self._add_id(datum)
+                record = records.parse(datum)
+            except (ParseError, ValidationError) as e:
+                raise e.__class__(
+                    "Record {0} is invalid: {1}".format(number, e.message))
+            yield record
+
+    def store_stream(self, records, chunk_size=BULK_SAVE_CHUNK_SIZE):
+        """Store an iterable of records a chunk at a time
+
+        Only one chunk is held in memory at once. Returns the number of
+        records stored.
+        """
+        failures = []
+        count = 0
+        for chunk in _chunks(records, chunk_size):
+            try:
+                self.store(chunk)
+            except BulkSaveError as e:
+                failures += [(count + index, message)
+                             for index, message in e.failures]
+            count += len(chunk)
+
+        if failures:
+            raise BulkSaveError(failures)
+
+        log.info("stored %s documents" % count)
+        return count
 
     def store(self, records):
         if isinstance(records, list):
-            [self.repository.save(record.to_mongo()) for record in records]
+            docs = [record.to_mongo() for record in records]
         else:
-            self.repository.save(records.to_mongo())
-
-    def query(self, query):
-        result = query.execute(self.repository)
+            docs = [records.to_mongo()]
+
+        # Saving gives every document an _id, so split them up first
+        replaced = [doc for doc in docs if '_id' in doc]
+        inserted = [doc for doc in docs if '_id' not in doc]
+
+        try:
+            if isinstance(records, list):
+                updated_at = self.repository.save_all(docs)
+            else:
+                updated_at = self.repository.save(docs[0])
+        except BulkSaveError:
+            # Some documents were saved, recompute from what is there and
+            # invalidate anything derived from the data before the write
+            self._stored([], docs, docs[0].get('_updated_at'))
+            raise
+
+        self._stored(inserted, replaced, updated_at)
+
+    def _stored(self, inserted, replaced, updated_at):
+        """Update the rollups and bump the version after records are stored
+
+        The version is bumped even if the rollups fail to update, as the
+        records are stored and anything cached from before is out of date.
+        It is bumped last so nothing is cached under it from rollups that
+        are not yet updated.
+        """
+        try:
+            self.rollups.update(inserted, replaced)
+        finally:
+            BucketVersions(self.db).bump(self.name, updated_at)
+
+    def query(self, query, stream=False):
+        repository = self.repository
+
+        rollup_driver = self.rollups.driver_for(query)
+        if rollup_driver is not None:
+            repository = Repository(rollup_driver)
+
+        result = query.execute(repository, stream=stream)
 
         return result
 
@@ -75,10 +163,19 @@ class Bucket(object):
         return b64encode(".".join([datum[key] for key in self.auto_id_keys]))
 
 
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
 _BucketConfig = namedtuple(
     "_BucketConfig",
     "name data_group data_type raw_queries_allowed bearer_token upload_format "
-    "upload_filters auto_ids queryable realtime capped_size max_age_expected")
+    "upload_filters auto_ids queryable realtime capped_size max_age_expected "
+    "indexes rollups")
 
 
 class BucketConfig(_BucketConfig):
@@ -86,10 +183,19 @@ class BucketConfig(_BucketConfig):
     def __new__(cls, name, data_group, data_type, raw_queries_allowed=False,
                 bearer_token=None, upload_format="csv", upload_filters=None,
                 auto_ids=None, queryable=True, realtime=False,
-                capped_size=5040, max_age_expected=2678400):
+                capped_size=5040, max_age_expected=2678400, indexes=None,
+                rollups=None):
         if not bucket_is_valid(name):
             raise ValueError("Bucket name is not valid: '{}'".format(name))
 
+        if indexes is not None and not all(map(index_spec_is_valid, indexes)):
+            raise ValueError("indexes must be a list of lists of "
+                             "[field, direction] pairs")
+
+        if rollups is not None and not all(map(rollup_spec_is_valid, rollups)):
+            raise ValueError("rollups must be a list of rollup specs with a "
+                             "period and optional group_by and fields")
+
         if upload_filters is None:
             upload_filters = [
                 "backdrop.core.upload.filters.first_sheet_filter"]
@@ -100,7 +206,8 @@ class BucketConfig(_BucketConfig):
                                                 bearer_token, upload_format,
                                                 upload_filters, auto_ids,
                                                 queryable, realtime,
-                                                capped_size, max_age_expected)
+                                                capped_size, max_age_expected,
+                                                indexes, rollups)
 
     @property
     def max_age(self):
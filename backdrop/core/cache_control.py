@@ -27,7 +27,10 @@ def etag(func):
     @wraps(func)
     def new_func(*args, **kwargs):
         resp = make_response(func(*args, **kwargs))
-        resp.set_etag(hashlib.sha1(resp.data).hexdigest())
+        etag, _ = resp.get_etag()
+        # Hashing a streamed body would read it all into memory
+        if etag is None and not resp.is_streamed:
+            resp.set_etag(hashlib.sha1(resp.data).hexdigest())
         resp.make_conditional(request)
         return resp
 
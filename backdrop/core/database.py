@@ -1,16 +1,57 @@
+import heapq
 import logging
 import os
-from bson import Code
+from operator import itemgetter
 import pymongo
-from pymongo.errors import AutoReconnect
+from pymongo.errors import AutoReconnect, BulkWriteError
 from backdrop import statsd
-from backdrop.core import timeutils
+from backdrop.core import phases, timeutils
+from backdrop.core.aggregation import build_group_pipeline, \
+    unwrap_group_results
 from backdrop.core.nested_merge import nested_merge, InvalidOperationError
+from backdrop.core.pagination import after_cursor
+
+# Number of documents sent to mongo in a single bulk write
+BULK_SAVE_CHUNK_SIZE = 1000
+
+# Collect methods that cannot fail for groups left out by a limit
+SORT_SAFE_COLLECT_METHODS = ["count", "set", "default"]
+
+# App config settings and the mongo client options they set
+CLIENT_OPTIONS = {
+    'MONGO_SECONDARY_ACCEPTABLE_LATENCY_MS': 'secondary_acceptable_latency_ms',
+    'MONGO_MAX_POOL_SIZE': 'max_pool_size',
+    'MONGO_CONNECT_TIMEOUT_MS': 'connectTimeoutMS',
+    'MONGO_SOCKET_TIMEOUT_MS': 'socketTimeoutMS',
+}
+
+
+def mongo_client_options(config):
+    """Return the mongo client options set in an app config
+
+    MONGO_READ_PREFERENCE is the name of a pymongo read preference, eg.
+    secondary_preferred to spread reads across the replica set.
+    """
+    options = dict((option, config[setting])
+                   for setting, option in CLIENT_OPTIONS.items()
+                   if config.get(setting) is not None)
+
+    read_preference = config.get('MONGO_READ_PREFERENCE')
+    if read_preference is not None:
+        try:
+            options['read_preference'] = getattr(
+                pymongo.ReadPreference, read_preference.upper())
+        except AttributeError:
+            raise ValueError(
+                "Unknown read preference {0}".format(read_preference))
+
+    return options
 
 
 class Database(object):
 
-    def __init__(self, hosts, port, name):
+    def __init__(self, hosts, port, name, client_options=None):
+        self._client_options = client_options or {}
         self._mongo = self.get_client(hosts, port)
         self.name = name
 
@@ -34,10 +75,10 @@ class Database(object):
         replica_set = os.getenv('MONGO_REPLICA_SET', 'production')
 
         if replica_set == '':
-            return pymongo.MongoClient(client_list)
+            return pymongo.MongoClient(client_list, **self._client_options)
         else:
             return pymongo.MongoReplicaSetClient(
-                client_list, replicaSet=replica_set)
+                client_list, replicaSet=replica_set, **self._client_options)
 
     def _client_list(self, hosts, port):
         return ','.join('{}:{}'.format(host, port) for host in hosts)
@@ -45,6 +86,30 @@ class Database(object):
     def alive(self):
         return self._mongo.alive()
 
+    def pool_stats(self):
+        """Return the idle and maximum connections to each member
+
+        pymongo 2.x does not make its connection pools public, so they are
+        found in the client's private state. Nothing is returned if that is
+        not there.
+        """
+        return [{
+            "host": "{0}:{1}".format(*member.host),
+            "idle": len(member.pool.sockets),
+            "max_size": member.pool.max_size,
+        } for member in _client_members(self._mongo)]
+
+    @property
+    def reads_from_secondaries(self):
+        """Whether reads may be answered by a secondary, which can be behind
+
+        Data read from a secondary may be older than a bucket version read
+        from another member, so it must not be cached under the version.
+        """
+        read_preference = self._client_options.get(
+            'read_preference', pymongo.ReadPreference.PRIMARY)
+        return read_preference != pymongo.ReadPreference.PRIMARY
+
     def get_repository(self, bucket_name):
         return Repository(self.get_collection(bucket_name))
 
@@ -72,6 +137,27 @@ class Database(object):
         return self._mongo[self.name]
 
 
+def _client_members(client):
+    rs_state = getattr(client, '_MongoReplicaSetClient__rs_state', None)
+    if rs_state is not None:
+        return sorted(rs_state.members, key=lambda member: member.host)
+
+    member = getattr(client, '_MongoClient__member', None)
+    return [member] if member is not None else []
+
+
+def report_pool_stats(db, app_name):
+    """Send the connection pool stats of a database to statsd"""
+    stats = db.pool_stats()
+    for stat in stats:
+        prefix = "db.pool.{0}".format(
+            stat["host"].replace(".", "_").replace(":", "_"))
+        statsd.gauge(prefix + ".idle", stat["idle"], bucket=app_name)
+        statsd.gauge(prefix + ".max_size", stat["max_size"] or 0,
+                     bucket=app_name)
+    return stats
+
+
 class MongoDriver(object):
 
     def __init__(self, collection):
@@ -82,7 +168,12 @@ class MongoDriver(object):
         }
 
     def _parse_sort(self, sort):
+        """Turn a [key, direction] pair, or a list of them, into a mongo sort
+        """
         if sort:
+            if isinstance(sort[0], (list, tuple)):
+                return sum([self._parse_sort(pair) for pair in sort], [])
+
             key, direction = sort
 
             if direction not in self.sort_options.keys():
@@ -96,9 +187,10 @@ class MongoDriver(object):
             sort=self._parse_sort(sort),
             limit=limit or 0)
 
-    def find(self, query=None, sort=None, limit=0):
+    def find(self, query=None, sort=None, limit=0, fields=None):
         return self._collection.find(
             query,
+            fields=fields,
             sort=self._parse_sort(sort),
             limit=limit or 0)
 
@@ -108,38 +200,50 @@ class MongoDriver(object):
                 query[key] = {"$ne": None}
         return query
 
-    def group(self, keys, query, collect_fields):
-        return self._collection.group(
-            key=keys,
-            condition=self._ignore_docs_without_grouping_keys(keys, query),
-            initial=self._build_accumulator_initial_state(collect_fields),
-            reduce=self._build_reducer_function(collect_fields)
-        )
-
-    def _build_collector_code(self, collect_fields):
-        template = "if (current['{c}'] !== undefined) " \
-                   "{{ previous['{c}'].push(current['{c}']); }}"
-        code = [template.format(c=self._clean_collect_field(collect_field))
-                for collect_field in collect_fields]
-        return "\n".join(code)
-
-    def _clean_collect_field(self, collect_field):
-        return collect_field.replace('\\', '\\\\').replace("'", "\\'")
-
-    def _build_accumulator_initial_state(self, collect_fields):
-        initial = {'_count': 0}
-        for collect_field in collect_fields:
-            initial.update({collect_field: []})
-        return initial
-
-    def _build_reducer_function(self, collect_fields):
-        reducer_skeleton = "function (current, previous)" + \
-                           "{{ previous._count++; {collectors} }}"
-        reducer_code = reducer_skeleton.format(
-            collectors=self._build_collector_code(collect_fields)
-        )
-        reducer = Code(reducer_code)
-        return reducer
+    def group(self, keys, query, collect, sort=None, limit=None):
+        pipeline = build_group_pipeline(
+            keys,
+            self._ignore_docs_without_grouping_keys(keys, query),
+            collect,
+            sort,
+            limit)
+
+        return unwrap_group_results(keys, collect, self.aggregate(pipeline))
+
+    def aggregate(self, pipeline):
+        return self._collection.aggregate(
+            pipeline, cursor={}, allowDiskUse=True)
+
+    def update(self, query, update, upsert=False):
+        return self._collection.update(query, update, upsert=upsert)
+
+    def update_all(self, updates, upsert=False):
+        """Apply a list of (query, update) tuples in a single round trip"""
+        if not updates:
+            return
+
+        bulk = self._collection.initialize_unordered_bulk_op()
+        for query, update in updates:
+            if upsert:
+                bulk.find(query).upsert().update_one(update)
+            else:
+                bulk.find(query).update_one(update)
+        bulk.execute()
+
+    def remove(self, query):
+        return self._collection.remove(query)
+
+    def index_keys(self):
+        """Return the keys of every index except the one on _id"""
+        return [index['key'] for name, index
+                in self._collection.index_information().items()
+                if name != '_id_']
+
+    def create_index(self, keys):
+        return self._collection.create_index(keys, background=True)
+
+    def drop_index(self, keys):
+        self._collection.drop_index(keys)
 
     def save(self, obj, tries=3):
         try:
@@ -152,6 +256,60 @@ class MongoDriver(object):
             else:
                 raise
 
+    def save_all(self, objs, chunk_size=BULK_SAVE_CHUNK_SIZE):
+        """Save a list of documents using as few round trips as possible
+
+        Documents with an _id replace any existing document with that _id,
+        documents without one are inserted. Raises a BulkSaveError listing
+        every document that could not be saved.
+        """
+        failures = []
+        for offset in range(0, len(objs), chunk_size):
+            chunk = objs[offset:offset + chunk_size]
+            failures += [(offset + index, message)
+                         for index, message in self._save_chunk(chunk)]
+
+        if failures:
+            raise BulkSaveError(failures)
+
+    def _save_chunk(self, objs, tries=3):
+        """Save a chunk of documents, return (index, message) failures
+
+        An unordered bulk op may apply its writes in any order, so of the
+        documents sharing an _id only the last is sent. That is the one
+        saving them one at a time would have left.
+        """
+        last = dict((obj['_id'], index)
+                    for index, obj in enumerate(objs) if '_id' in obj)
+        indexes = [index for index, obj in enumerate(objs)
+                   if '_id' not in obj or last[obj['_id']] == index]
+
+        bulk = self._collection.initialize_unordered_bulk_op()
+        for obj in (objs[index] for index in indexes):
+            if '_id' in obj:
+                bulk.find({'_id': obj['_id']}).upsert().replace_one(obj)
+            else:
+                bulk.insert(obj)
+
+        try:
+            bulk.execute()
+        except AutoReconnect:
+            logging.warning("AutoReconnect on bulk save")
+            statsd.incr("db.AutoReconnect", bucket=self._collection.name)
+            if tries > 1:
+                # inserted documents have been given an _id, so retrying
+                # turns them into upserts rather than duplicating them
+                return self._save_chunk(objs, tries - 1)
+            else:
+                raise
+        except BulkWriteError as e:
+            if e.details.get('writeConcernErrors'):
+                raise
+            return [(indexes[error['index']], error['errmsg'])
+                    for error in e.details['writeErrors']]
+
+        return []
+
 
 class Repository(object):
 
@@ -174,9 +332,21 @@ class Repository(object):
         is_class = hasattr(query, 'to_mongo_query')
         mongo_query = query.to_mongo_query() if is_class else query
 
+        if is_class and query.is_paginated:
+            # Break ties on _id so pages follow on from each other exactly
+            sort = [sort, ["_id", sort[1]]]
+            if query.cursor:
+                mongo_query = {"$and": [
+                    mongo_query, after_cursor(query.cursor, sort[0][1])]}
+
+        if is_class and query.projection:
+            return self._mongo_driver.find(mongo_query, sort, limit,
+                                           fields=query.projection)
+
         return self._mongo_driver.find(mongo_query, sort, limit)
 
-    def group(self, group_by, query, sort=None, limit=None, collect=None):
+    def group(self, group_by, query, sort=None, limit=None, collect=None,
+              rows_filter=None):
         if sort:
             self._validate_sort(sort)
         return self._group(
@@ -184,14 +354,26 @@ class Repository(object):
             query.to_mongo_query(),
             sort,
             limit,
-            collect or [])
+            collect or [],
+            rows_filter)
 
     def save(self, obj):
-        obj['_updated_at'] = timeutils.now()
+        """Save a document and return the _updated_at it was given"""
+        updated_at = timeutils.now()
+        obj['_updated_at'] = updated_at
         self._mongo_driver.save(obj)
+        return updated_at
+
+    def save_all(self, objs):
+        """Save documents and return the _updated_at they were given"""
+        updated_at = timeutils.now()
+        for obj in objs:
+            obj['_updated_at'] = updated_at
+        self._mongo_driver.save_all(objs)
+        return updated_at
 
     def multi_group(self, key1, key2, query,
-                    sort=None, limit=None, collect=None):
+                    sort=None, limit=None, collect=None, rows_filter=None):
         if key1 == key2:
             raise GroupingError("Cannot group on two equal keys")
         results = self._group(
@@ -199,7 +381,8 @@ class Repository(object):
             query.to_mongo_query(),
             sort,
             limit,
-            collect or [])
+            collect or [],
+            rows_filter)
 
         return results
 
@@ -209,31 +392,83 @@ class Repository(object):
                 query[key] = {"$ne": None}
         return query
 
-    def _group(self, keys, query, sort=None, limit=None, collect=None):
-        collect_fields = unique_collect_fields(collect)
-        results = self._mongo_driver.group(keys, query, list(collect_fields))
+    def _group(self, keys, query, sort=None, limit=None, collect=None,
+               rows_filter=None):
+        """Group documents by keys and merge the results
 
-        results = nested_merge(keys, collect, results)
+        rows_filter is given the rows grouped by the database and returns
+        the ones to merge.
+        """
+        with phases.timed("mongo"):
+            if rows_filter is None and top_groups_in_database(
+                    keys, sort, limit, collect):
+                results = self._mongo_driver.group(keys, query, collect,
+                                                   sort=sort, limit=limit)
+            else:
+                results = self._mongo_driver.group(keys, query, collect)
 
-        if sort:
-            sorters = {
-                "ascending": lambda a, b: cmp(a, b),
-                "descending": lambda a, b: cmp(b, a)
-            }
-            sorter = sorters[sort[1]]
-            try:
-                results.sort(cmp=sorter, key=lambda a: a[sort[0]])
-            except KeyError:
-                raise InvalidSortError('Invalid sort key {0}'.format(sort[0]))
-        if limit:
-            results = results[:limit]
+        with phases.timed("merge"):
+            if rows_filter is not None:
+                results = rows_filter(results)
 
-        return results
+            results = nested_merge(keys, collect, results)
 
+            if sort:
+                return top_groups(results, sort, limit)
+            if limit:
+                results = results[:limit]
 
-def unique_collect_fields(collect):
-    """Return the unique set of field names to collect."""
-    return set([collect_field for collect_field, _ in collect])
+            return results
+
+
+def top_groups_in_database(keys, sort, limit, collect):
+    """Return whether the database can pick the groups a query returns
+
+    Only single level groups sorted by _count are picked by the database.
+    Every group is read when a sum or mean is collected, as any group
+    could hold a value that makes the query invalid.
+    """
+    return (len(keys) == 1 and
+            bool(sort) and sort[0] == "_count" and
+            bool(limit) and
+            all(method in SORT_SAFE_COLLECT_METHODS for _, method in collect))
+
+
+def top_groups(results, sort, limit=None):
+    """Return the groups sorted by a [key, direction] pair
+
+    Only the first limit groups are kept, which are selected with a heap
+    rather than by sorting every group. Groups that tie keep their order.
+    """
+    if sort[1] not in ("ascending", "descending"):
+        raise InvalidSortError(sort[1])
+
+    key = itemgetter(sort[0])
+    try:
+        if not limit:
+            return sorted(results, key=key,
+                          reverse=(sort[1] == "descending"))
+        elif sort[1] == "descending":
+            return heapq.nlargest(limit, results, key=key)
+        else:
+            return heapq.nsmallest(limit, results, key=key)
+    except KeyError:
+        raise InvalidSortError('Invalid sort key {0}'.format(sort[0]))
+
+
+class BulkSaveError(StandardError):
+    """Raised when some documents in a bulk save could not be written
+
+    failures is a list of (index, message) tuples, where index is the
+    position of the failed document in the list passed to save_all.
+    """
+    def __init__(self, failures):
+        self.failures = failures
+        self.message = "{0} records could not be saved: {1}".format(
+            len(failures),
+            ", ".join("record {0} ({1})".format(index, message)
+                      for index, message in failures))
+        super(BulkSaveError, self).__init__(self.message)
 
 
 class GroupingError(ValueError):
@@ -0,0 +1,230 @@
+"""
+Index management for bucket collections
+
+Buckets declare the indexes they need in their config; reconcile_indexes
+creates any that are missing. The read api samples the shape of the queries
+each bucket receives so that suggest_indexes can recommend compound indexes
+for them.
+"""
+from collections import namedtuple
+import logging
+import random
+
+import pymongo
+
+
+log = logging.getLogger(__name__)
+
+# Every bucket is filtered on _timestamp, paged through by _timestamp and
+# _id, and checked for freshness by sorting on _updated_at
+DEFAULT_INDEXES = [
+    [["_timestamp", pymongo.ASCENDING], ["_id", pymongo.ASCENDING]],
+    [["_updated_at", pymongo.DESCENDING]],
+]
+
+QUERY_SHAPES_COLLECTION = "query_shapes"
+
+
+def index_spec_is_valid(spec):
+    """Return whether a spec is a list of [field, direction] pairs
+
+    >>> index_spec_is_valid([["_timestamp", 1], ["service", -1]])
+    True
+    >>> index_spec_is_valid([["_timestamp", "up"]])
+    False
+    >>> index_spec_is_valid([])
+    False
+    """
+    if not isinstance(spec, (list, tuple)) or len(spec) == 0:
+        return False
+
+    return all(isinstance(pair, (list, tuple)) and len(pair) == 2
+               and isinstance(pair[0], basestring)
+               and pair[1] in (pymongo.ASCENDING, pymongo.DESCENDING)
+               for pair in spec)
+
+
+def normalise_spec(spec):
+    """Return an index spec as a hashable tuple of (field, direction)
+
+    >>> normalise_spec([["a", 1], ["b", -1.0]])
+    (('a', 1), ('b', -1))
+    """
+    return tuple(
+        (field, direction if isinstance(direction, basestring)
+            else int(direction))
+        for field, direction in spec)
+
+
+def bucket_indexes(bucket_config):
+    """Return the normalised index specs a bucket should have"""
+    specs = []
+    for spec in DEFAULT_INDEXES + list(bucket_config.indexes or []):
+        spec = normalise_spec(spec)
+        if spec not in specs:
+            specs.append(spec)
+    return specs
+
+
+def reconcile_indexes(mongo_driver, specs, prune=False):
+    """Create the indexes in specs that do not exist on a collection
+
+    If prune is set, indexes that are not in specs are dropped.
+    Returns a tuple of the created and dropped specs.
+    """
+    existing = [normalise_spec(keys) for keys in mongo_driver.index_keys()]
+
+    created = [spec for spec in specs if spec not in existing]
+    for spec in created:
+        log.info("Creating index {0}".format(spec))
+        mongo_driver.create_index(list(spec))
+
+    dropped = []
+    if prune:
+        dropped = [spec for spec in existing if spec not in specs]
+        for spec in dropped:
+            log.info("Dropping index {0}".format(spec))
+            mongo_driver.drop_index(list(spec))
+
+    return created, dropped
+
+
+_QueryShape = namedtuple("_QueryShape", "equality sort range group")
+
+
+class QueryShape(_QueryShape):
+    """The fields a query filters on, sorts by, selects a range of and
+    groups by"""
+
+    @classmethod
+    def from_query(cls, query):
+        equality = tuple(sorted(key for key, _ in query.filter_by))
+
+        sort = None
+        if not query.group_by and not query.period:
+            sort = tuple(query.sort_by or ["_timestamp", "ascending"])
+
+        time_range = ()
+        if query.start_at or query.end_at:
+            time_range = ("_timestamp",)
+
+        group = ()
+        if query.group_by:
+            group += (query.group_by,)
+        if query.period:
+            group += (query.period.start_at_key,)
+
+        return cls(equality, sort, time_range, group)
+
+    @property
+    def key(self):
+        sort = ":".join(self.sort) if self.sort else ""
+        return "|".join([",".join(self.equality), sort,
+                         ",".join(self.range), ",".join(self.group)])
+
+    def index_spec(self):
+        """Return an index supporting this shape
+
+        Fields are ordered equality first, then sort, then range, which
+        lets mongo use a single index for matching and sorting. The group
+        keys come last, so grouping reads them from the index.
+
+        >>> QueryShape(('service',), ('_timestamp', 'descending'),
+        ...            ('_timestamp',), ()).index_spec()
+        (('service', 1), ('_timestamp', -1))
+        >>> QueryShape(('service',), None, ('_timestamp',),
+        ...            ('channel',)).index_spec()
+        (('service', 1), ('_timestamp', 1), ('channel', 1))
+        """
+        spec = [(field, pymongo.ASCENDING) for field in self.equality]
+        if self.sort:
+            field, direction = self.sort
+            spec.append((field, pymongo.DESCENDING
+                         if direction == "descending"
+                         else pymongo.ASCENDING))
+        spec += [(field, pymongo.ASCENDING) for field in self.range]
+        spec += [(field, pymongo.ASCENDING) for field in self.group]
+
+        unique = []
+        for field, direction in spec:
+            if field not in [f for f, _ in unique]:
+                unique.append((field, direction))
+        return tuple(unique)
+
+
+def _fields(spec):
+    return [field for field, _ in spec]
+
+
+def _is_prefix(spec, other):
+    return _fields(other)[:len(spec)] == _fields(spec)
+
+
+def suggest_indexes(shape_counts, existing_specs):
+    """Return suggested index specs with the number of queries they serve
+
+    shape_counts: a list of (QueryShape, count) tuples
+    existing_specs: the index specs that already exist on the collection
+
+    Shapes already served by a prefix of an existing index are skipped and
+    suggestions that are a prefix of another suggestion are merged into it.
+    Suggestions are ordered by the number of queries they serve.
+    """
+    candidates = {}
+    for shape, count in shape_counts:
+        spec = shape.index_spec()
+        if not spec:
+            continue
+        if any(_is_prefix(spec, existing) for existing in existing_specs):
+            continue
+        candidates[spec] = candidates.get(spec, 0) + count
+
+    suggestions = []
+    for spec, count in sorted(candidates.items(),
+                              key=lambda item: -len(item[0])):
+        covering = next((suggestion for suggestion in suggestions
+                         if _is_prefix(spec, suggestion[0])), None)
+        if covering is not None:
+            covering[1] += count
+        else:
+            suggestions.append([spec, count])
+
+    return sorted([tuple(suggestion) for suggestion in suggestions],
+                  key=lambda item: -item[1])
+
+
+class QueryShapeRecorder(object):
+    """Count a sample of the query shapes each bucket receives"""
+
+    def __init__(self, db, sample_rate):
+        self._collection = db.get_collection(QUERY_SHAPES_COLLECTION)
+        self.sample_rate = sample_rate
+
+    def record(self, bucket_name, query):
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return
+
+        shape = QueryShape.from_query(query)
+        self._collection.update(
+            {"_id": "{0}/{1}".format(bucket_name, shape.key)},
+            {
+                "$set": {
+                    "bucket": bucket_name,
+                    "equality": list(shape.equality),
+                    "sort": list(shape.sort) if shape.sort else None,
+                    "range": list(shape.range),
+                    "group": list(shape.group),
+                },
+                "$inc": {"count": 1},
+            },
+            upsert=True)
+
+    def shapes(self, bucket_name):
+        """Return a list of (QueryShape, count) tuples for a bucket"""
+        return [
+            (QueryShape(tuple(doc["equality"]),
+                        tuple(doc["sort"]) if doc["sort"] else None,
+                        tuple(doc["range"]),
+                        tuple(doc["group"])),
+             doc["count"])
+            for doc in self._collection.find({"bucket": bucket_name})]
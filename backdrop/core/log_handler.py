@@ -1,7 +1,7 @@
 from logging import FileHandler
 from logstash_formatter import LogstashFormatter
 import logging
-from flask import request
+from flask import g, request
 
 
 def get_log_file_handler(path, log_level=logging.DEBUG):
@@ -42,10 +42,13 @@ def create_request_logger(app):
 
 def create_response_logger(app):
     def log_response(response):
+        # Apps that time the phases of a request keep the timer in g
+        timer = getattr(g, 'phase_timer', None)
         app.logger.info(
             "response: %s - %s - %s" % (
                 request.method, request.url, response.status
-            )
+            ),
+            extra={'phases': timer.summary()} if timer else {}
         )
         return response
     return log_response
@@ -1,16 +1,22 @@
-from operator import itemgetter, add
+from operator import itemgetter
 import itertools
 
 
 def nested_merge(keys, collect, data):
+    """Merge the rows returned by MongoDriver.group into nested groups
+
+    Each level of groups is built in a single pass over its rows and the
+    partial collect values of every group are combined in one pass up the
+    tree. Rows and groups are changed in place rather than copied. Groups
+    are sorted by their key.
+    """
     if len(keys) > 1:
         data = group_by(data, keys)
         data = apply_counts(data)
+    else:
+        data = sorted(data, key=itemgetter(keys[0]))
 
-    data = apply_collect(data, collect)
-    data = sort_all(data, keys)
-
-    return data
+    return apply_collect(data, collect)
 
 
 def group_by(data, keys):
@@ -18,45 +24,56 @@ def group_by(data, keys):
 
     data: a list of dictionaries as returned by MongoDriver.group
     keys: a list of keys to group by
+
+    The keys are removed from the rows as they are grouped.
     """
     key = keys[0]
-    getter = itemgetter(key)
-    data = sorted(data, key=getter)
-    if len(keys) > 1:
-        data = [
-            {
-                key: value,
-                "_subgroup": group_by(
-                    remove_key_from_all(subgroups, key),
-                    keys[1:]
-                )
-            }
-            for value, subgroups in itertools.groupby(data, getter)
-        ]
-    return data
-
-
-def remove_key_from_all(groups, key):
-    """Remove a key from each group in a list of groups
+    if len(keys) == 1:
+        return sorted(data, key=itemgetter(key))
 
-    groups: a list of groups (dictionaries)
-    key: the key to remove
-    """
-    return [remove_key(group, key) for group in groups]
+    try:
+        groups = _hash_groups(data, key)
+    except TypeError:
+        # Values that cannot be hashed, eg. arrays, are grouped by sorting
+        groups = _sorted_groups(data, key)
 
+    for _, rows in groups:
+        for row in rows:
+            del row[key]
+
+    return [
+        {
+            key: value,
+            "_subgroup": group_by(rows, keys[1:])
+        }
+        for value, rows in groups
+    ]
 
-def remove_key(doc, key):
-    """Return a new document with the key removed
 
-    >>> doc = {'a':1, 'b':2}
-    >>> remove_key(doc, 'a')
-    {'b': 2}
-    >>> # Show that the original document is not affected
-    >>> doc['a']
-    1
+def _hash_groups(data, key):
+    """Return sorted (value, rows) tuples for the values of a key
+
+    Rows keep their order within a group and each group takes the value
+    of its first row.
     """
-    return dict(
-        (k, v) for k, v in doc.items() if k != key)
+    groups = {}
+    values = []
+    for row in data:
+        value = row[key]
+        rows = groups.get(value)
+        if rows is None:
+            rows = groups[value] = []
+            values.append(value)
+        rows.append(row)
+
+    values.sort()
+    return [(value, groups[value]) for value in values]
+
+
+def _sorted_groups(data, key):
+    getter = itemgetter(key)
+    return [(value, list(rows)) for value, rows
+            in itertools.groupby(sorted(data, key=getter), getter)]
 
 
 def apply_counts(groups):
@@ -83,32 +100,55 @@ def apply_collect(groups, collect):
     groups: a list of groups (dictionaries)
     collect: a list of collect fields, each being a tuple of field name and
              collection method
+
+    The partial collect values of each group are replaced by final values
+    in place. The partial values of a group with subgroups are combined
+    from the partial values of its subgroups.
     """
-    return [
-        apply_collect_to_group(group, collect)
-        for group in groups
-    ]
+    collectors = _collectors(collect)
+    for group in groups:
+        _collect_group(group, collectors)
+    return groups
 
 
-def apply_collect_to_group(group, collect):
-    group = group.copy()
-    # calculate collected values
-    for key, method in collect:
-        group[collect_key(key, method)] = collect_value(group, key, method)
+def _collectors(collect):
+    """Return (field, method, collect key, reducer) tuples for collect"""
+    return [(key, method, collect_key(key, method), collect_reducer(method))
+            for key, method in collect]
 
-    # apply collect to subgroups
-    if '_subgroup' in group:
-        group['_subgroup'] = apply_collect(group['_subgroup'], collect)
 
-    # remove left over collect keys
-    for key, _ in collect:
-        group = remove_key(group, key)
+def _collect_group(group, collectors):
+    """Collect a group and its subgroups, returning their partial values
+
+    The partial values are a dictionary of every partial value under the
+    group for each collect key, so that the groups above it do not need
+    to walk the tree again.
+    """
+    partials = None
+    if '_subgroup' in group:
+        partials = {}
+        for subgroup in group['_subgroup']:
+            subgroup_partials = _collect_group(subgroup, collectors)
+            for partial_key, values in subgroup_partials.iteritems():
+                partials.setdefault(partial_key, []).extend(values)
+
+    own = {}
+    for _, _, partial_key, _ in collectors:
+        if partial_key in group:
+            own[partial_key] = [group[partial_key]]
+        elif partials is not None:
+            own[partial_key] = partials.get(partial_key, [])
+        else:
+            own[partial_key] = None
+
+    for _, _, partial_key, reducer in collectors:
+        group[partial_key] = reducer(own[partial_key])
 
     # Hack in the old way
-    for key, method in collect:
+    for key, method, partial_key, _ in collectors:
         if method == 'default':
-            group[key] = group[collect_key(key, method)]
-    return group
+            group[key] = group[partial_key]
+    return own
 
 
 def replace_default_method(method):
@@ -126,22 +166,8 @@ def collect_key(key, method):
     return '{0}:{1}'.format(key, replace_default_method(method))
 
 
-def collect_value(group, key, method):
-    reducer = collect_reducer(method)
-    return reducer(collect_all_values(group, key))
-
-
-def collect_all_values(group, key):
-    if key in group:
-        return group[key]
-    elif '_subgroup' in group:
-        _subgroup = [
-            collect_all_values(sub, key) for sub in group['_subgroup']]
-        return reduce(add, _subgroup)
-
-
 def collect_reducer(method):
-    """Return a collector function to be applied over a list of values"""
+    """Return a function combining a list of partial values"""
     method = replace_default_method(method)
     try:
         return globals()['collect_reducer_{}'.format(method)]
@@ -151,60 +177,45 @@ def collect_reducer(method):
 
 
 def collect_reducer_sum(values):
-    """Return the sum of all values
+    """Return the sum of partial sums
 
     >>> collect_reducer_sum([2, 5, 8])
     15
-    >>> collect_reducer_sum(['sum', 'this'])
-    Traceback (most recent call last):
-        ...
-    InvalidOperationError: Unable to sum that data
     """
-    try:
-        return sum(values)
-    except TypeError:
-        raise InvalidOperationError("Unable to sum that data")
+    return sum(values)
 
 
 def collect_reducer_count(values):
-    """Return the number of values
+    """Return the total of partial counts
 
-    >>> collect_reducer_count(['Sheep', 'Elephant', 'Wolf', 'Dog'])
-    4
+    >>> collect_reducer_count([4, 1])
+    5
     """
-    return len(values)
+    return sum(values)
 
 
 def collect_reducer_set(values):
-    """Return the set of values
+    """Return the union of partial sets
 
-    >>> collect_reducer_set(['Badger', 'Badger', 'Badger', 'Snake'])
+    >>> collect_reducer_set([['Badger', 'Snake'], ['Badger']])
     ['Badger', 'Snake']
     """
-    return sorted(list(set(values)))
+    return sorted(set(itertools.chain.from_iterable(values)))
 
 
 def collect_reducer_mean(values):
-    """Return the mean of numeric values
+    """Return the mean given partial (sum, number of values) tuples
 
-    >>> collect_reducer_mean([13, 19, 15, 2])
+    >>> collect_reducer_mean([(32, 3), (17, 1)])
     12.25
-    >>> collect_reducer_mean(['average', 'this'])
-    Traceback (most recent call last):
-        ...
-    InvalidOperationError: Unable to find the mean of that data
+    >>> collect_reducer_mean([(0, 0)]) is None
+    True
     """
-    try:
-        return sum(values) / float(len(values))
-    except TypeError:
-        raise InvalidOperationError("Unable to find the mean of that data")
-
-
-def sort_all(data, keys):
-    if len(keys) > 1:
-        for i, group in enumerate(data):
-            data[i]['_subgroup'] = sort_all(group['_subgroup'], keys[1:])
-    return sorted(data, key=itemgetter(keys[0]))
+    total = sum(value_sum for value_sum, _ in values)
+    count = sum(value_count for _, value_count in values)
+    if count == 0:
+        return None
+    return total / float(count)
 
 
 class InvalidOperationError(TypeError):
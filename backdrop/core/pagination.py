@@ -0,0 +1,101 @@
+"""
+Keyset pagination of raw queries
+
+A page of a raw query sorted by _timestamp ends with a cursor built from
+the _timestamp and _id of its last document. The next page is read with a
+range predicate on (_timestamp, _id), which the default index on those
+fields answers directly however deep into the bucket the page is.
+"""
+import base64
+import json
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from backdrop.core.timeutils import parse_time_as_utc
+
+# BSON type numbers, ids are either strings or ObjectIds and strings sort
+# before ObjectIds
+BSON_STRING = 2
+BSON_OBJECT_ID = 7
+
+
+class CursorError(ValueError):
+    pass
+
+
+def encode_cursor(document):
+    """Return an opaque cursor for the position after a document
+
+    >>> decode_cursor(encode_cursor({"_id": "abc"}))
+    (None, u'abc')
+    """
+    timestamp = document.get("_timestamp")
+    _id = document["_id"]
+
+    position = [
+        timestamp.isoformat() if timestamp is not None else None,
+        {"oid": str(_id)} if isinstance(_id, ObjectId) else _id,
+    ]
+    encoded = base64.urlsafe_b64encode(
+        json.dumps(position, separators=(',', ':')))
+    # Padding would have to be escaped in a query string
+    return encoded.rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Return the (_timestamp, _id) tuple a cursor was built from
+
+    >>> decode_cursor("not a cursor")
+    Traceback (most recent call last):
+        ...
+    CursorError: Invalid cursor
+    """
+    try:
+        cursor = str(cursor)
+        padding = "=" * (-len(cursor) % 4)
+        timestamp, _id = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        if timestamp is not None:
+            timestamp = parse_time_as_utc(timestamp)
+        if isinstance(_id, dict):
+            _id = ObjectId(_id["oid"])
+    except (TypeError, ValueError, KeyError, InvalidId):
+        raise CursorError("Invalid cursor")
+
+    return timestamp, _id
+
+
+def _ids_after(_id, direction):
+    if direction == "ascending":
+        conditions = [{"$gt": _id}]
+        if not isinstance(_id, ObjectId):
+            conditions.append({"$type": BSON_OBJECT_ID})
+    else:
+        conditions = [{"$lt": _id}]
+        if isinstance(_id, ObjectId):
+            conditions.append({"$type": BSON_STRING})
+
+    return conditions
+
+
+def after_cursor(cursor, direction="ascending"):
+    """Return a mongo query matching the documents that follow a cursor
+
+    Documents are ordered by _timestamp and then _id in the given
+    direction. Documents without a _timestamp sort before all others.
+    """
+    timestamp, _id = decode_cursor(cursor)
+
+    clauses = [{"_timestamp": timestamp, "_id": condition}
+               for condition in _ids_after(_id, direction)]
+
+    if direction == "ascending":
+        if timestamp is None:
+            clauses.append({"_timestamp": {"$ne": None}})
+        else:
+            clauses.append({"_timestamp": {"$gt": timestamp}})
+    elif timestamp is not None:
+        clauses.append({"_timestamp": {"$lt": timestamp}})
+        clauses.append({"_timestamp": None})
+
+    return {"$or": clauses}
@@ -0,0 +1,109 @@
+"""
+Time the phases of answering a request
+
+A PhaseTimer is started for each request and the code answering it marks
+its phases with timed(name). The timer is kept per thread, so it does not
+have to be passed down through every call, and phases run when no timer
+is started are not timed at all. A timer started while another is
+running replaces it until it is stopped.
+
+The time of a phase does not include the phases timed inside it, so the
+phases of a request add up to no more than its total.
+"""
+from contextlib import contextmanager
+import threading
+import time
+
+
+_local = threading.local()
+
+
+class PhaseTimer(object):
+
+    def __init__(self, outer=None):
+        self.outer = outer
+        self.started_at = time.time()
+        self.stopped_at = None
+        self._names = []
+        self._durations = {}
+        # The time spent in the phases inside each phase being timed
+        self._nested = []
+
+    @contextmanager
+    def timed(self, name):
+        self._nested.append(0)
+        started_at = time.time()
+        try:
+            yield
+        finally:
+            elapsed = (time.time() - started_at) * 1000
+            self.add(name, elapsed - self._nested.pop())
+            if self._nested:
+                self._nested[-1] += elapsed
+
+    def add(self, name, milliseconds):
+        """Add to the time of a phase, a phase timed twice is added up"""
+        if name not in self._durations:
+            self._names.append(name)
+            self._durations[name] = 0
+        self._durations[name] += milliseconds
+
+    def durations(self):
+        """Return (name, milliseconds) pairs in the order phases started"""
+        return [(name, self._durations[name]) for name in self._names]
+
+    def total(self):
+        """Return the milliseconds from starting to stopping the timer"""
+        stopped_at = self.stopped_at or time.time()
+        return (stopped_at - self.started_at) * 1000
+
+    def summary(self):
+        """Return the time of each phase, and the total, by name"""
+        summary = dict(self.durations())
+        summary["total"] = self.total()
+        return summary
+
+    def server_timing(self):
+        """Return the value of a Server-Timing header for the phases
+
+        >>> timer = PhaseTimer()
+        >>> timer.add("mongo", 12.34)
+        >>> timer.add("encode", 1.06)
+        >>> timer.stopped_at = timer.started_at + 0.015
+        >>> timer.server_timing()
+        'mongo;dur=12.3, encode;dur=1.1, total;dur=15.0'
+        """
+        return ", ".join(
+            "{0};dur={1:.1f}".format(name, milliseconds)
+            for name, milliseconds in self.durations() + [
+                ("total", self.total())])
+
+
+def start():
+    """Start timing the phases run in this thread and return the timer"""
+    _local.timer = PhaseTimer(outer=current())
+    return _local.timer
+
+
+def stop():
+    """Stop timing the phases run in this thread and return the timer"""
+    timer = current()
+    if timer is not None:
+        timer.stopped_at = time.time()
+        _local.timer = timer.outer
+    return timer
+
+
+def current():
+    return getattr(_local, 'timer', None)
+
+
+@contextmanager
+def timed(name):
+    """Time a phase with the timer of this thread, if one is started"""
+    timer = current()
+    if timer is None:
+        yield
+    else:
+        with timer.timed(name):
+            yield
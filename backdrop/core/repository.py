@@ -1,6 +1,14 @@
+from collections import namedtuple
+import threading
+import time
+
 from backdrop.core.bucket import BucketConfig
 from backdrop.core.user import UserConfig
 
+# The fields of a bucket config holding lists, which are frozen when cached
+BUCKET_CONFIG_LIST_FIELDS = ("upload_filters", "auto_ids", "indexes",
+                             "rollups")
+
 
 class _Repository(object):
 
@@ -41,10 +49,24 @@ class _Repository(object):
 
 
 class BucketConfigRepository(object):
+    """Store bucket configs, optionally keeping them in memory
 
-    def __init__(self, db):
+    With a ttl every config is loaded into memory and lookups are answered
+    from there. The configs are reloaded once they are older than ttl
+    seconds, so changes made anywhere, even straight to the buckets
+    collection, are seen within ttl seconds. Saves in this process reload
+    them on the next lookup. A ttl of 0 reads from mongo on every lookup.
+
+    Cached configs are shared by every lookup, so their lists are frozen
+    into tuples.
+    """
+
+    def __init__(self, db, ttl=0):
         self._db = db
         self._repository = _Repository(db, BucketConfig, "buckets", "name")
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._configs = None
 
     def save(self, bucket_config, create_bucket=True):
         self._repository.save(bucket_config)
@@ -53,16 +75,79 @@ class BucketConfigRepository(object):
             self._db.create_capped_collection(bucket_config.name,
                                               bucket_config.capped_size)
 
+        self._configs = None
+
     def get_all(self):
-        return self._repository.get_all()
+        if not self.ttl:
+            return self._repository.get_all()
+
+        by_name = self._cached_configs().by_name
+        return [by_name[name] for name in sorted(by_name)]
 
     def retrieve(self, name):
-        return self._repository.retrieve(name)
+        if not self.ttl:
+            return self._repository.retrieve(name)
+
+        return self._cached_configs().by_name.get(name)
 
     def get_bucket_for_query(self, data_group, data_type):
-        return self._repository.find_first_instance_of(
-            {"data_group": data_group,
-             "data_type": data_type})
+        if not self.ttl:
+            return self._repository.find_first_instance_of(
+                {"data_group": data_group,
+                 "data_type": data_type})
+
+        return self._cached_configs().by_query.get((data_group, data_type))
+
+    def _cached_configs(self):
+        configs = self._configs
+        if configs is not None and time.time() - configs.loaded_at < self.ttl:
+            return configs
+
+        with self._lock:
+            configs = self._configs
+            if configs is not None and \
+                    time.time() - configs.loaded_at < self.ttl:
+                return configs
+
+            configs = _CachedConfigs.load(self._repository)
+            self._configs = configs
+
+        return configs
+
+
+class _CachedConfigs(namedtuple("_CachedConfigs",
+                                "by_name by_query loaded_at")):
+
+    @classmethod
+    def load(cls, repository):
+        by_name, by_query = {}, {}
+        for config in repository.get_all():
+            config = _frozen_config(config)
+            by_name[config.name] = config
+            # find_one returns the first match, so keep the first one here
+            by_query.setdefault((config.data_group, config.data_type), config)
+
+        return cls(by_name, by_query, time.time())
+
+
+def _frozen_config(config):
+    """Return a bucket config with its lists turned into tuples"""
+    return config._replace(**dict(
+        (field, _freeze(getattr(config, field)))
+        for field in BUCKET_CONFIG_LIST_FIELDS))
+
+
+def _freeze(value):
+    """Turn the lists in a value into tuples, including those in dicts
+
+    >>> _freeze([["a", 1], {"fields": ["b"]}])
+    (('a', 1), {'fields': ('b',)})
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return dict((key, _freeze(item)) for key, item in value.items())
+    return value
 
 
 class UserConfigRepository(object):
@@ -0,0 +1,362 @@
+"""
+Period rollups of bucket data
+
+A rollup holds the number of records in each period, optionally split by
+the values of a group_by key, along with the count, sum, min and max of
+some numeric fields. Rollups are updated as records are stored, so the
+period queries they cover are answered without aggregating raw records.
+
+Rollups are configured on a bucket as a list of specs, eg.
+
+    [{"period": "week", "group_by": "channel", "fields": ["value"]}]
+"""
+from collections import namedtuple
+import logging
+
+from bson.son import SON
+
+from backdrop.core.aggregation import build_group_id, build_top_stages, \
+    collect_field_alias, count_where, field_path, group_key_alias, \
+    is_not_numeric, is_numeric, is_present, unique_collects, \
+    unwrap_group_results
+from backdrop.core.timeseries import parse_period
+from backdrop.core.validation import key_is_valid
+from backdrop.core.versions import BucketVersions
+
+
+log = logging.getLogger(__name__)
+
+# Collect methods that can be answered from the statistics in a rollup
+ROLLUP_METHODS = ("sum", "count", "mean")
+
+ROLLUP_SPEC_KEYS = ("period", "group_by", "fields")
+
+# The statistics kept for each field
+STATISTICS = ("present", "numeric", "invalid", "sum", "min", "max")
+
+
+def rollup_spec_is_valid(spec):
+    """Return whether a spec describes a rollup
+
+    >>> rollup_spec_is_valid({"period": "week", "fields": ["value"]})
+    True
+    >>> rollup_spec_is_valid({"period": "fortnight"})
+    False
+    >>> rollup_spec_is_valid({"period": "day", "group_by": "$where"})
+    False
+    """
+    if not isinstance(spec, dict) or not set(spec) <= set(ROLLUP_SPEC_KEYS):
+        return False
+
+    if parse_period(spec.get("period")) is None:
+        return False
+
+    group_by = spec.get("group_by")
+    if group_by is not None and not key_is_valid(group_by):
+        return False
+
+    fields = spec.get("fields", [])
+    return isinstance(fields, list) and all(map(key_is_valid, fields))
+
+
+def is_number(value):
+    """Return whether a value is summed by mongo
+
+    >>> [is_number(value) for value in (1, 2.5, True, "3", None)]
+    [True, True, False, False, False]
+    """
+    return isinstance(value, (int, long, float)) \
+        and not isinstance(value, bool)
+
+
+_Rollup = namedtuple("_Rollup", "period group_by fields")
+
+
+class Rollup(_Rollup):
+
+    @classmethod
+    def from_spec(cls, spec):
+        return cls(parse_period(spec["period"]), spec.get("group_by"),
+                   tuple(spec.get("fields", [])))
+
+    def collection_name(self, bucket_name):
+        """Return the name of the collection holding this rollup
+
+        Bucket names cannot contain dots, so this cannot clash with a bucket.
+
+        >>> Rollup.from_spec({"period": "week", "group_by": "channel"})\\
+        ...     .collection_name("licensing")
+        'rollups.licensing.week.channel'
+        """
+        parts = ["rollups", bucket_name, self.period.name]
+        if self.group_by:
+            parts.append(self.group_by)
+        return ".".join(parts)
+
+    @property
+    def keys(self):
+        """The keys that identify a document in this rollup"""
+        keys = [self.period.start_at_key]
+        if self.group_by:
+            keys.append(self.group_by)
+        return keys
+
+    def covers(self, query):
+        """Return whether a query can be answered from this rollup
+
+        The query must be for this period, group by this rollup's key (or
+        neither) and must not filter. Any time range has to fall on period
+        boundaries and every collect has to be a numeric one on a field the
+        rollup keeps.
+        """
+        if query.period is None or query.period.name != self.period.name:
+            return False
+
+        if query.group_by != self.group_by or query.filter_by:
+            return False
+
+        for timestamp in (query.start_at, query.end_at):
+            if timestamp is not None and \
+                    self.period.start(timestamp) != timestamp:
+                return False
+
+        return all(method in ROLLUP_METHODS and field in self.fields
+                   for field, method in unique_collects(query.collect))
+
+    def document_id(self, key):
+        names = ["start_at", "group"][:len(self.keys)]
+        return SON(zip(names, key))
+
+    def key_of(self, doc):
+        """Return the rollup key of a record, None if it has no key"""
+        key = tuple(doc.get(name) for name in self.keys)
+        if any(value is None for value in key):
+            return None
+        return key
+
+    def updates(self, docs):
+        """Return the (query, update) tuples adding docs to this rollup"""
+        deltas = {}
+        for doc in docs:
+            key = self.key_of(doc)
+            if key is None:
+                continue
+            delta = deltas.setdefault(key, _empty_delta(self.fields))
+            delta["_count"] += 1
+            for field in self.fields:
+                _add_value(delta["fields"][field], doc.get(field))
+
+        return [self._update(key, delta) for key, delta in deltas.items()]
+
+    def _update(self, key, delta):
+        update = {
+            "$setOnInsert": dict(zip(self.keys, key)),
+            "$inc": {"_count": delta["_count"]},
+        }
+        for field, stats in delta["fields"].items():
+            path = "fields.{0}.".format(field)
+            update["$inc"].update(
+                (path + name, stats[name])
+                for name in ("present", "numeric", "invalid", "sum"))
+            if stats["numeric"]:
+                update.setdefault("$min", {})[path + "min"] = stats["min"]
+                update.setdefault("$max", {})[path + "max"] = stats["max"]
+
+        return {"_id": self.document_id(key)}, update
+
+    def build_pipeline(self, query):
+        """Return a pipeline computing rollup documents from raw records"""
+        match = dict(query)
+        for key in self.keys:
+            match.setdefault(key, {"$ne": None})
+
+        stage = {
+            "_id": build_group_id(self.keys),
+            "_count": {"$sum": 1},
+        }
+        for index, field in enumerate(self.fields):
+            path = field_path(field)
+            alias = collect_field_alias(index)
+            numeric_value = {"$cond": [is_numeric(path), path, None]}
+            stage.update({
+                alias + "_present": count_where(is_present(path)),
+                alias + "_numeric": count_where(is_numeric(path)),
+                alias + "_invalid": count_where(is_not_numeric(path)),
+                alias + "_sum": {"$sum": path},
+                alias + "_min": {"$min": numeric_value},
+                alias + "_max": {"$max": numeric_value},
+            })
+
+        return [{"$match": match}, {"$group": stage}]
+
+    def document_from_result(self, result):
+        key = tuple(result["_id"][group_key_alias(index)]
+                    for index in range(len(self.keys)))
+
+        doc = dict(zip(self.keys, key))
+        doc["_id"] = self.document_id(key)
+        doc["_count"] = result["_count"]
+        doc["fields"] = dict(
+            (field, dict((name, result[collect_field_alias(index) + "_" +
+                                       name])
+                         for name in STATISTICS))
+            for index, field in enumerate(self.fields))
+
+        return doc
+
+    def group_stage(self, keys, collect):
+        """Return a $group stage combining rollup documents
+
+        The aliases match those used by aggregation.build_group_stage so
+        that the results can be read with unwrap_group_results.
+        """
+        stage = {
+            "_id": build_group_id(keys),
+            "_count": {"$sum": "$_count"},
+        }
+        for index, (field, method) in enumerate(unique_collects(collect)):
+            alias = collect_field_alias(index)
+            path = "$fields.{0}.".format(field)
+            if method == "count":
+                stage[alias] = {"$sum": path + "present"}
+            else:
+                stage[alias] = {"$sum": path + "sum"}
+                stage[alias + "_invalid"] = {"$sum": path + "invalid"}
+            if method == "mean":
+                stage[alias + "_values"] = {"$sum": path + "numeric"}
+
+        return stage
+
+
+def _empty_delta(fields):
+    return {
+        "_count": 0,
+        "fields": dict(
+            (field, {"present": 0, "numeric": 0, "invalid": 0, "sum": 0,
+                     "min": None, "max": None})
+            for field in fields),
+    }
+
+
+def _add_value(stats, value):
+    if value is None:
+        return
+
+    stats["present"] += 1
+    if not is_number(value):
+        stats["invalid"] += 1
+        return
+
+    stats["numeric"] += 1
+    stats["sum"] += value
+    stats["min"] = value if stats["min"] is None else min(stats["min"], value)
+    stats["max"] = value if stats["max"] is None else max(stats["max"], value)
+
+
+class RollupDriver(object):
+    """Answer grouped queries from a rollup collection
+
+    Has the same group method as MongoDriver so it can back a Repository.
+    """
+
+    def __init__(self, mongo_driver, rollup):
+        self._mongo_driver = mongo_driver
+        self.rollup = rollup
+
+    def group(self, keys, query, collect, sort=None, limit=None):
+        match = dict(query)
+        time_range = match.pop("_timestamp", None)
+        if time_range is not None:
+            match[self.rollup.period.start_at_key] = time_range
+
+        pipeline = [
+            {"$match": match},
+            {"$group": self.rollup.group_stage(keys, collect)},
+        ]
+        if sort and limit:
+            pipeline += build_top_stages(keys, sort, limit)
+
+        return unwrap_group_results(
+            keys, collect, self._mongo_driver.aggregate(pipeline))
+
+
+class BucketRollups(object):
+    """The rollups configured for a bucket"""
+
+    def __init__(self, db, bucket_name, specs):
+        self._db = db
+        self.bucket_name = bucket_name
+        self.rollups = [Rollup.from_spec(spec) for spec in specs or []]
+
+    def _collection(self, rollup):
+        return self._db.get_collection(
+            rollup.collection_name(self.bucket_name))
+
+    def driver_for(self, query):
+        """Return a RollupDriver for the first rollup covering a query"""
+        for rollup in self.rollups:
+            if rollup.covers(query):
+                return RollupDriver(self._collection(rollup), rollup)
+
+    def update(self, inserted, replaced=None):
+        """Add newly stored documents to every rollup
+
+        Statistics for inserted documents are added in place. A replaced
+        document (one saved with an _id) cannot be subtracted, so the
+        periods replaced documents fall in are recomputed from the bucket.
+        If a replacement moved a document to another period, its old period
+        stays out of date until the rollups are rebuilt.
+        """
+        for rollup in self.rollups:
+            self._collection(rollup).update_all(
+                rollup.updates(inserted), upsert=True)
+            if replaced:
+                self.recompute_periods(rollup, replaced)
+
+    def recompute_periods(self, rollup, docs):
+        """Recompute the periods of a rollup that docs fall in"""
+        starts = sorted(set(doc[rollup.period.start_at_key] for doc in docs
+                            if doc.get(rollup.period.start_at_key)))
+        if not starts:
+            return
+
+        self._replace(rollup, {rollup.period.start_at_key: {"$in": starts}})
+
+    def rebuild(self):
+        """Recompute every rollup from the bucket, eg. after a backfill
+
+        The rollups are never empty while they are rebuilt, and the bucket
+        version is bumped afterwards, as results cached from the old
+        rollups are out of date.
+        """
+        for rollup in self.rollups:
+            log.info("Rebuilding {0}".format(
+                rollup.collection_name(self.bucket_name)))
+            self._replace(rollup, {})
+
+        BucketVersions(self._db).bump(self.bucket_name)
+
+    def _replace(self, rollup, query):
+        """Recompute the groups of a rollup whose records match query
+
+        New groups are saved over the old ones before the groups that no
+        longer have any records are removed.
+
+        The groups are replaced without checking whether they changed since
+        they were computed, so records added to them by another writer in
+        the meantime are lost from the rollup until it is next recomputed.
+        Buckets written by more than one process at a time should have
+        their rollups rebuilt after backfills.
+        """
+        rebuilt = self._compute(rollup, query)
+
+        collection = self._collection(rollup)
+        if rebuilt:
+            collection.save_all(rebuilt)
+        collection.remove(dict(query, _id={
+            "$nin": [doc["_id"] for doc in rebuilt]}))
+
+    def _compute(self, rollup, query):
+        results = self._db.get_collection(self.bucket_name).aggregate(
+            rollup.build_pipeline(query))
+        return [rollup.document_from_result(result) for result in results]
@@ -1,5 +1,5 @@
 from datetime import timedelta, time
-import time as _time
+from operator import itemgetter
 from dateutil.relativedelta import relativedelta, MO
 import pytz
 
@@ -32,6 +32,14 @@ class Period(object):
             yield (_start, _start + self._delta)
             _start += self._delta
 
+    def boundaries(self, start, end):
+        """Return the (start, end) tuples of every period in a range
+
+        The list can be shared by every timeseries covering the range so
+        the period arithmetic is only done once.
+        """
+        return list(self.range(start, end))
+
 
 class Hour(Period):
     def __init__(self):
@@ -116,41 +124,33 @@ def parse_period(period_name):
             return period
 
 
-def _time_to_index(dt):
-    return _time.mktime(dt.replace(tzinfo=pytz.utc).timetuple())
-
-
 def timeseries(start, end, period, data, default):
-    data_by_start_at = _index_by_start_at(data)
-
-    def entry(start, end):
-        time_index = _time_to_index(start)
-        if time_index in data_by_start_at:
-            return data_by_start_at[time_index]
-        else:
-            return _merge(default, _period_limits(start, end))
-    return [entry(start, end) for start, end in period.range(start, end)]
-
-
-def _period_limits(start, end):
-    return {
-        "_start_at": start,
-        "_end_at": end
-    }
-
-
-def _index_by_start_at(data):
-    return dict((_time_to_index(d["_start_at"]), d) for d in data)
-
-
-def _period_range(start, stop, period):
-    while start < stop:
-        yield (start, start + period)
-        start += period
-
-
-def _merge(first, second):
-    return dict(first.items() + second.items())
+    return fill_timeseries(period.boundaries(start, end), data, default)
+
+
+def fill_timeseries(boundaries, data, default):
+    """Return an entry for every period, using default for missing ones
+
+    Data is matched to the periods on its _start_at by walking both in
+    order, so the work is linear in the number of periods. Data outside
+    the periods is dropped.
+    """
+    # Timestamps are compared as UTC whatever timezone they are in
+    data = sorted(((datum["_start_at"].replace(tzinfo=pytz.UTC), datum)
+                   for datum in data), key=itemgetter(0))
+    index, count = 0, len(data)
+    filled = []
+    for start, end in boundaries:
+        entry = None
+        while index < count and data[index][0] <= start:
+            if data[index][0] == start:
+                entry = data[index][1]
+            index += 1
+        if entry is None:
+            entry = dict(default, _start_at=start, _end_at=end)
+        filled.append(entry)
+
+    return filled
 
 
 def _truncate_time(datetime):
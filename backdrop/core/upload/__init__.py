@@ -8,11 +8,16 @@ def create_parser(bucket_config):
     upload_filters = map(load_filter, bucket_config.upload_filters)
 
     def parser(file_stream):
+        """Return an iterator of the dictionaries in a file
+
+        Rows are read from the file as the iterator is consumed, so the
+        file must stay open until it is exhausted.
+        """
         data = format_parser(file_stream)
         for upload_filter in upload_filters:
             data = upload_filter(data)
 
-        return list(make_dicts(data))
+        return make_dicts(data)
 
     return parser
 
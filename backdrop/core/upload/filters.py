@@ -1,3 +1,3 @@
 
 def first_sheet_filter(sheets):
-    return list(sheets)[0]
+    return next(iter(sheets))
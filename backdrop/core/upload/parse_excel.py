@@ -1,4 +1,6 @@
 import logging
+import os
+import time
 import xlrd
 import datetime
 from backdrop import statsd
@@ -21,33 +23,67 @@ class ExcelError(object):
 EXCEL_ERROR = ExcelError("error in cell")
 
 
-@statsd.timer('parse_excel.parse_excel')
 def parse_excel(incoming_data):
-    book = xlrd.open_workbook(file_contents=incoming_data.read())
+    """Yield an iterator of rows for each sheet in a workbook
 
-    for sheet in book.sheets():
-        yield _extract_rows(sheet, book)
+    Sheets are only read from the workbook when their rows are needed.
+    """
+    started = time.time()
+    book = _open_workbook(incoming_data)
+    statsd.timing('parse_excel.open_workbook', _ms_since(started))
 
+    for index in range(book.nsheets):
+        yield _extract_rows(book, index)
+
+
+def _open_workbook(incoming_data):
+    path = getattr(incoming_data, 'name', None)
+    if path is not None and os.path.isfile(path):
+        # xlrd maps a file on disk into memory instead of copying it
+        return xlrd.open_workbook(path, on_demand=True)
+
+    return xlrd.open_workbook(file_contents=incoming_data.read(),
+                              on_demand=True)
+
+
+def _extract_rows(book, index):
+    """Yield the rows in a sheet, timing the sheet as a whole
+
+    The time taken by whatever consumes the rows is not counted.
+    """
+    started = time.time()
+    sheet = book.sheet_by_index(index)
+    elapsed = _ms_since(started)
 
-@statsd.timer('parse_excel._extract_rows')
-def _extract_rows(sheet, book):
     for i in range(sheet.nrows):
-        yield _extract_values(sheet.row(i), book)
+        started = time.time()
+        values = _extract_values(
+            sheet.row_types(i), sheet.row_values(i), book.datemode)
+        elapsed += _ms_since(started)
+        yield values
+
+    book.unload_sheet(index)
+
+    statsd.timing('parse_excel.sheet', elapsed)
+    statsd.incr('parse_excel.rows', sheet.nrows)
 
 
-@statsd.timer('parse_excel._extract_values')
-def _extract_values(row, book):
-    return [_extract_cell_value(cell, book) for cell in row]
+def _extract_values(types, values, datemode):
+    return [_extract_cell_value(ctype, value, datemode)
+            for ctype, value in zip(types, values)]
 
 
-@statsd.timer('parse_excel._extract_cell_value')
-def _extract_cell_value(cell, book):
-    if cell.ctype == xlrd.XL_CELL_DATE:
-        time_tuple = xlrd.xldate_as_tuple(cell.value, book.datemode)
+def _extract_cell_value(ctype, value, datemode):
+    if ctype == xlrd.XL_CELL_DATE:
+        time_tuple = xlrd.xldate_as_tuple(value, datemode)
         return utc(datetime.datetime(*time_tuple)).isoformat()
-    if cell.ctype == xlrd.XL_CELL_EMPTY:
+    if ctype == xlrd.XL_CELL_EMPTY:
         return None
-    elif cell.ctype == xlrd.XL_CELL_ERROR:
+    elif ctype == xlrd.XL_CELL_ERROR:
         logging.warn("Encountered errors in cells when parsing excel file")
         return EXCEL_ERROR
-    return cell.value
+    return value
+
+
+def _ms_since(started):
+    return (time.time() - started) * 1000
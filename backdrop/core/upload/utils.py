@@ -1,10 +1,9 @@
-from itertools import ifilter
 import logging
 from backdrop.core.errors import ParseError
 
 
-def remove_blanks(rows):
-    return filter(lambda r: not all(v is None or len(v) == 0 for v in r), rows)
+def is_blank(row):
+    return all(v is None or len(v) == 0 for v in row)
 
 
 def make_dicts(rows):
@@ -12,19 +11,24 @@ def make_dicts(rows):
 
     Given an iterator of rows consisting of a iterator of lists of values
     produces an iterator of dictionaries using the first row as the keys for
-    all subsequent rows.
+    all subsequent rows. Rows are read one at a time and errors give the
+    number of the row, counting the keys as row 1.
     """
     rows = iter(rows)
     keys = next(rows)
+    key_count = len(keys)
 
-    for row in remove_blanks(rows):
-        key_count = len(keys)
+    for number, row in enumerate(rows, start=2):
+        if is_blank(row):
+            continue
         row_count = len(row)
         if key_count < row_count:
             raise ParseError(
-                'Some rows in the CSV file contain more values than columns')
+                'Row {0} in the file contains more values than '
+                'columns'.format(number))
         if key_count > row_count:
             raise ParseError(
-                'Some rows in the CSV file contain fewer values than columns')
+                'Row {0} in the file contains fewer values than '
+                'columns'.format(number))
 
         yield dict(zip(keys, row))
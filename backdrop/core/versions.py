@@ -0,0 +1,62 @@
+"""
+Per-bucket data versions and last updated watermarks
+
+Every write to a bucket bumps its version, so anything derived from the
+data in a bucket (eg. cached query results) can be keyed on the version
+and is invalidated by the next write. Writes also record when the bucket
+was last updated, so its freshness can be checked without querying the
+bucket itself.
+"""
+import time
+
+from backdrop.core import timeutils
+
+
+BUCKET_METADATA_COLLECTION = "bucket_metadata"
+
+
+class BucketVersions(object):
+
+    def __init__(self, db, ttl=0):
+        """ttl: number of seconds a version read from mongo is reused for"""
+        self._collection = db.get_collection(BUCKET_METADATA_COLLECTION)
+        self.ttl = ttl
+        self._cache = {}
+
+    def bump(self, bucket_name, updated_at=None):
+        update = {"$inc": {"version": 1}}
+        if updated_at is not None:
+            update["$max"] = {"last_updated": updated_at}
+
+        self._collection.update({"_id": bucket_name}, update, upsert=True)
+        self._cache.pop(bucket_name, None)
+
+    def set_last_updated(self, bucket_name, updated_at):
+        """Move the watermark of a bucket forward to updated_at"""
+        self._collection.update(
+            {"_id": bucket_name},
+            {"$max": {"last_updated": updated_at}},
+            upsert=True)
+
+    def last_updated(self):
+        """Return a dictionary of bucket name to last updated time
+
+        Buckets that have not been written since watermarks were introduced
+        are missing from it.
+        """
+        return dict(
+            (doc["_id"], timeutils.utc(doc["last_updated"]))
+            for doc in self._collection.find(
+                {"last_updated": {"$ne": None}},
+                fields=["last_updated"]))
+
+    def get(self, bucket_name):
+        cached = self._cache.get(bucket_name)
+        if cached is not None and time.time() - cached[1] < self.ttl:
+            return cached[0]
+
+        doc = self._collection.find_one({"_id": bucket_name}) or {}
+        version = doc.get("version", 0)
+        self._cache[bucket_name] = (version, time.time())
+
+        return version
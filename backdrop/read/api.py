@@ -1,23 +1,35 @@
-import datetime
 import json
+import os
+import threading
+from multiprocessing.pool import ThreadPool
 from os import getenv
-from bson import ObjectId
 
-from flask import Flask, jsonify, request, redirect
+from flask import Flask, g, jsonify, request, redirect, stream_with_context
 from flask_featureflags import FeatureFlag
+from werkzeug.datastructures import MultiDict
 from backdrop.core.log_handler \
     import create_request_logger, create_response_logger
+from backdrop import statsd
 from backdrop.read.query import Query
+from backdrop.read.result_cache import ResultCache, cache_key, query_etag
+from backdrop.read.serialization import default as json_default, \
+    get_serializer
 
 from .validation import validate_request_args
-from ..core import database, log_handler, cache_control
+from ..core import database, log_handler, cache_control, phases
 from ..core.bucket import Bucket
 from ..core.database import InvalidOperationError
+from ..core.pagination import encode_cursor
+from ..core.indexes import QueryShapeRecorder
 from ..core.repository import BucketConfigRepository
+from ..core.versions import BucketVersions
 
 
 GOVUK_ENV = getenv("GOVUK_ENV", "development")
 
+# Bytes of encoded documents written to a streamed response at a time
+STREAM_CHUNK_SIZE = 64 * 1024
+
 app = Flask("backdrop.read.api")
 
 feature_flags = FeatureFlag(app)
@@ -29,22 +41,59 @@ app.config.from_object(
 db = database.Database(
     app.config['MONGO_HOSTS'],
     app.config['MONGO_PORT'],
-    app.config['DATABASE_NAME']
+    app.config['DATABASE_NAME'],
+    database.mongo_client_options(app.config)
 )
 
-bucket_repository = BucketConfigRepository(db)
+bucket_repository = BucketConfigRepository(
+    db, app.config.get('BUCKET_CONFIG_TTL', 0))
+query_shape_recorder = QueryShapeRecorder(
+    db, app.config.get('QUERY_SHAPE_SAMPLE_RATE', 0))
+bucket_versions = BucketVersions(db, app.config.get('BUCKET_VERSION_TTL', 0))
+result_cache = ResultCache(app.config.get('RESULT_CACHE_SIZE', 0))
+serializer = get_serializer(app.config.get('JSON_BACKEND', 'auto'))
 
 log_handler.set_up_logging(app, GOVUK_ENV)
 
 
+@app.before_request
+def start_phase_timer():
+    g.phase_timer = phases.start()
+
+
+@app.after_request
+def report_phase_timings(response):
+    """Say where the time answering a request went
+
+    Registered after the response logger so it runs first, and the logged
+    phases include the total.
+    """
+    timer = phases.stop()
+    if timer is not None:
+        response.headers['Server-Timing'] = timer.server_timing()
+        send_phase_timings(timer, getattr(g, 'bucket_name', None))
+    return response
+
+
+@app.teardown_request
+def discard_phase_timer(exception):
+    # Responses are not processed when a request raises an exception
+    if phases.current() is getattr(g, 'phase_timer', None):
+        phases.stop()
+
+
+def send_phase_timings(timer, bucket_name):
+    if bucket_name is None:
+        return
+    for name, milliseconds in timer.summary().items():
+        statsd.timing("read.phase.%s" % name, milliseconds,
+                      bucket=bucket_name)
+
+
 class JsonEncoder(json.JSONEncoder):
 
     def default(self, obj):
-        if isinstance(obj, ObjectId):
-            return str(obj)
-        if isinstance(obj, datetime.datetime):
-            return obj.isoformat()
-        return json.JSONEncoder.default(self, obj)
+        return json_default(obj)
 app.json_encoder = JsonEncoder
 
 
@@ -67,7 +116,8 @@ def health_check():
         return jsonify(status='error',
                        message='cannot connect to database'), 500
 
-    return jsonify(status='ok', message='database is up')
+    return jsonify(status='ok', message='database is up',
+                   connections=database.report_pool_stats(db, 'read'))
 
 
 @app.route('/_status/buckets', methods=['GET'])
@@ -76,17 +126,27 @@ def bucket_health():
 
     failing_buckets = []
     okay_buckets = []
+    watermarks = bucket_versions.last_updated()
     bucket_configs = bucket_repository.get_all()
 
+    stale_buckets = []
     for bucket_config in bucket_configs:
         bucket = Bucket(db, bucket_config)
-        if not bucket.is_recent_enough():
+        if bucket.was_updated_recently(watermarks.get(bucket.name)):
+            okay_buckets.append(bucket.name)
+        else:
+            stale_buckets.append(bucket)
+
+    last_updated = _check_last_updated(stale_buckets, watermarks)
+
+    for bucket in stale_buckets:
+        if bucket.was_updated_recently(last_updated[bucket.name]):
+            okay_buckets.append(bucket.name)
+        else:
             failing_buckets.append({
                 'name': bucket.name,
-                'last_updated': bucket.get_last_updated()
+                'last_updated': last_updated[bucket.name]
             })
-        else:
-            okay_buckets.append(bucket.name)
 
     if len(failing_buckets):
         message = _bucket_message(failing_buckets)
@@ -102,6 +162,36 @@ def bucket_health():
                        okay_buckets)
 
 
+def _check_last_updated(buckets, watermarks):
+    """Return the last updated time of each bucket
+
+    Watermarks are only maintained by writes through backdrop, so buckets
+    that look out of date are checked against their collection, in
+    parallel, when STATUS_FALLBACK_THREADS is set. Watermarks found to be
+    behind are moved forward so the next check does not need to.
+    """
+    last_updated = dict((bucket.name, watermarks.get(bucket.name))
+                        for bucket in buckets)
+    threads = app.config.get('STATUS_FALLBACK_THREADS', 0)
+    if not buckets or not threads:
+        return last_updated
+
+    pool = ThreadPool(min(threads, len(buckets)))
+    try:
+        found = pool.map(lambda bucket: bucket.get_last_updated(), buckets)
+    finally:
+        pool.close()
+
+    for bucket, updated_at in zip(buckets, found):
+        watermark = last_updated[bucket.name]
+        if updated_at is not None and (watermark is None or
+                                       updated_at > watermark):
+            bucket_versions.set_last_updated(bucket.name, updated_at)
+            last_updated[bucket.name] = updated_at
+
+    return last_updated
+
+
 def _bucket_message(buckets):
     message = ', '.join(
         '%s (last updated: %s)' % (bucket['name'],
@@ -116,16 +206,19 @@ def log_error_and_respond(bucket, message, status_code):
 
 
 @app.route('/data/<data_group>/<data_type>', methods=['GET', 'OPTIONS'])
+@cache_control.etag
 def data(data_group, data_type):
-    bucket_config = bucket_repository.get_bucket_for_query(data_group,
-                                                           data_type)
+    with phases.timed("config"):
+        bucket_config = bucket_repository.get_bucket_for_query(data_group,
+                                                               data_type)
     return fetch(bucket_config)
 
 
 @app.route('/<bucket_name>', methods=['GET', 'OPTIONS'])
 @cache_control.etag
 def query(bucket_name):
-    bucket_config = bucket_repository.retrieve(name=bucket_name)
+    with phases.timed("config"):
+        bucket_config = bucket_repository.retrieve(name=bucket_name)
     return fetch(bucket_config)
 
 
@@ -136,6 +229,8 @@ def fetch(bucket_config):
             bname, 'bucket not found',
             404)
 
+    g.bucket_name = bucket_config.name
+
     if request.method == 'OPTIONS':
         # OPTIONS requests are made by XHR as part of the CORS spec
         # if the client uses custom headers
@@ -143,8 +238,11 @@ def fetch(bucket_config):
         response.headers['Access-Control-Max-Age'] = '86400'
         response.headers['Access-Control-Allow-Headers'] = 'cache-control'
     else:
-        result = validate_request_args(request.args,
-                                       bucket_config.raw_queries_allowed)
+        with phases.timed("validate"):
+            result = validate_request_args(request.args,
+                                           bucket_config.raw_queries_allowed)
+            if result.is_valid:
+                query = Query.parse(request.args)
 
         if not result.is_valid:
             return log_error_and_respond(
@@ -152,17 +250,35 @@ def fetch(bucket_config):
                 400)
 
         bucket = Bucket(db, bucket_config)
+        version = bucket_version(bucket)
+        # Without a version the ETag is a hash of the body, which is set
+        # after the query is run
+        etag = None
+        if version is not None:
+            etag = query_etag(bucket.name, version, query)
+
+        if etag is not None and request.if_none_match.contains(etag):
+            # The client has the current response, so skip the query
+            statsd.incr("read.not_modified", bucket=bucket.name)
+            response = app.response_class(status=304)
+        elif app.config.get('STREAM_RAW_QUERIES') and query.is_raw:
+            query_shape_recorder.record(bucket.name, query)
+            data = bucket.query(query, stream=True)
+            response = app.response_class(
+                stream_with_context(stream_json(
+                    'data', data,
+                    trailer=lambda: paging(query, data.count, data.last))),
+                mimetype='application/json')
+        else:
+            try:
+                response = query_response(bucket, query, version)
+            except InvalidOperationError:
+                return log_error_and_respond(
+                    bucket.name, 'invalid collect function',
+                    400)
 
-        try:
-            query = Query.parse(request.args)
-            data = bucket.query(query).data()
-
-        except InvalidOperationError:
-            return log_error_and_respond(
-                bucket.name, 'invalid collect function',
-                400)
-
-        response = jsonify(data=data)
+        if etag is not None:
+            response.set_etag(etag)
 
     # allow requests from any origin
     response.headers['Access-Control-Allow-Origin'] = '*'
@@ -173,6 +289,228 @@ def fetch(bucket_config):
     return response
 
 
+@app.route('/_batch', methods=['POST', 'OPTIONS'])
+@cache_control.nocache
+def batch():
+    """Run several queries and return their results keyed by id
+
+    The body is a JSON list of queries, eg.
+
+        [{"id": "visits", "bucket": "govuk_visitors",
+          "query": {"period": "week", "duration": "9"}},
+         {"id": "volumes", "data_group": "lpa", "data_type": "volumes",
+          "query": {"group_by": "key", "collect": ["value"]}}]
+
+    Each result has the status and body a GET of that query would have
+    had. The queries are run at the same time on up to BATCH_THREADS
+    threads.
+    """
+    if request.method == 'OPTIONS':
+        response = app.make_default_options_response()
+        response.headers['Access-Control-Max-Age'] = '86400'
+        response.headers['Access-Control-Allow-Headers'] = 'content-type'
+    else:
+        entries = request.get_json(force=True, silent=True)
+        if not isinstance(entries, list) or \
+                not all(isinstance(entry, dict) for entry in entries):
+            return log_error_and_respond(
+                '_batch', 'expected a list of queries', 400)
+        if len(entries) > app.config.get('BATCH_MAX_QUERIES', 50):
+            return log_error_and_respond(
+                '_batch', 'too many queries in one batch', 400)
+
+        ids = [unicode(entry.get('id', index))
+               for index, entry in enumerate(entries)]
+        if len(set(ids)) != len(ids):
+            return log_error_and_respond(
+                '_batch', 'query ids must be unique', 400)
+
+        results = _run_batch(entries)
+        response = app.response_class(
+            '{"results":{%s}}' % ','.join(
+                '%s:{"status":%d,"body":%s}' % (json.dumps(_id), status, body)
+                for _id, (status, body) in zip(ids, results)),
+            mimetype='application/json')
+
+    response.headers['Access-Control-Allow-Origin'] = '*'
+
+    return response
+
+
+def _run_batch(entries):
+    if app.config.get('BATCH_THREADS', 1) <= 1 or len(entries) <= 1:
+        return map(batch_result, entries)
+
+    return batch_pool().map(batch_result, entries)
+
+
+_batch_pool = None
+_batch_pool_pid = None
+_batch_pool_lock = threading.Lock()
+
+
+def batch_pool():
+    """Return the pool of BATCH_THREADS threads that batches run on
+
+    Every batch in a process shares the pool, so concurrent batches do not
+    start more threads. It is started on first use in each process, as a
+    pool started before the app server forks has no threads in the workers.
+    """
+    global _batch_pool, _batch_pool_pid
+
+    with _batch_pool_lock:
+        if _batch_pool_pid != os.getpid():
+            _batch_pool = ThreadPool(app.config['BATCH_THREADS'])
+            _batch_pool_pid = os.getpid()
+        return _batch_pool
+
+
+def batch_result(entry):
+    """Return the (status, JSON body) of a query in a batch
+
+    The phases of each query are timed on their own, as the queries may
+    run on other threads, and sent to statsd for the bucket queried.
+    """
+    timer = phases.start()
+    bucket_name = None
+    try:
+        with phases.timed("config"):
+            if 'bucket' in entry:
+                bucket_config = bucket_repository.retrieve(
+                    name=entry['bucket'])
+            else:
+                bucket_config = bucket_repository.get_bucket_for_query(
+                    entry.get('data_group'), entry.get('data_type'))
+        if bucket_config is None or not bucket_config.queryable:
+            return 404, _batch_error('bucket not found')
+        bucket_name = bucket_config.name
+
+        request_args = _batch_request_args(entry.get('query', {}))
+        with phases.timed("validate"):
+            result = validate_request_args(request_args,
+                                           bucket_config.raw_queries_allowed)
+            if result.is_valid:
+                query = Query.parse(request_args)
+        if not result.is_valid:
+            return 400, _batch_error(result.message)
+
+        bucket = Bucket(db, bucket_config)
+        return 200, query_body(bucket, query, bucket_version(bucket))
+    except InvalidOperationError:
+        return 400, _batch_error('invalid collect function')
+    except Exception as e:
+        app.logger.exception(e)
+        return 500, _batch_error('Internal error')
+    finally:
+        phases.stop()
+        send_phase_timings(timer, bucket_name)
+
+
+def _batch_request_args(query):
+    """Turn the query of a batch entry into request args
+
+    Values are strings, or lists of strings for repeated args.
+    """
+    if not isinstance(query, dict):
+        return MultiDict()
+
+    return MultiDict(
+        (name, unicode(value))
+        for name, values in query.items()
+        for value in (values if isinstance(values, list) else [values]))
+
+
+def _batch_error(message):
+    return serializer.dumps({'status': 'error', 'message': message})
+
+
+def bucket_version(bucket):
+    """Return the version responses from a bucket are cached under
+
+    None if data may be read from a secondary. The version may be read from
+    a different member than the data, so a secondary that is behind would
+    have its old data cached and ETagged as the new version until the next
+    write. Reading from secondaries gives up the result cache and the
+    ETags checked before a query for spreading the query load.
+    """
+    if db.reads_from_secondaries:
+        return None
+    with phases.timed("version"):
+        return bucket_versions.get(bucket.name)
+
+
+def query_response(bucket, query, version):
+    """Return the response to a query, from the result cache if possible"""
+    return app.response_class(query_body(bucket, query, version),
+                              mimetype='application/json')
+
+
+def query_body(bucket, query, version):
+    """Return the JSON body answering a query
+
+    Bodies are cached under the bucket version, if there is one.
+    """
+    cached = result_cache.enabled and version is not None
+    key = cache_key(bucket.name, version, query)
+    body = result_cache.get(key) if cached else None
+
+    if body is not None:
+        statsd.incr("read.result_cache.hit", bucket=bucket.name)
+    else:
+        query_shape_recorder.record(bucket.name, query)
+        results = bucket.query(query)
+        with phases.timed("encode"):
+            data = results.data()
+            fields = {'data': data}
+            if query.is_paginated:
+                fields.update(
+                    paging(query, len(data), data[-1] if data else None))
+            body = serializer.dumps(fields)
+
+        if cached:
+            statsd.incr("read.result_cache.miss", bucket=bucket.name)
+            result_cache.set(key, body)
+
+    return body
+
+
+def paging(query, count, last):
+    """Return the fields linking a page of results to the next one
+
+    A full page of a paginated query is followed by a cursor for the next
+    page. Other results have nothing to link to.
+    """
+    if query.is_paginated and count == query.limit and last is not None:
+        return {'next': encode_cursor(last)}
+    return {}
+
+
+def stream_json(key, documents, chunk_size=STREAM_CHUNK_SIZE, trailer=None):
+    """Yield a JSON object with documents as a list under key
+
+    Documents are encoded one at a time and yielded in chunks of about
+    chunk_size bytes, so the whole body is never held in memory. trailer
+    is called once the documents are written and returns more fields for
+    the object.
+    """
+    chunk = ['{%s:[' % json.dumps(key)]
+    size = 0
+    for index, document in enumerate(documents):
+        encoded = serializer.dumps(document)
+        if index > 0:
+            chunk.append(',')
+        chunk.append(encoded)
+        size += len(encoded)
+        if size >= chunk_size:
+            yield ''.join(chunk)
+            chunk, size = [], 0
+    chunk.append(']')
+    for name, value in (trailer() if trailer else {}).items():
+        chunk.append(',%s:%s' % (json.dumps(name), serializer.dumps(value)))
+    chunk.append('}')
+    yield ''.join(chunk)
+
+
 def start(port):
     app.debug = True
     app.run(host='0.0.0.0', port=port)
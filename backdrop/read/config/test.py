@@ -1,7 +1,37 @@
 DATABASE_NAME = "backdrop_test"
 MONGO_HOSTS = ['localhost']
 MONGO_PORT = 27017
+# Where reads are sent: primary, primary_preferred, secondary,
+# secondary_preferred or nearest. Anything but primary turns off the result
+# cache and the bucket version ETags, as data read from a secondary may be
+# older than the version.
+MONGO_READ_PREFERENCE = "primary"
+# Milliseconds slower than the nearest member a secondary can be to be read
+MONGO_SECONDARY_ACCEPTABLE_LATENCY_MS = 15
+# Connections kept open to each member of the replica set
+MONGO_MAX_POOL_SIZE = 100
+# Milliseconds to wait for a connection, and for a reply, before failing
+MONGO_CONNECT_TIMEOUT_MS = 2000
+MONGO_SOCKET_TIMEOUT_MS = 10000
 LOG_LEVEL = "ERROR"
+# Fraction of queries whose shape is recorded for the index advisor
+QUERY_SHAPE_SAMPLE_RATE = 0
+# Bytes of serialized responses kept in the result cache, 0 disables it
+RESULT_CACHE_SIZE = 0
+# Seconds a bucket version is reused before being read again
+BUCKET_VERSION_TTL = 5
+# Seconds bucket configs are kept in memory, 0 reads them on every request
+BUCKET_CONFIG_TTL = 0
+# Threads used to check buckets whose watermark is out of date, 0 skips it
+STATUS_FALLBACK_THREADS = 4
+# Stream raw query responses instead of building them in memory
+STREAM_RAW_QUERIES = False
+# json, simplejson or auto to use the fastest one installed
+JSON_BACKEND = "auto"
+# Threads running the queries of a /_batch request at the same time
+BATCH_THREADS = 2
+# Most queries allowed in a single /_batch request
+BATCH_MAX_QUERIES = 50
 RAW_QUERIES_ALLOWED = {
     "reptiles": True,
     "foo": True,
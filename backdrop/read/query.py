@@ -1,11 +1,16 @@
 from collections import namedtuple
 
 import pytz
+from backdrop.core import phases
 from backdrop.core.timeseries import parse_period
 from backdrop.core.timeutils import now, parse_time_as_utc
 from backdrop.read.response import *
 
 
+# Number of documents fetched from mongo at a time when streaming
+STREAM_BATCH_SIZE = 1000
+
+
 def if_present(func, value):
     """Apply the given function to the value and return if it exists"""
     if value is not None:
@@ -46,6 +51,11 @@ def parse_request_args(request_args):
 
     args['limit'] = if_present(int, request_args.get('limit'))
 
+    args['cursor'] = request_args.get('cursor')
+
+    args['fields'] = [field for fields_arg in request_args.getlist('fields')
+                      for field in fields_arg.split(',')]
+
     args['collect'] = []
     for collect_arg in request_args.getlist('collect'):
         if ':' in collect_arg:
@@ -63,7 +73,8 @@ This is the internal Query object
 _Query = namedtuple(
     '_Query',
     ['start_at', 'end_at', 'delta', 'period',
-     'filter_by', 'group_by', 'sort_by', 'limit', 'collect'])
+     'filter_by', 'group_by', 'sort_by', 'limit', 'collect', 'cursor',
+     'fields'])
 
 
 class Query(_Query):
@@ -71,7 +82,8 @@ class Query(_Query):
     def create(cls,
                start_at=None, end_at=None, duration=None, delta=None,
                period=None, filter_by=None, group_by=None,
-               sort_by=None, limit=None, collect=None):
+               sort_by=None, limit=None, collect=None, cursor=None,
+               fields=None):
         delta = None
         if duration is not None:
             date = start_at or end_at or now()
@@ -79,7 +91,8 @@ class Query(_Query):
             start_at, end_at = cls.__calculate_start_and_end(period, date,
                                                              delta)
         return Query(start_at, end_at, delta, period,
-                     filter_by or [], group_by, sort_by, limit, collect or [])
+                     filter_by or [], group_by, sort_by, limit, collect or [],
+                     cursor, fields or [])
 
     @classmethod
     def parse(cls, request_args):
@@ -96,13 +109,13 @@ class Query(_Query):
 
         return start_at, end_at
 
-    def __skip_blank_periods(self, results, repository):
-        amount_to_shift = results.amount_to_shift(self.delta)
-        if amount_to_shift != 0:
-            query = self.get_shifted_query(shift=amount_to_shift)
-            results = query.execute(repository)
-
-        return results
+    def __widened(self):
+        """Return a Query covering every window a duration query can be
+        moved to when it skips blank periods"""
+        extra = self.period.delta * (abs(self.delta) - 1)
+        if self.delta > 0:
+            return self._replace(end_at=self.end_at + extra, delta=None)
+        return self._replace(start_at=self.start_at - extra, delta=None)
 
     def get_shifted_query(self, shift):
         """Return a new Query where the date is shifted by n periods"""
@@ -125,38 +138,85 @@ class Query(_Query):
             mongo_query.update(self.filter_by)
         return mongo_query
 
-    def execute(self, repository):
+    @property
+    def is_raw(self):
+        """Whether the query returns documents rather than groups"""
+        return not self.group_by and not self.period
+
+    @property
+    def is_paginated(self):
+        """Whether the query returns a page that can be followed by another
+
+        Pages are raw queries with a limit sorted by _timestamp, which are
+        also sorted by _id so that the order of documents is stable.
+        """
+        return bool(self.is_raw and self.limit and
+                    (self.sort_by or ["_timestamp"])[0] == "_timestamp")
+
+    @property
+    def projection(self):
+        """The mongo projection of a raw query, None for whole documents
+
+        A page keeps its _timestamp as the next cursor is built from it.
+        """
+        if not self.fields:
+            return None
+
+        projection = dict((field, 1) for field in self.fields)
+        if self.is_paginated:
+            projection["_timestamp"] = 1
+        return projection
+
+    def execute(self, repository, stream=False):
+        """Run the query against a repository
+
+        With stream, raw queries return a StreamingData that reads the
+        documents from mongo as it is iterated.
+        """
+        if stream and self.is_raw:
+            return self.__execute_streaming_query(repository)
+
+        if self.delta:
+            # Group every window the query could be moved to in one scan
+            # and keep the one that starts (or ends) with data
+            return self.__widened().__execute(repository, ShiftToData(self))
+
+        return self.__execute(repository)
+
+    def __execute(self, repository, shift=None):
         if self.group_by and self.period:
-            result = self.__execute_period_group_query(repository)
+            return self.__execute_period_group_query(repository, shift)
         elif self.group_by:
-            result = self.__execute_grouped_query(repository)
+            return self.__execute_grouped_query(repository)
         elif self.period:
-            result = self.__execute_period_query(repository)
+            return self.__execute_period_query(repository, shift)
         else:
-            result = self.__execute_query(repository)
-
-        if self.delta:
-            result = self.__skip_blank_periods(result, repository)
-
-        return result
+            return self.__execute_query(repository)
 
     def __get_period_key(self):
         return self.period.start_at_key
 
-    def __execute_period_group_query(self, repository):
+    def __window(self, shift):
+        if shift is not None:
+            return shift.window
+        return self.start_at, self.end_at
+
+    def __execute_period_group_query(self, repository, shift=None):
         period_key = self.__get_period_key()
 
         cursor = repository.multi_group(
             self.group_by, period_key, self,
             sort=self.sort_by, limit=self.limit,
-            collect=self.collect
+            collect=self.collect, rows_filter=shift
         )
 
-        results = PeriodGroupedData(cursor, period=self.period)
+        with phases.timed("fill"):
+            results = PeriodGroupedData(cursor, period=self.period)
 
-        if self.start_at and self.end_at:
-            results.fill_missing_periods(
-                self.start_at, self.end_at, collect=self.collect)
+            start_at, end_at = self.__window(shift)
+            if start_at and end_at:
+                results.fill_missing_periods(
+                    start_at, end_at, collect=self.collect)
 
         return results
 
@@ -167,19 +227,22 @@ class Query(_Query):
         results = GroupedData(cursor)
         return results
 
-    def __execute_period_query(self, repository):
+    def __execute_period_query(self, repository, shift=None):
         period_key = self.__get_period_key()
         sort = [period_key, "ascending"]
         cursor = repository.group(
             period_key, self,
-            sort=sort, limit=self.limit, collect=self.collect
+            sort=sort, limit=self.limit, collect=self.collect,
+            rows_filter=shift
         )
 
-        results = PeriodData(cursor, period=self.period)
+        with phases.timed("fill"):
+            results = PeriodData(cursor, period=self.period)
 
-        if self.start_at and self.end_at:
-            results.fill_missing_periods(
-                self.start_at, self.end_at, collect=self.collect)
+            start_at, end_at = self.__window(shift)
+            if start_at and end_at:
+                results.fill_missing_periods(
+                    start_at, end_at, collect=self.collect)
 
         return results
 
@@ -187,5 +250,46 @@ class Query(_Query):
         cursor = repository.find(
             self, sort=self.sort_by, limit=self.limit)
 
-        results = SimpleData(cursor)
+        # The documents are read from mongo as the cursor is iterated
+        with phases.timed("mongo"):
+            results = SimpleData(cursor)
         return results
+
+    def __execute_streaming_query(self, repository):
+        cursor = repository.find(
+            self, sort=self.sort_by, limit=self.limit)
+
+        return StreamingData(cursor.batch_size(STREAM_BATCH_SIZE))
+
+
+class ShiftToData(object):
+    """Move the window of a duration query onto the periods with data
+
+    A query counting forward from start_at skips the empty periods at the
+    start of its window and one counting back from end_at skips those at
+    the end. Called with the grouped rows of the widened query, it works
+    out the window and returns only the rows inside it.
+    """
+    def __init__(self, query):
+        self._query = query
+        self.window = (query.start_at, query.end_at)
+
+    def __call__(self, rows):
+        query = self._query
+        key = query.period.start_at_key
+        start_at, end_at = self.window
+
+        starts = [row[key].replace(tzinfo=pytz.utc) for row in rows]
+        with_data = [start for start in starts if start_at <= start < end_at]
+        if with_data:
+            length = query.period.delta * abs(query.delta)
+            if query.delta > 0:
+                start_at = min(with_data)
+                end_at = start_at + length
+            else:
+                end_at = max(with_data) + query.period.delta
+                start_at = end_at - length
+            self.window = (start_at, end_at)
+
+        return [row for row, start in zip(rows, starts)
+                if start_at <= start < end_at]
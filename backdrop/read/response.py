@@ -1,7 +1,7 @@
 import datetime
 import pytz
 from backdrop.core.nested_merge import collect_key
-from backdrop.core.timeseries import timeseries, PERIODS
+from backdrop.core.timeseries import timeseries, fill_timeseries, PERIODS
 from dateutil.relativedelta import relativedelta
 
 
@@ -39,6 +39,13 @@ def first_nonempty(data, is_reversed):
     return first_nonempty_index
 
 
+def with_utc_timestamp(document):
+    if "_timestamp" in document:
+        document["_timestamp"] = \
+            document["_timestamp"].replace(tzinfo=pytz.utc)
+    return document
+
+
 class SimpleData(object):
     def __init__(self, cursor):
         self._data = []
@@ -46,10 +53,7 @@ class SimpleData(object):
             self.__add(doc)
 
     def __add(self, document):
-        if "_timestamp" in document:
-            document["_timestamp"] = \
-                document["_timestamp"].replace(tzinfo=pytz.utc)
-        self._data.append(document)
+        self._data.append(with_utc_timestamp(document))
 
     def data(self):
         return tuple(self._data)
@@ -59,6 +63,31 @@ class SimpleData(object):
         return 0
 
 
+class StreamingData(object):
+    """Raw query results read from the cursor as they are iterated
+
+    Only one batch of documents is held in memory at a time. The results
+    can only be iterated once.
+    """
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.count = 0
+        self.last = None
+
+    def __iter__(self):
+        for document in self._cursor:
+            self.count += 1
+            self.last = with_utc_timestamp(document)
+            yield self.last
+
+    def data(self):
+        return tuple(self)
+
+    def amount_to_shift(self, delta):
+        """This response type cannot be shifted"""
+        return 0
+
+
 class PeriodData(object):
     def __init__(self, cursor, period):
         self.period = period
@@ -142,14 +171,10 @@ class PeriodGroupedData(object):
         default = {"_count": 0}
         if collect:
             default.update((collect_key(k, v), None) for k, v in collect)
-        for i, _ in enumerate(self._data):
-            self._data[i]['values'] = timeseries(
-                start=start_date,
-                end=end_date,
-                period=self._period,
-                data=self._data[i]['values'],
-                default=default
-            )
+        boundaries = self._period.boundaries(start_date, end_date)
+        for group in self._data:
+            group['values'] = fill_timeseries(
+                boundaries, group['values'], default)
 
     def amount_to_shift(self, delta):
         is_reversed = delta < 0
@@ -0,0 +1,74 @@
+"""
+In-memory cache of serialized read api responses
+"""
+from collections import OrderedDict
+import hashlib
+import threading
+
+
+def _freeze(value):
+    """Turn lists into tuples so that a value can be used as a key
+
+    >>> _freeze([['a', 'b'], ('c', ['d'])])
+    (('a', 'b'), ('c', ('d',)))
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def cache_key(bucket_name, version, query):
+    """Return a key for a query against a version of a bucket"""
+    return bucket_name, version, _freeze(query)
+
+
+def query_etag(bucket_name, version, query):
+    """Return an ETag for a query against a version of a bucket
+
+    The ETag is the same in every process and only changes when the bucket
+    is written to, so it can be checked before the query is run.
+    """
+    period = query.period.name if query.period else None
+    key = cache_key(bucket_name, version, query._replace(period=period))
+    return hashlib.sha1(repr(key)).hexdigest()
+
+
+class ResultCache(object):
+    """An LRU cache of response bodies
+
+    The total size of the cached bodies is kept within max_size bytes.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def get(self, key):
+        """Return a cached body, or None if the key is not cached"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+            return entry
+
+    def set(self, key, body):
+        if len(body) > self.max_size:
+            return
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        body = self._entries.pop(key, None)
+        if body is not None:
+            self.size -= len(body)
@@ -0,0 +1,108 @@
+"""
+JSON serialization of read api responses
+
+Responses are encoded without indentation or spaces after separators,
+with their keys sorted as jsonify did. Datetimes and ObjectIds, the only
+non-JSON types found in bucket documents, are turned into strings before
+encoding, so the encoder never calls back into Python for them.
+
+simplejson is used when it is installed, as its C speedups can sort keys.
+The json module in Python 2.7 falls back to its pure Python encoder when
+sorting. The backend can be chosen with JSON_BACKEND.
+"""
+import datetime
+import json
+
+from bson import ObjectId
+
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
+
+
+SEPARATORS = (',', ':')
+
+ENCODERS = {
+    datetime.datetime: lambda obj: obj.isoformat(),
+    ObjectId: str,
+}
+
+BACKENDS = {
+    "json": json,
+    "simplejson": simplejson,
+}
+
+# Types the encoders handle themselves
+JSON_TYPES = frozenset([str, unicode, int, long, float, bool, type(None)])
+
+
+def default(obj):
+    """Return a JSON encodable version of a datetime or ObjectId
+
+    >>> default(datetime.datetime(2014, 1, 1))
+    '2014-01-01T00:00:00'
+    >>> default(ObjectId('52a9d7fd2da9f2c6f26cfe20'))
+    '52a9d7fd2da9f2c6f26cfe20'
+    """
+    encoder = ENCODERS.get(type(obj))
+    if encoder is None:
+        # Subclasses, eg. the datetimes made by freezegun
+        encoder = next((encoder for cls, encoder in ENCODERS.items()
+                        if isinstance(obj, cls)), None)
+    if encoder is None:
+        raise TypeError("{0!r} is not JSON serializable".format(obj))
+
+    return encoder(obj)
+
+
+def encodable(obj):
+    """Return obj with its datetimes and ObjectIds turned into strings
+
+    Dicts, lists and tuples are copied, and only values that are not
+    already JSON types are looked at further.
+
+    >>> encodable({"a": [datetime.datetime(2014, 1, 1)], "b": 1})
+    {'a': ['2014-01-01T00:00:00'], 'b': 1}
+    """
+    cls = type(obj)
+    if cls is dict:
+        return {key: value if type(value) in JSON_TYPES else encodable(value)
+                for key, value in obj.iteritems()}
+    if cls is list or cls is tuple:
+        return [value if type(value) in JSON_TYPES else encodable(value)
+                for value in obj]
+    if cls in JSON_TYPES:
+        return obj
+    return default(obj)
+
+
+class JsonSerializer(object):
+
+    def __init__(self, name, module):
+        self.name = name
+        self._module = module
+
+    def dumps(self, obj):
+        """Return obj encoded as compact JSON
+
+        >>> get_serializer("json").dumps({"b": [1, 2], "a": None})
+        '{"a":null,"b":[1,2]}'
+        """
+        return self._module.dumps(encodable(obj),
+                                  separators=SEPARATORS, sort_keys=True)
+
+
+def get_serializer(name="auto"):
+    """Return the serializer for a backend name
+
+    auto picks the fastest backend that is installed.
+    """
+    if name == "auto":
+        name = "simplejson" if simplejson is not None else "json"
+
+    module = BACKENDS.get(name)
+    if module is None:
+        raise ValueError("JSON backend {0} is not available".format(name))
+
+    return JsonSerializer(name, module)
@@ -2,6 +2,7 @@ from datetime import time
 from dateutil import parser
 import pytz
 import api
+from backdrop.core.pagination import decode_cursor, CursorError
 from backdrop.core.timeseries import PERIODS
 from ..core.validation import value_is_valid_datetime_string, valid, \
     invalid, key_is_valid
@@ -49,6 +50,8 @@ class ParameterValidator(Validator):
             'sort_by',
             'limit',
             'collect',
+            'cursor',
+            'fields',
         ])
         super(ParameterValidator, self).__init__(request_args)
 
@@ -218,6 +221,39 @@ class RawQueryValidator(Validator):
             self.add_error("querying for raw data is not allowed")
 
 
+class CursorValidator(Validator):
+    def validate(self, request_args, context):
+        if 'cursor' not in request_args:
+            return
+
+        if 'group_by' in request_args or 'period' in request_args:
+            self.add_error("cursor can only be used with raw queries")
+        if 'limit' not in request_args:
+            self.add_error("cursor can only be used with limit")
+        if request_args.get('sort_by', '_timestamp').split(':')[0] \
+                != '_timestamp':
+            self.add_error("cursor can only be used with queries sorted by "
+                           "_timestamp")
+        try:
+            decode_cursor(request_args['cursor'])
+        except CursorError:
+            self.add_error("cursor is not valid")
+
+
+class FieldsValidator(Validator):
+    def validate(self, request_args, context):
+        MultiValueValidator(
+            request_args,
+            param_name='fields',
+            validate_field_value=self.validate_field_value)
+
+    def validate_field_value(self, value, request_args, _):
+        if 'group_by' in request_args or 'period' in request_args:
+            self.add_error("fields can only be used with raw queries")
+        if not all(key_is_valid(field) for field in value.split(',')):
+            self.add_error("Cannot select an invalid field name")
+
+
 def _is_valid_date(string):
     return string and value_is_valid_datetime_string(string)
 
@@ -322,6 +358,8 @@ def validate_request_args(request_args, raw_queries_allowed=False):
                                  depends_on=['group_by', 'period']),
         RelativeTimeValidator(request_args),
         CollectValidator(request_args),
+        CursorValidator(request_args),
+        FieldsValidator(request_args),
     ]
 
     if not raw_queries_allowed:
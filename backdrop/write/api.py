@@ -1,4 +1,5 @@
 from os import getenv
+import copy
 import json
 
 from flask import Flask, request, jsonify, g
@@ -11,7 +12,9 @@ from backdrop.core.repository import (BucketConfigRepository,
 
 from ..core.errors import ParseError, ValidationError
 from ..core import database, log_handler, cache_control
+from ..core.database import BulkSaveError
 
+from .spool import WriteSpool
 from .validation import bearer_token_is_valid, extract_bearer_token
 
 
@@ -28,14 +31,36 @@ app.config.from_object(
 db = database.Database(
     app.config['MONGO_HOSTS'],
     app.config['MONGO_PORT'],
-    app.config['DATABASE_NAME']
+    app.config['DATABASE_NAME'],
+    database.mongo_client_options(app.config)
 )
 
-bucket_repository = BucketConfigRepository(db)
+bucket_repository = BucketConfigRepository(
+    db, app.config.get('BUCKET_CONFIG_TTL', 0))
 user_repository = UserConfigRepository(db)
 
 log_handler.set_up_logging(app, GOVUK_ENV)
 
+
+def store_spooled(bucket_name, data):
+    """Store writes that were spooled for a bucket"""
+    bucket_config = bucket_repository.retrieve(name=bucket_name)
+    if bucket_config is None:
+        app.logger.error("Dropping spooled writes to missing bucket {0}"
+                         .format(bucket_name))
+        return
+
+    Bucket(db, bucket_config).parse_and_store(data)
+
+
+write_spool = None
+if app.config.get('WRITE_SPOOL_DIRECTORY'):
+    write_spool = WriteSpool(app.config['WRITE_SPOOL_DIRECTORY'],
+                             store_spooled,
+                             app.config.get('WRITE_SPOOL_INTERVAL', 1),
+                             app.config.get('WRITE_SPOOL_SYNC', True),
+                             app.config.get('WRITE_SPOOL_MAX_ATTEMPTS', 10))
+
 app.url_map.converters["bucket"] = BucketConverter
 
 
@@ -58,7 +83,8 @@ def exception_handler(e):
 @cache_control.nocache
 def health_check():
     if db.alive():
-        return jsonify(status='ok', message='database seems fine')
+        return jsonify(status='ok', message='database seems fine',
+                       connections=database.report_pool_stats(db, 'write'))
     else:
         return jsonify(status='error',
                        message='cannot connect to database'), 500
@@ -145,11 +171,23 @@ def _write_to_bucket(bucket_config):
         data = listify_json(request.json)
 
         bucket = Bucket(db, bucket_config)
-        bucket.parse_and_store(data)
+        if write_spool is not None:
+            # Validate now, the records are parsed again when stored.
+            # Parsing changes them in place, so spool them as they came.
+            bucket.parse(copy.deepcopy(data))
+            write_spool.append(bucket.name, data)
+        else:
+            bucket.parse_and_store(data)
 
         return jsonify(status='ok')
     except (ParseError, ValidationError) as e:
         return jsonify(status="error", message=str(e)), 400
+    except BulkSaveError as e:
+        app.logger.error(str(e))
+        statsd.incr("write_api.bulk_save_error", bucket=g.bucket_name)
+        return jsonify(status="error", message=str(e),
+                       errors=[{"index": index, "message": message}
+                               for index, message in e.failures]), 500
 
 
 def listify_json(data):
@@ -1,7 +1,28 @@
 DATABASE_NAME = "backdrop"
 MONGO_HOSTS = ['localhost']
 MONGO_PORT = 27017
+# Where reads are sent: primary, primary_preferred, secondary,
+# secondary_preferred or nearest
+MONGO_READ_PREFERENCE = "primary"
+# Milliseconds slower than the nearest member a secondary can be to be read
+MONGO_SECONDARY_ACCEPTABLE_LATENCY_MS = 15
+# Connections kept open to each member of the replica set
+MONGO_MAX_POOL_SIZE = 50
+# Milliseconds to wait for a connection, and for a reply, before failing
+MONGO_CONNECT_TIMEOUT_MS = 2000
+MONGO_SOCKET_TIMEOUT_MS = 30000
 LOG_LEVEL = "DEBUG"
+# Seconds bucket configs are kept in memory, 0 reads them on every request
+BUCKET_CONFIG_TTL = 60
+# Directory writes are spooled to before being stored in the background,
+# None stores them during the request
+WRITE_SPOOL_DIRECTORY = None
+# Seconds between moving spooled writes into the database
+WRITE_SPOOL_INTERVAL = 1
+# Sync every spooled write to disk before acknowledging it
+WRITE_SPOOL_SYNC = True
+# Times a batch of spooled writes is tried before it is moved to failed/
+WRITE_SPOOL_MAX_ATTEMPTS = 10
 BUCKET_AUTO_ID_KEYS = {
     "lpa_volumes": ("key", "start_at", "end_at")
 }
@@ -0,0 +1,361 @@
+"""
+A local spool for writes to buckets
+
+When the write api is given a WRITE_SPOOL_DIRECTORY, validated writes are
+appended to a spool file in that directory and acknowledged straight away.
+A background thread moves the spooled writes into mongo in batches.
+
+Each process appends to its own file and holds a lock on it. Every flush
+the file is renamed to .ready and a new one is started. Ready files, and
+the files of processes that have died, are stored and then deleted.
+
+The writes in a file are stored in one batch per bucket. Each batch that
+is stored is noted in a .progress file next to it, so a batch is not sent
+again when another batch in the file fails. Only a crash between storing
+a batch and noting it can store a write twice.
+
+A batch that fails is retried by later flushes, and later batches for the
+same bucket wait for it so writes are stored in order. Batches that fail
+max_attempts times, or that can never be stored, are moved to a dead
+letter file in the failed/ directory. Records a bulk save rejected are
+moved there on their own, as the rest of their batch was stored. Dead
+letter files are in the spool format, so they can be moved back into the
+spool directory as .ready files to store them again.
+"""
+import copy
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+from backdrop import statsd
+from backdrop.core.database import BulkSaveError
+from backdrop.core.errors import BackdropError
+
+
+log = logging.getLogger(__name__)
+
+ACTIVE_SUFFIX = ".spool"
+READY_SUFFIX = ".ready"
+PROGRESS_SUFFIX = ".progress"
+FAILED_DIRECTORY = "failed"
+
+# Outcomes of storing a batch noted in a progress file
+STORED = "stored"
+DEAD = "dead"
+ATTEMPTED = "attempted"
+
+
+class WriteSpool(object):
+    """Append writes to a local file and store them in the background
+
+    store is called with a bucket name and the list of records written to
+    it, in the order they were written. Writes are stored every interval
+    seconds, or only when flush is called if interval is None. A batch that
+    store fails on max_attempts times is moved to a dead letter file.
+    """
+
+    def __init__(self, directory, store, interval=1, sync=True,
+                 max_attempts=10):
+        self.directory = directory
+        self._store = store
+        self._interval = interval
+        self._sync = sync
+        self._max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._file = None
+        self._sequence = 0
+        self._flusher_pid = None
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def append(self, bucket_name, data):
+        """Durably add a write to the spool"""
+        self.start()
+
+        line = json.dumps({
+            "bucket": bucket_name,
+            "data": data,
+            "spooled_at": time.time(),
+        }, separators=(',', ':')) + "\n"
+
+        with self._lock:
+            if self._file is None:
+                self._file = self._open()
+            self._file.write(line)
+            self._file.flush()
+            if self._sync:
+                os.fsync(self._file.fileno())
+
+    def _open(self):
+        self._sequence += 1
+        path = os.path.join(self.directory, "{0}-{1}-{2}{3}".format(
+            os.getpid(), int(time.time()), self._sequence, ACTIVE_SUFFIX))
+        spool_file = open(path, "a")
+        # Tells flushes in other processes that this file is in use
+        fcntl.flock(spool_file, fcntl.LOCK_EX)
+        return spool_file
+
+    def rotate(self):
+        """Mark the current file as ready to store and start a new one"""
+        with self._lock:
+            if self._file is None:
+                return
+            # Renamed while still locked so it is never seen as abandoned
+            path = self._file.name
+            os.rename(path, path[:-len(ACTIVE_SUFFIX)] + READY_SUFFIX)
+            self._file.close()
+            self._file = None
+
+    def start(self):
+        """Start the background flush in this process if it is not running
+
+        Checked on every append, as a thread started before the app server
+        forks does not run in the workers.
+        """
+        if self._flusher_pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            # A file opened before a fork belongs to the parent
+            self._file = None
+            if self._interval is None:
+                return
+            thread = threading.Thread(target=self._run)
+            thread.daemon = True
+            thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self._interval)
+            try:
+                self.flush()
+            except Exception as e:
+                log.exception(e)
+
+    def flush(self):
+        """Store every write spooled so far, return how many were stored
+
+        Batches that fail are logged and left for the next flush.
+        """
+        self.rotate()
+
+        stored = 0
+        # Buckets with a batch that failed, whose later batches must wait
+        blocked = set()
+        paths = sorted(glob.glob(os.path.join(self.directory,
+                                              "*" + READY_SUFFIX)) +
+                       glob.glob(os.path.join(self.directory,
+                                              "*" + ACTIVE_SUFFIX)))
+        for path in paths:
+            stored += self._flush_file(path, blocked)
+
+        _remove_orphaned_progress(self.directory)
+        return stored
+
+    def _flush_file(self, path, blocked):
+        spool_file = _claim(path)
+        if spool_file is None:
+            return 0
+
+        stored = 0
+        try:
+            writes = list(_read_writes(spool_file))
+            progress = Progress(path + PROGRESS_SUFFIX)
+            for index, (bucket_name, data, lag, count) in enumerate(
+                    _batch_by_bucket(writes)):
+                if progress.is_done(index):
+                    continue
+                if bucket_name in blocked:
+                    progress.complete = False
+                    continue
+                outcome = self._store_batch(path, index, progress,
+                                            bucket_name, data, lag)
+                if outcome == STORED:
+                    stored += count
+                elif outcome == ATTEMPTED:
+                    blocked.add(bucket_name)
+
+            if progress.complete:
+                os.remove(path)
+                progress.remove()
+        finally:
+            spool_file.close()
+
+        return stored
+
+    def _store_batch(self, path, index, progress, bucket_name, data, lag):
+        """Store a batch and return the outcome noted in its progress
+
+        The outcome is STORED, DEAD if it was moved to a dead letter file or
+        ATTEMPTED if it is left for a later flush.
+        """
+        try:
+            # Parsing records changes them in place, keep the data as spooled
+            self._store(bucket_name, copy.deepcopy(data))
+        except BulkSaveError as e:
+            log.error("Spooled writes to {0} were rejected: {1}".format(
+                bucket_name, e.message))
+            self._dead_letter(path, index, bucket_name,
+                              [data[i] for i, _ in e.failures], lag,
+                              e.message)
+            return progress.note(index, DEAD)
+        except Exception as e:
+            log.exception(e)
+            progress.note(index, ATTEMPTED)
+            attempts = progress.attempts(index)
+            if not isinstance(e, BackdropError) and \
+                    attempts < self._max_attempts:
+                progress.complete = False
+                return ATTEMPTED
+            self._dead_letter(path, index, bucket_name, data, lag, str(e))
+            return progress.note(index, DEAD)
+
+        statsd.incr("write.spool.stored", len(data), bucket=bucket_name)
+        statsd.timing("write.spool.lag", lag * 1000, bucket=bucket_name)
+        return progress.note(index, STORED)
+
+    def _dead_letter(self, path, index, bucket_name, data, lag, error):
+        """Move writes that cannot be stored to a file of their own"""
+        directory = os.path.join(self.directory, FAILED_DIRECTORY)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        dead_letter_path = os.path.join(directory, "{0}-{1}{2}".format(
+            os.path.splitext(os.path.basename(path))[0], index,
+            READY_SUFFIX))
+        with open(dead_letter_path, "w") as dead_letter:
+            dead_letter.write(json.dumps({
+                "bucket": bucket_name,
+                "data": data,
+                "spooled_at": time.time() - lag,
+                "error": error,
+            }, separators=(',', ':')) + "\n")
+            dead_letter.flush()
+            os.fsync(dead_letter.fileno())
+
+        log.error("Moved {0} spooled writes to {1} to {2}".format(
+            len(data), bucket_name, dead_letter_path))
+        statsd.incr("write.spool.failed", len(data), bucket=bucket_name)
+
+
+class Progress(object):
+    """The outcomes of storing the batches of a spool file
+
+    Outcomes are appended to a file as they happen, so they survive the
+    process. complete is cleared when a batch is left to be stored later.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.complete = True
+        self._done = set()
+        self._attempts = {}
+        if os.path.exists(path):
+            with open(path) as progress_file:
+                for line in progress_file:
+                    self._read(line)
+
+    def _read(self, line):
+        try:
+            index, outcome = line.split()
+            index = int(index)
+        except ValueError:
+            # The end of a note cut short by a crash
+            return
+        if outcome == ATTEMPTED:
+            self._attempts[index] = self._attempts.get(index, 0) + 1
+        else:
+            self._done.add(index)
+
+    def is_done(self, index):
+        return index in self._done
+
+    def attempts(self, index):
+        return self._attempts.get(index, 0)
+
+    def note(self, index, outcome):
+        """Durably note the outcome of a batch and return it"""
+        line = "{0} {1}\n".format(index, outcome)
+        with open(self.path, "a") as progress_file:
+            progress_file.write(line)
+            progress_file.flush()
+            os.fsync(progress_file.fileno())
+        self._read(line)
+        return outcome
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            # There was no progress to note, or it was already removed
+            pass
+
+
+def _remove_orphaned_progress(directory):
+    """Remove the progress of files that were stored before a crash"""
+    for path in glob.glob(os.path.join(directory, "*" + PROGRESS_SUFFIX)):
+        if not os.path.exists(path[:-len(PROGRESS_SUFFIX)]):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _claim(path):
+    """Lock a spool file for flushing, None if it is in use or gone"""
+    try:
+        spool_file = open(path, "r")
+    except IOError:
+        return None
+
+    try:
+        fcntl.flock(spool_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # Another flush may have stored and removed it before it was locked
+        if os.fstat(spool_file.fileno()).st_ino != os.stat(path).st_ino:
+            raise OSError("{0} was replaced".format(path))
+    except (IOError, OSError):
+        spool_file.close()
+        return None
+
+    return spool_file
+
+
+def _read_writes(spool_file):
+    for line in spool_file:
+        try:
+            write = json.loads(line)
+        except ValueError:
+            # The end of a write that was cut short by a crash
+            log.warning("Skipping a partial write in {0}".format(
+                spool_file.name))
+            continue
+        yield write
+
+
+def _batch_by_bucket(writes):
+    """Return (bucket name, records, lag, writes) tuples, one per bucket
+
+    Records keep the order they were written in, lag is the age in seconds
+    of the oldest write and writes is how many writes the records came
+    from.
+    """
+    batches = []
+    by_bucket = {}
+    now = time.time()
+    for write in writes:
+        name = write["bucket"]
+        if name not in by_bucket:
+            by_bucket[name] = [name, [], now - write["spooled_at"], 0]
+            batches.append(by_bucket[name])
+        by_bucket[name][1].extend(write["data"])
+        by_bucket[name][3] += 1
+
+    return [tuple(batch) for batch in batches]
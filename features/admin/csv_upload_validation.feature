@@ -35,8 +35,9 @@ Feature: csv upload validation
     Then  I should see the text "There was an error with your upload"
     And   the platform should have "0" items stored in "foo"
 
-  Scenario: file too large
-    Given a file named "data.csv" of size "1000000" bytes
+  Scenario: file too big to scan for viruses
+    # clamd stops reading streams over its StreamMaxLength, 25M by default
+    Given a file named "data.csv" of size "26300000" bytes
     And   I have a bucket named "foo"
     And   bucket setting upload_format is "csv"
     And   I am logged in
@@ -45,6 +46,7 @@ Feature: csv upload validation
     And   I enter "data.csv" into the file upload field
     And   I click "Upload"
     Then  I should see the text "There was an error with your upload"
+    And   I should see the text "file too big to scan for viruses"
     And   the platform should have "0" items stored in "foo"
 
   Scenario: non UTF8 characters
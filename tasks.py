@@ -1,13 +1,17 @@
 import json
 import os
+import sys
 from invoke import task
 from os import getenv
 from backdrop.core import database
 from backdrop.core.user import UserConfig
 from backdrop.write.api import app
 from backdrop.core.bucket import BucketConfig
+from backdrop.core.indexes import bucket_indexes, reconcile_indexes, \
+    suggest_indexes, normalise_spec, QueryShapeRecorder
 from backdrop.core.repository import BucketConfigRepository,\
     UserConfigRepository
+from backdrop.core.rollups import BucketRollups
 
 
 def environment():
@@ -75,3 +79,61 @@ def load_seed():
     save_all("user-seed.json",
              UserConfigRepository,
              UserConfig)
+
+
+@task
+def ensure_indexes(bucket=None, prune=False):
+    """Create the indexes configured for one or all buckets.
+
+    With prune, indexes that are not configured are dropped."""
+    db = get_database()
+    repository = BucketConfigRepository(db)
+
+    if bucket is None:
+        configs = repository.get_all()
+    else:
+        config = repository.retrieve(bucket)
+        if config is None:
+            sys.exit("{0}: no such bucket".format(bucket))
+        configs = [config]
+
+    for config in configs:
+        created, dropped = reconcile_indexes(
+            db.get_collection(config.name), bucket_indexes(config), prune)
+        for spec in created:
+            print("{0}: created {1}".format(config.name, spec))
+        for spec in dropped:
+            print("{0}: dropped {1}".format(config.name, spec))
+
+
+@task
+def suggest_bucket_indexes(bucket):
+    """Suggest indexes for a bucket from the queries it has received."""
+    db = get_database()
+    recorder = QueryShapeRecorder(db, sample_rate=0)
+    existing = [normalise_spec(keys)
+                for keys in db.get_collection(bucket).index_keys()]
+
+    suggestions = suggest_indexes(recorder.shapes(bucket), existing)
+    if not suggestions:
+        print("{0}: no suggestions".format(bucket))
+
+    for spec, count in suggestions:
+        print("{0}: {1} (serves {2} sampled queries)".format(
+            bucket, [list(pair) for pair in spec], count))
+
+
+@task
+def rebuild_rollups(bucket):
+    """Recompute the rollups of a bucket from its records, eg. after a
+    backfill."""
+    db = get_database()
+    config = BucketConfigRepository(db).retrieve(bucket)
+
+    if config is None:
+        sys.exit("{0}: no such bucket".format(bucket))
+    if not config.rollups:
+        print("{0}: no rollups configured".format(bucket))
+        return
+
+    BucketRollups(db, config.name, config.rollups).rebuild()
@@ -0,0 +1,83 @@
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+
+# The EICAR test file, which virus scanners report as a virus
+EICAR = (r'X5O!P%@AP[4\PZX54(P^)7CC)7}$'
+         r'EICAR-STANDARD-ANTIVIRUS-TEST-FILE!$H+H*')
+
+
+class StubClamd(object):
+    """A stand-in for clamd that answers INSTREAM commands on a unix socket
+
+    Streams containing the EICAR test string are reported as viruses and
+    every stream received is kept in streams. Like clamd, streams over
+    stream_max_length bytes are cut off with an error.
+    """
+    def __init__(self, reply=None, stream_max_length=None):
+        self.reply = reply
+        self.stream_max_length = stream_max_length
+        self.streams = []
+        self.commands = []
+        self._directory = tempfile.mkdtemp()
+        self.address = os.path.join(self._directory, 'clamd.ctl')
+
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.address)
+        self._server.listen(1)
+
+        thread = threading.Thread(target=self._serve)
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        self._server.close()
+        shutil.rmtree(self._directory)
+
+    def _serve(self):
+        while True:
+            try:
+                connection, _ = self._server.accept()
+            except socket.error:
+                return
+            try:
+                self._handle(connection)
+            finally:
+                connection.close()
+
+    def _handle(self, connection):
+        connection_file = connection.makefile('rb')
+        self.commands.append(_read_until(connection_file, '\0'))
+
+        chunks = []
+        received = 0
+        while True:
+            length, = struct.unpack('!L', connection_file.read(4))
+            if length == 0:
+                break
+            received += length
+            if self.stream_max_length is not None and \
+                    received > self.stream_max_length:
+                connection.sendall('INSTREAM size limit exceeded. ERROR\0')
+                return
+            chunks.append(connection_file.read(length))
+        stream = ''.join(chunks)
+        self.streams.append(stream)
+
+        if self.reply is not None:
+            reply = self.reply
+        elif EICAR in stream:
+            reply = 'stream: Eicar-Test-Signature FOUND'
+        else:
+            reply = 'stream: OK'
+        connection.sendall(reply + '\0')
+
+
+def _read_until(connection_file, terminator):
+    read = ''
+    while not read.endswith(terminator):
+        read += connection_file.read(1)
+    return read
@@ -1,45 +1,57 @@
+from StringIO import StringIO
 import unittest
 from hamcrest import assert_that, is_
-from mock import Mock
-from backdrop.admin.scanned_file import ScannedFile
-import subprocess
-import os
-from tests.admin.support.file_upload_test_case import FileUploadTestCase
+from mock import patch
+from backdrop.admin import scanned_file
+from backdrop.admin.scanned_file import ScannedFile, StreamTooLargeError, \
+    clamd_address
+from tests.admin.support.clamd import StubClamd, EICAR
 
 
-class TestScannedFile(FileUploadTestCase):
+class TestScannedFile(unittest.TestCase):
 
     def setUp(self):
-        self.file_object = self._file_storage_wrapper("This is a test", browser_filename="abc.txt")
-        self.scanner = ScannedFile(self.file_object)
+        self.clamd = StubClamd()
 
     def tearDown(self):
-        try:
-            os.remove('/tmp/abc.txt')
-        except OSError:
-            pass
+        self.clamd.close()
+
+    def scan(self, contents):
+        return ScannedFile(StringIO(contents),
+                           self.clamd.address).has_virus_signature
+
+    def test_clean_files_have_no_virus_signature(self):
+        assert_that(self.scan("This is a test"), is_(False))
 
     def test_has_virus_signature(self):
-        self.scanner._virus_signature = True
-        self.scanner._save_file_to_disk = Mock()
-        self.scanner._scan_file = Mock()
-        self.scanner._clean_up = Mock()
-        assert_that(self.scanner.has_virus_signature, is_(True))
-        self.scanner._save_file_to_disk.assert_called_once_with()
-        self.scanner._scan_file.assert_called_once_with()
-        self.scanner._clean_up.assert_called_once_with()
-
-    def test_saving_a_file_to_disk(self):
-        self.scanner._save_file_to_disk()
-        assert_that(file('/tmp/abc.txt').read(), is_("This is a test"))
-
-    def test_cleaning_up_after_scanning(self):
-        self.file_object.save('/tmp/abc.txt')
-        self.scanner._clean_up()
-        assert_that(os.path.exists('/tmp/abc.txt'), is_(False))
-
-    def test_scanning_a_file(self):
-        self.scanner._clamscan = Mock(return_value=True)
-        self.scanner._scan_file()
-        assert_that(self.scanner._virus_signature, is_(True))
-        self.scanner._clamscan.assert_called_once_with("/tmp/abc.txt")
+        assert_that(self.scan("This is a " + EICAR), is_(True))
+
+    def test_files_are_streamed_to_clamd(self):
+        contents = "a" * (scanned_file.CHUNK_SIZE * 2 + 1)
+
+        self.scan(contents)
+
+        assert_that(self.clamd.commands, is_(["zINSTREAM\0"]))
+        assert_that(self.clamd.streams, is_([contents]))
+
+    def test_clamd_errors_are_raised(self):
+        self.clamd.reply = "lstat() failed: Permission denied. ERROR"
+
+        self.assertRaises(SystemError, self.scan, "This is a test")
+
+    def test_files_over_the_clamd_stream_limit_are_too_large(self):
+        self.clamd.stream_max_length = scanned_file.CHUNK_SIZE
+
+        self.assertRaises(StreamTooLargeError, self.scan,
+                          "a" * (scanned_file.CHUNK_SIZE * 64))
+
+
+class TestClamdAddress(unittest.TestCase):
+
+    @patch.dict('os.environ', {'CLAMD_SOCKET': '/tmp/clamd.socket'})
+    def test_unix_socket_address(self):
+        assert_that(clamd_address(), is_('/tmp/clamd.socket'))
+
+    @patch.dict('os.environ', {'CLAMD_SOCKET': 'localhost:3310'})
+    def test_tcp_address(self):
+        assert_that(clamd_address(), is_(('localhost', 3310)))
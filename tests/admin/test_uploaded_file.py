@@ -2,6 +2,7 @@ from hamcrest import assert_that, is_, equal_to
 from mock import Mock, patch
 from backdrop.admin.uploaded_file import UploadedFile, FileUploadError
 from backdrop.admin.scanned_file import ScannedFile, VirusSignatureError
+from tests.admin.support.clamd import StubClamd, EICAR
 from tests.admin.support.file_upload_test_case import FileUploadTestCase
 
 
@@ -12,12 +13,14 @@ class TestUploadedFile(FileUploadTestCase):
         upload = self._uploaded_file_wrapper(contents)
         assert_that(upload.file_stream().read(), is_(contents))
 
+    @patch.object(UploadedFile, 'MAX_FILE_SIZE', 1000000)
     def test_files_under_1000000_octets_are_valid(self):
         csv_length_999999 = '\n'.join(['aa,bb,ccc' for i in range(100000)])
         upload = self._uploaded_file_wrapper(contents=csv_length_999999)
 
         assert_that(upload.valid, is_(True))
 
+    @patch.object(UploadedFile, 'MAX_FILE_SIZE', 1000000)
     def test_files_over_1000000_octets_are_not_valid(self):
         csv_length_1000009 = '\n'.join(['aa,bb,ccc' for i in range(100001)])
         upload = self._uploaded_file_wrapper(contents=csv_length_1000009)
@@ -59,6 +62,56 @@ class TestUploadedFileContentTypeValidation(FileUploadTestCase):
         upload = self._uploaded_file_wrapper(fixture_name='donothing.exe')
         assert_that(upload.valid, is_(False))
 
+    def test_the_type_is_worked_out_from_the_contents(self):
+        upload = self._file_storage_wrapper(
+            contents='a,b\n1,2\n', browser_filename='data.xlsx')
+
+        assert_that(UploadedFile(upload).guessed_mimetype, is_('text/csv'))
+
+    def test_exe_files_with_a_spreadsheet_name_are_not_valid(self):
+        with open('features/fixtures/donothing.exe') as f:
+            storage = self._file_storage_wrapper(
+                contents=f.read(), browser_filename='data.xls')
+        upload = UploadedFile(storage)
+        upload._is_potential_virus = Mock(return_value=False)
+
+        assert_that(upload.valid, is_(False))
+
     def test_perform_virus_scan(self):
         upload = self._uploaded_file_wrapper('[fake empty content]', is_virus=True)
         assert_that(upload.valid, is_(False))
+
+
+class TestUploadedFileSpooling(FileUploadTestCase):
+    def setUp(self):
+        self.clamd = StubClamd()
+
+    def tearDown(self):
+        self.clamd.close()
+
+    def test_size_and_hash_are_computed_while_saving(self):
+        upload = self._uploaded_file_from_contents('This is a test')
+
+        assert_that(upload.file_size, is_(14))
+        assert_that(upload.sha256, is_(
+            'c7be1ed902fb8dd4d48997c6452f5d7e'
+            '509fbcdbe2808b16bcf4edce4c07d14e'))
+
+    @patch.dict('os.environ', {'SKIP_VIRUS_SCAN': ''})
+    def test_the_saved_file_is_scanned_once(self):
+        with patch.dict('os.environ', {'CLAMD_SOCKET': self.clamd.address}):
+            upload = self._uploaded_file_from_contents(EICAR)
+
+            assert_that(upload.valid, is_(False))
+            assert_that(upload.valid, is_(False))
+
+        assert_that(self.clamd.streams, is_([EICAR]))
+
+    @patch.dict('os.environ', {'SKIP_VIRUS_SCAN': ''})
+    def test_files_too_big_to_scan_are_not_valid(self):
+        self.clamd.stream_max_length = 4
+        with patch.dict('os.environ', {'CLAMD_SOCKET': self.clamd.address}):
+            upload = self._uploaded_file_from_contents('This is a test')
+
+            assert_that(upload.valid, is_(False))
+            self.assertRaises(FileUploadError, upload.validate)
@@ -5,7 +5,7 @@ from hamcrest import *
 from pymongo import MongoClient
 
 from backdrop.core.database import Repository, GroupingError, \
-    InvalidSortError, MongoDriver, Database
+    InvalidSortError, MongoDriver, Database, InvalidOperationError
 from backdrop.read.query import Query
 from tests.support.test_helpers import d, d_tz
 
@@ -44,6 +44,33 @@ class TestMongoDriver(unittest.TestCase):
 
         assert_that(saved_documents, only_contains(updated_document))
 
+    def test_save_all(self):
+        self.mongo_driver.save_all([
+            {'name': 'test_document'},
+            {'_id': 'second', 'name': '2nd_test_document'},
+        ])
+
+        results = self.mongo_collection.find()
+        assert_that(results, contains_inanyorder(
+            has_entries({'name': 'test_document'}),
+            has_entries({'_id': 'second', 'name': '2nd_test_document'}),
+        ))
+
+    def test_save_all_updates_documents_with_id(self):
+        self.mongo_driver.save_all([{"_id": "event1", "title": "first"}])
+        self.mongo_driver.save_all([{"_id": "event1", "title": "second"}])
+
+        saved_documents = self.mongo_collection.find()
+
+        assert_that(saved_documents,
+                    only_contains({"_id": "event1", "title": "second"}))
+
+    def test_save_all_across_several_chunks(self):
+        self.mongo_driver.save_all([{"n": i} for i in range(25)],
+                                   chunk_size=10)
+
+        assert_that(self.mongo_collection.count(), is_(25))
+
     def test_find_one(self):
         self._setup_people()
 
@@ -91,7 +118,7 @@ class TestMongoDriver(unittest.TestCase):
     def test_group(self):
         self._setup_musical_instruments()
 
-        results = self.mongo_driver.group(keys=["type"], query={}, collect_fields=[])
+        results = self.mongo_driver.group(keys=["type"], query={}, collect=[])
 
         assert_that(results, contains_inanyorder(
             has_entries({"_count": is_(2), "type": "wind"}),
@@ -103,7 +130,7 @@ class TestMongoDriver(unittest.TestCase):
 
         results = self.mongo_driver.group(keys=["type"],
                                           query={"range": "high"},
-                                          collect_fields=[])
+                                          collect=[])
 
         assert_that(results, contains_inanyorder(
             has_entries({"_count": is_(1), "type": "wind"}),
@@ -113,36 +140,67 @@ class TestMongoDriver(unittest.TestCase):
     def test_group_and_collect_additional_properties(self):
         self._setup_musical_instruments()
 
-        results = self.mongo_driver.group(keys=["type"], query={}, collect_fields=["range"])
+        results = self.mongo_driver.group(keys=["type"], query={}, collect=[("range", "set")])
 
-        assert_that(results, contains(
+        assert_that(results, contains_inanyorder(
             has_entries(
                 {"_count": is_(2),
                  "type": "wind",
-                 "range": ["high", "low"]}),
+                 "range:set": contains_inanyorder("high", "low")}),
+            has_entries(
+                {"_count": is_(3),
+                 "type": "string",
+                 "range:set": contains_inanyorder("high", "low")})
+        ))
+
+    def test_group_and_reduce_collected_values(self):
+        self.mongo_collection.save({"type": "wind", "value": 2})
+        self.mongo_collection.save({"type": "wind", "value": 4})
+        self.mongo_collection.save({"type": "wind"})
+        self.mongo_collection.save({"type": "string", "value": 1.5})
+
+        results = self.mongo_driver.group(
+            keys=["type"], query={},
+            collect=[("value", "sum"), ("value", "count"), ("value", "mean")])
+
+        assert_that(results, contains_inanyorder(
             has_entries(
                 {"_count": is_(3),
+                 "type": "wind",
+                 "value:sum": 6,
+                 "value:count": 2,
+                 "value:mean": (6, 2)}),
+            has_entries(
+                {"_count": is_(1),
                  "type": "string",
-                 "range": ["high", "high", "low"]})
+                 "value:sum": 1.5,
+                 "value:count": 1,
+                 "value:mean": (1.5, 1)})
         ))
 
+    def test_group_and_sum_non_numeric_values(self):
+        self.mongo_collection.save({"type": "wind", "value": "flute"})
+
+        self.assertRaises(InvalidOperationError, self.mongo_driver.group,
+                          ["type"], {}, [("value", "sum")])
+
     def test_group_and_collect_with_hyphen_in_field_name(self):
         self.mongo_collection.save({"type": "foo", "this-name": "bar"})
         self.mongo_collection.save({"type": "foo", "this-name": "bar"})
         self.mongo_collection.save({"type": "bar", "this-name": "bar"})
         self.mongo_collection.save({"type": "bar", "this-name": "foo"})
 
-        results = self.mongo_driver.group(keys=["type"], query={}, collect_fields=["this-name"])
+        results = self.mongo_driver.group(keys=["type"], query={}, collect=[("this-name", "set")])
 
-        assert_that(results, contains(
+        assert_that(results, contains_inanyorder(
             has_entries(
                 {"_count": is_(2),
                  "type": "foo",
-                 "this-name": ["bar", "bar"]}),
+                 "this-name:set": ["bar"]}),
             has_entries(
                 {"_count": is_(2),
                  "type": "bar",
-                 "this-name": ["bar", "foo"]})
+                 "this-name:set": contains_inanyorder("bar", "foo")})
         ))
 
     def test_group_and_collect_with_injection_attempt(self):
@@ -152,9 +210,9 @@ class TestMongoDriver(unittest.TestCase):
         self.mongo_collection.save({"type": "bar", "this-name": "foo"})
 
         for collect_field in ["name']-foo", "name\\']-foo"]:
-            results = self.mongo_driver.group(keys=["type"], query={}, collect_fields=[collect_field])
+            results = self.mongo_driver.group(keys=["type"], query={}, collect=[(collect_field, "set")])
 
-            assert_that(results, contains(
+            assert_that(results, contains_inanyorder(
                 has_entries(
                     {"_count": is_(2),
                      "type": "foo"}),
@@ -169,23 +227,23 @@ class TestMongoDriver(unittest.TestCase):
         self.mongo_collection.save({"foo": "two", "bar": True})
         self.mongo_collection.save({"foo": "one", "bar": False})
 
-        results = self.mongo_driver.group(["foo"], {}, ["bar"])
+        results = self.mongo_driver.group(["foo"], {}, [("bar", "set")])
 
-        assert_that(results, contains(
+        assert_that(results, contains_inanyorder(
             has_entries({
-                "bar": [False, False]
+                "bar:set": [False]
             }),
             has_entries({
-                "bar": [True, True]
+                "bar:set": [True]
             })
         ))
 
     def test_group_without_keys(self):
         self._setup_people()
 
-        results = self.mongo_driver.group(keys=[], query={}, collect_fields=[])
+        results = self.mongo_driver.group(keys=[], query={}, collect=[])
 
-        assert_that(results, contains(
+        assert_that(results, contains_inanyorder(
             has_entries({"_count": is_(4)}),
         ))
 
@@ -194,14 +252,22 @@ class TestMongoDriver(unittest.TestCase):
         self._setup_people()
         self.mongo_collection.save({"name": "Yoko"})
 
-        results = self.mongo_driver.group(keys=["plays"], query={}, collect_fields=[])
+        results = self.mongo_driver.group(keys=["plays"], query={}, collect=[])
 
-        assert_that(results, contains(
+        assert_that(results, contains_inanyorder(
             has_entries({"_count": is_(2), "plays": "guitar"}),
             has_entries({"_count": is_(1), "plays": "bass"}),
             has_entries({"_count": is_(1), "plays": "drums"}),
         ))
 
+    def test_group_with_more_than_20000_unique_keys(self):
+        self.mongo_driver.save_all([{"key": i} for i in range(20001)])
+
+        results = self.mongo_driver.group(keys=["key"], query={},
+                                          collect=[])
+
+        assert_that(len(results), is_(20001))
+
     def _setup_people(self):
         self.mongo_collection.save({"name": "George", "plays": "guitar"})
         self.mongo_collection.save({"name": "John", "plays": "guitar"})
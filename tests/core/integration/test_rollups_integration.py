@@ -0,0 +1,93 @@
+import unittest
+
+from pymongo import MongoClient
+from hamcrest import assert_that, is_
+
+from backdrop.core import database, bucket
+from backdrop.core.bucket import BucketConfig
+from backdrop.core.records import parse_all
+from backdrop.core.timeseries import WEEK
+from backdrop.read.query import Query
+from tests.support.test_helpers import d_tz
+
+HOST = ['localhost']
+PORT = 27017
+DB_NAME = 'performance_platform_test'
+BUCKET = 'rollups_integration_test'
+ROLLUPS = [
+    {"period": "week", "fields": ["value"]},
+    {"period": "week", "group_by": "channel", "fields": ["value"]},
+]
+
+
+class TestRollupsIntegration(unittest.TestCase):
+
+    def setUp(self):
+        self.db = database.Database(HOST, PORT, DB_NAME)
+        self.raw_bucket = bucket.Bucket(self.db, BucketConfig(
+            BUCKET, data_group="group", data_type="type"))
+        self.bucket = bucket.Bucket(self.db, BucketConfig(
+            BUCKET, data_group="group", data_type="type", rollups=ROLLUPS))
+        self.mongo_db = MongoClient(HOST, PORT)[DB_NAME]
+
+    def tearDown(self):
+        self.mongo_db.drop_collection(BUCKET)
+        for rollup in self.bucket.rollups.rollups:
+            self.mongo_db.drop_collection(rollup.collection_name(BUCKET))
+
+    def store(self, data):
+        self.bucket.store(parse_all(data))
+
+    def assert_rollup_matches_raw(self, query):
+        assert_that(self.bucket.rollups.driver_for(query) is not None)
+        assert_that(self.bucket.query(query).data(),
+                    is_(self.raw_bucket.query(query).data()))
+
+    def test_period_queries_match_the_raw_records(self):
+        self.store([
+            {"_timestamp": "2013-01-07T10:00:00+00:00", "value": 3},
+            {"_timestamp": "2013-01-08T10:00:00+00:00", "value": 4},
+            {"_timestamp": "2013-01-15T10:00:00+00:00"},
+        ])
+        self.store([
+            {"_timestamp": "2013-01-15T10:00:00+00:00", "value": 10},
+        ])
+
+        self.assert_rollup_matches_raw(Query.create(
+            period=WEEK, start_at=d_tz(2013, 1, 7), end_at=d_tz(2013, 1, 28),
+            collect=[("value", "sum"), ("value", "mean"),
+                     ("value", "count")]))
+
+    def test_period_group_queries_match_the_raw_records(self):
+        self.store([
+            {"_timestamp": "2013-01-07T10:00:00+00:00",
+             "channel": "web", "value": 3},
+            {"_timestamp": "2013-01-07T10:00:00+00:00",
+             "channel": "phone", "value": 4},
+            {"_timestamp": "2013-01-15T10:00:00+00:00",
+             "channel": "web", "value": 5},
+        ])
+
+        self.assert_rollup_matches_raw(Query.create(
+            period=WEEK, group_by="channel",
+            collect=[("value", "sum")]))
+
+    def test_replaced_records_are_not_counted_twice(self):
+        self.store([{"_id": "a", "_timestamp": "2013-01-07T10:00:00+00:00",
+                     "value": 3}])
+        self.store([{"_id": "a", "_timestamp": "2013-01-07T10:00:00+00:00",
+                     "value": 5}])
+
+        self.assert_rollup_matches_raw(Query.create(
+            period=WEEK, collect=[("value", "sum")]))
+
+    def test_rebuild_matches_the_raw_records(self):
+        self.raw_bucket.store(parse_all([
+            {"_timestamp": "2013-01-07T10:00:00+00:00",
+             "channel": "web", "value": 3},
+        ]))
+
+        self.bucket.rollups.rebuild()
+
+        self.assert_rollup_matches_raw(Query.create(
+            period=WEEK, group_by="channel", collect=[("value", "mean")]))
@@ -0,0 +1,136 @@
+import unittest
+from hamcrest import assert_that, is_, has_entries
+from nose.tools import raises
+from backdrop.core.aggregation import build_group_pipeline, \
+    unwrap_group_results
+from backdrop.core.nested_merge import InvalidOperationError
+
+
+class TestBuildGroupPipeline(unittest.TestCase):
+    def test_query_is_used_as_match_stage(self):
+        pipeline = build_group_pipeline(["a"], {"b": "foo"}, [])
+
+        assert_that(pipeline[0], is_({"$match": {"b": "foo"}}))
+
+    def test_only_grouped_and_collected_fields_are_projected(self):
+        pipeline = build_group_pipeline(["a"], {}, [("b", "sum")])
+
+        assert_that(pipeline[1], is_({"$project": {"a": 1, "b": 1}}))
+
+    def test_nothing_is_projected_without_keys_or_collects(self):
+        pipeline = build_group_pipeline([], {}, [])
+
+        assert_that(len(pipeline), is_(2))
+
+    def test_groups_on_all_keys(self):
+        pipeline = build_group_pipeline(["a", "b"], {}, [])
+
+        assert_that(pipeline[-1]["$group"]["_id"],
+                    is_({"k0": "$a", "k1": "$b"}))
+
+    def test_groups_everything_together_without_keys(self):
+        pipeline = build_group_pipeline([], {}, [])
+
+        assert_that(pipeline[-1]["$group"]["_id"], is_(None))
+
+    def test_counts_documents_in_each_group(self):
+        pipeline = build_group_pipeline(["a"], {}, [])
+
+        assert_that(pipeline[-1]["$group"]["_count"], is_({"$sum": 1}))
+
+    def test_collect_fields_are_reduced_under_an_alias(self):
+        pipeline = build_group_pipeline(
+            ["a"], {}, [("this-name", "set"), ("name.foo", "set")])
+
+        assert_that(pipeline[-1]["$group"]["c0"],
+                    is_({"$addToSet": "$this-name"}))
+        assert_that(pipeline[-1]["$group"]["c1"],
+                    is_({"$addToSet": "$name.foo"}))
+
+    def test_default_and_set_are_only_reduced_once(self):
+        pipeline = build_group_pipeline(
+            ["a"], {}, [("b", "default"), ("b", "set")])
+
+        assert_that(pipeline[-1]["$group"], is_({
+            "_id": {"k0": "$a"},
+            "_count": {"$sum": 1},
+            "c0": {"$addToSet": "$b"},
+        }))
+
+    def test_sum_is_reduced_by_the_database(self):
+        pipeline = build_group_pipeline(["a"], {}, [("b", "sum")])
+
+        assert_that(pipeline[-1]["$group"], has_entries({
+            "c0": {"$sum": "$b"},
+            "c0_invalid": {"$sum": {"$cond": [{"$gte": ["$b", ""]}, 1, 0]}},
+        }))
+
+    def test_mean_is_reduced_to_a_sum_and_number_of_values(self):
+        pipeline = build_group_pipeline(["a"], {}, [("b", "mean")])
+
+        assert_that(pipeline[-1]["$group"], has_entries({
+            "c0": {"$sum": "$b"},
+            "c0_values": {"$sum": {"$cond": [
+                {"$and": [{"$gt": ["$b", None]}, {"$lt": ["$b", ""]}]},
+                1, 0]}},
+        }))
+
+    def test_count_counts_present_values(self):
+        pipeline = build_group_pipeline(["a"], {}, [("b", "count")])
+
+        assert_that(pipeline[-1]["$group"]["c0"], is_(
+            {"$sum": {"$cond": [{"$gt": ["$b", None]}, 1, 0]}}))
+
+    def test_sort_and_limit_pick_the_top_groups(self):
+        pipeline = build_group_pipeline(
+            ["a"], {}, [], ["_count", "descending"], 10)
+
+        assert_that(pipeline[-2:], is_([
+            {"$sort": {"_count": -1, "_id.k0": 1}},
+            {"$limit": 10}]))
+        assert_that(pipeline[-2]["$sort"].keys(), is_(["_count", "_id.k0"]))
+
+    def test_sort_without_a_limit_is_left_to_python(self):
+        pipeline = build_group_pipeline(
+            ["a"], {}, [], ["_count", "descending"], None)
+
+        assert_that(pipeline[-1].keys(), is_(["$group"]))
+
+    @raises(ValueError)
+    def test_unknown_collect_method_raises_an_error(self):
+        build_group_pipeline(["a"], {}, [("b", "median")])
+
+
+class TestUnwrapGroupResults(unittest.TestCase):
+    def test_aliases_are_mapped_back_to_field_names(self):
+        results = unwrap_group_results(["a", "b"], [("c", "set")], [
+            {"_id": {"k0": "foo", "k1": "bar"}, "_count": 3, "c0": [1, 2]},
+        ])
+
+        assert_that(results, is_([
+            {"a": "foo", "b": "bar", "_count": 3, "c:set": [1, 2]}
+        ]))
+
+    def test_results_without_keys_only_have_a_count(self):
+        results = unwrap_group_results([], [], [{"_id": None, "_count": 4}])
+
+        assert_that(results, is_([{"_count": 4}]))
+
+    def test_collected_values_are_keyed_by_collect_key(self):
+        results = unwrap_group_results(
+            ["a"], [("b", "default"), ("b", "mean"), ("c", "count")], [
+                {"_id": {"k0": "foo"}, "_count": 3,
+                 "c0": [1, 2], "c1": 3, "c1_values": 2, "c1_invalid": 0,
+                 "c2": 1}
+            ])
+
+        assert_that(results, is_([
+            {"a": "foo", "_count": 3,
+             "b:set": [1, 2], "b:mean": (3, 2), "c:count": 1}
+        ]))
+
+    @raises(InvalidOperationError)
+    def test_summing_non_numeric_values_raises_an_error(self):
+        unwrap_group_results(["a"], [("b", "sum")], [
+            {"_id": {"k0": "foo"}, "_count": 3, "c0": 0, "c0_invalid": 3}
+        ])
@@ -23,10 +23,10 @@ class TestBucketAutoIdGeneration(unittest.TestCase):
 
         bucket.parse_and_store(objects)
 
-        self.mock_repository.save.assert_called_once_with({
+        self.mock_repository.save_all.assert_called_once_with([{
             "_id": b64encode("def"),
             "abc": "def"
-        })
+        }])
 
     def test_auto_id_generation(self):
         objects = [{
@@ -41,12 +41,12 @@ class TestBucketAutoIdGeneration(unittest.TestCase):
 
         bucket.parse_and_store(objects)
 
-        self.mock_repository.save.assert_called_once_with({
+        self.mock_repository.save_all.assert_called_once_with([{
             "_id": b64encode("WC2B 6SE.125"),
             "postcode": "WC2B 6SE",
             "number": "125",
             "name": "Aviation House"
-        })
+        }])
 
     def test_no_id_generated_if_auto_id_is_none(self):
         object = {
@@ -61,7 +61,7 @@ class TestBucketAutoIdGeneration(unittest.TestCase):
 
         bucket.parse_and_store([object])
 
-        self.mock_repository.save.assert_called_once_with(object)
+        self.mock_repository.save_all.assert_called_once_with([object])
 
     @raises(ValidationError)
     def test_validation_error_if_auto_id_property_is_missing(self):
@@ -87,7 +87,7 @@ class TestBucketAutoIdGeneration(unittest.TestCase):
         bucket = Bucket(self.mock_database, config)
         bucket.parse_and_store(objects)
 
-        saved_object = self.mock_repository.save.call_args[0][0]
+        saved_object = self.mock_repository.save_all.call_args[0][0][0]
 
         assert_that(b64decode(saved_object['_id']),
                     is_("2013-08-01T00:00:00+00:00.bar"))
@@ -1,10 +1,13 @@
 import unittest
+import datetime
 from hamcrest import *
 from hamcrest import assert_that, is_
 from nose.tools import *
 from mock import Mock, call
-from backdrop.core import bucket
+from backdrop.core import bucket, timeutils
 from backdrop.core.bucket import BucketConfig
+from backdrop.core.database import BulkSaveError
+from backdrop.core.errors import ParseError
 from backdrop.core.records import Record
 from backdrop.read.query import Query
 from backdrop.core.timeseries import WEEK, MONTH
@@ -51,12 +54,144 @@ class TestBucket(unittest.TestCase):
 
         self.bucket.store(my_records)
 
-        self.mock_repository.save.assert_has_calls([
-            call({'name': "Groucho"}),
-            call({"name": "Harpo"}),
-            call({"name": "Chico"})
+        self.mock_repository.save_all.assert_called_once_with([
+            {'name': "Groucho"},
+            {"name": "Harpo"},
+            {"name": "Chico"}
+        ])
+
+    def test_streams_of_records_are_stored_a_chunk_at_a_time(self):
+        my_records = (Record({"name": name})
+                      for name in ["Groucho", "Harpo", "Chico"])
+
+        count = self.bucket.store_stream(my_records, chunk_size=2)
+
+        assert_that(count, is_(3))
+        assert_that(self.mock_repository.save_all.call_args_list, is_([
+            call([{"name": "Groucho"}, {"name": "Harpo"}]),
+            call([{"name": "Chico"}]),
+        ]))
+
+    def test_failures_in_a_stream_are_numbered_across_chunks(self):
+        self.mock_repository.save_all.side_effect = [
+            None, BulkSaveError([(0, "too big")])]
+        my_records = [Record({"name": name})
+                      for name in ["Groucho", "Harpo", "Chico"]]
+
+        try:
+            self.bucket.store_stream(my_records, chunk_size=2)
+            self.fail("Expected a BulkSaveError")
+        except BulkSaveError as e:
+            assert_that(e.failures, is_([(2, "too big")]))
+
+    def test_streams_of_data_are_parsed_lazily(self):
+        def data():
+            yield {"name": "Groucho"}
+            raise AssertionError("Read too far")
+
+        parsed = self.bucket.parse_stream(data())
+
+        assert_that(next(parsed), is_(Record({"name": "Groucho"})))
+
+    def test_invalid_data_in_a_stream_is_numbered(self):
+        parsed = self.bucket.parse_stream([
+            {"name": "Groucho"},
+            {"_timestamp": "not a time"},
         ])
 
+        try:
+            list(parsed)
+            self.fail("Expected a ParseError")
+        except ParseError as e:
+            assert_that(e.message, starts_with("Record 2 is invalid: "))
+
+    def test_storing_records_bumps_the_bucket_version(self):
+        updated_at = d_tz(2014, 1, 1)
+        self.mock_repository.save_all.return_value = updated_at
+        self.bucket.store([Record({"name": "Groucho"})])
+
+        self.mock_database.get_collection("bucket_metadata").update\
+            .assert_called_once_with(
+                {"_id": "test_bucket"},
+                {"$inc": {"version": 1},
+                 "$max": {"last_updated": updated_at}},
+                upsert=True)
+
+    def test_partly_stored_records_bump_the_bucket_version(self):
+        updated_at = d_tz(2014, 1, 1)
+
+        def save_some(docs):
+            for doc in docs:
+                doc['_updated_at'] = updated_at
+            raise BulkSaveError([(1, "too big")])
+        self.mock_repository.save_all.side_effect = save_some
+
+        self.assertRaises(BulkSaveError, self.bucket.store, [
+            Record({"name": "Groucho"}), Record({"name": "Harpo"})])
+
+        self.mock_database.get_collection("bucket_metadata").update\
+            .assert_called_once_with(
+                {"_id": "test_bucket"},
+                {"$inc": {"version": 1},
+                 "$max": {"last_updated": updated_at}},
+                upsert=True)
+
+    def test_the_bucket_version_is_bumped_if_the_rollups_fail(self):
+        updated_at = d_tz(2014, 1, 1)
+        self.mock_repository.save_all.return_value = updated_at
+        self.bucket.rollups = Mock()
+        self.bucket.rollups.update.side_effect = IOError("rollups are down")
+
+        self.assertRaises(IOError, self.bucket.store,
+                          [Record({"name": "Groucho"})])
+
+        self.mock_database.get_collection("bucket_metadata").update\
+            .assert_called_once_with(
+                {"_id": "test_bucket"},
+                {"$inc": {"version": 1},
+                 "$max": {"last_updated": updated_at}},
+                upsert=True)
+
+    def test_recently_updated_buckets_are_recent_enough(self):
+        config = BucketConfig('test_bucket', data_group="group",
+                              data_type="type", max_age_expected=60)
+        recent = bucket.Bucket(self.mock_database, config)
+
+        assert_that(recent.was_updated_recently(
+            timeutils.now() - datetime.timedelta(seconds=10)))
+        assert_that(not recent.was_updated_recently(
+            timeutils.now() - datetime.timedelta(seconds=100)))
+        assert_that(not recent.was_updated_recently(None))
+
+    def test_storing_records_updates_the_rollups(self):
+        config = BucketConfig('test_bucket', data_group="group",
+                              data_type="type",
+                              rollups=[{"period": "week"}])
+        rolled_up = bucket.Bucket(self.mock_database, config)
+        rolled_up.rollups = Mock()
+
+        rolled_up.store([Record({"name": "Groucho"}),
+                         Record({"_id": "harpo", "name": "Harpo"})])
+
+        rolled_up.rollups.update.assert_called_once_with(
+            [{"name": "Groucho"}], [{"_id": "harpo", "name": "Harpo"}])
+
+    def test_covered_queries_are_answered_from_a_rollup(self):
+        config = BucketConfig('test_bucket', data_group="group",
+                              data_type="type",
+                              rollups=[{"period": "week"}])
+        rolled_up = bucket.Bucket(self.mock_database, config)
+        rollup_collection = Mock()
+        rollup_collection.aggregate.return_value = []
+        self.mock_database.get_collection.return_value = rollup_collection
+
+        rolled_up.query(Query.create(period=WEEK))
+
+        assert_that(rollup_collection.aggregate.called, is_(True))
+        self.mock_database.get_collection.assert_called_with(
+            "rollups.test_bucket.week")
+        assert_that(self.mock_repository.group.called, is_(False))
+
     def test_filter_by_query(self):
         self.bucket.query(Query.create(filter_by=[['name', 'Chico']]))
         self.mock_repository.find.assert_called_once()
@@ -152,7 +287,7 @@ class TestBucket(unittest.TestCase):
 
         self.mock_repository.group.assert_called_once_with(
             "_week_start_at", query, sort=['_week_start_at', 'ascending'],
-            limit=None, collect=[])
+            limit=None, collect=[], rows_filter=None)
 
         assert_that(query_result, has_length(2))
         assert_that(query_result, has_item(has_entries({
@@ -176,7 +311,7 @@ class TestBucket(unittest.TestCase):
         query_result = self.bucket.query(query).data()
         self.mock_repository.group.assert_called_once_with(
             "_month_start_at", query, sort=['_month_start_at', 'ascending'],
-            limit=None, collect=[])
+            limit=None, collect=[], rows_filter=None)
 
     def test_week_query_with_limit(self):
         self.mock_repository.group.return_value = []
@@ -186,7 +321,7 @@ class TestBucket(unittest.TestCase):
 
         self.mock_repository.group.assert_called_once_with(
             "_week_start_at", query, sort=['_week_start_at', 'ascending'],
-            limit=1, collect=[])
+            limit=1, collect=[], rows_filter=None)
 
     def test_month_query_with_limit(self):
         self.mock_repository.group.return_value = []
@@ -196,7 +331,7 @@ class TestBucket(unittest.TestCase):
 
         self.mock_repository.group.assert_called_once_with(
             "_month_start_at", query, sort=['_month_start_at', 'ascending'],
-            limit=1, collect=[])
+            limit=1, collect=[], rows_filter=None)
 
     def test_period_query_fails_when_weeks_do_not_start_on_monday(self):
         self.mock_repository.group.return_value = [
@@ -525,7 +660,8 @@ class TestBucket(unittest.TestCase):
             query,
             sort=["_count", "descending"],
             limit=None,
-            collect=[]
+            collect=[],
+            rows_filter=None
         )
 
     def test_sorted_week_and_group_query_with_limit(self):
@@ -558,7 +694,8 @@ class TestBucket(unittest.TestCase):
             query,
             sort=["_count", "descending"],
             limit=1,
-            collect=[])
+            collect=[],
+            rows_filter=None)
 
     def test_period_group_query_fails_when_weeks_do_not_start_on_monday(self):
         multi_group_results = [
@@ -1,8 +1,12 @@
 import unittest
 from hamcrest import assert_that, is_
 from mock import Mock, patch
-from pymongo.errors import AutoReconnect
-from backdrop.core.database import Repository, InvalidSortError, MongoDriver, Database
+from pymongo.errors import AutoReconnect, BulkWriteError
+from pymongo import ReadPreference
+from backdrop.core.database import Repository, InvalidSortError, MongoDriver, \
+    Database, BulkSaveError, mongo_client_options, report_pool_stats, \
+    top_groups
+from backdrop.core.pagination import after_cursor, encode_cursor
 from backdrop.read.query import Query
 from tests.support.test_helpers import d_tz
 
@@ -32,6 +36,103 @@ class TestDatabase(unittest.TestCase):
         assert not MongoReplicaSetClient.called
 
 
+class TestClientOptions(unittest.TestCase):
+    def test_options_are_read_from_the_app_config(self):
+        options = mongo_client_options({
+            'MONGO_READ_PREFERENCE': 'secondary_preferred',
+            'MONGO_SECONDARY_ACCEPTABLE_LATENCY_MS': 15,
+            'MONGO_MAX_POOL_SIZE': 100,
+            'MONGO_CONNECT_TIMEOUT_MS': 2000,
+            'MONGO_SOCKET_TIMEOUT_MS': 10000,
+        })
+
+        assert_that(options, is_({
+            'read_preference': ReadPreference.SECONDARY_PREFERRED,
+            'secondary_acceptable_latency_ms': 15,
+            'max_pool_size': 100,
+            'connectTimeoutMS': 2000,
+            'socketTimeoutMS': 10000,
+        }))
+
+    def test_unset_options_are_left_to_pymongo(self):
+        assert_that(mongo_client_options({'MONGO_HOSTS': ['a']}), is_({}))
+
+    def test_unknown_read_preferences_are_rejected(self):
+        self.assertRaises(ValueError, mongo_client_options,
+                          {'MONGO_READ_PREFERENCE': 'closest'})
+
+    @patch('os.getenv', return_value='test')
+    @patch('pymongo.MongoReplicaSetClient')
+    def test_options_are_given_to_the_client(self, MongoReplicaSetClient,
+                                             getenv):
+        Database(['localhost'], 27017, 'test', {'max_pool_size': 10})
+
+        MongoReplicaSetClient.assert_called_once_with(
+            'localhost:27017', replicaSet='test', max_pool_size=10)
+
+    @patch('os.getenv', return_value='test')
+    @patch('pymongo.MongoReplicaSetClient')
+    def test_reads_from_secondaries(self, MongoReplicaSetClient, getenv):
+        db = Database(['localhost'], 27017, 'test', {
+            'read_preference': ReadPreference.SECONDARY_PREFERRED})
+
+        assert_that(db.reads_from_secondaries, is_(True))
+
+    @patch('os.getenv', return_value='test')
+    @patch('pymongo.MongoReplicaSetClient')
+    def test_reads_from_the_primary_by_default(self, MongoReplicaSetClient,
+                                               getenv):
+        db = Database(['localhost'], 27017, 'test', {})
+
+        assert_that(db.reads_from_secondaries, is_(False))
+
+
+class TestPoolStats(unittest.TestCase):
+    def member(self, host, idle, max_size):
+        return Mock(host=host, pool=Mock(sockets=set(range(idle)),
+                                         max_size=max_size))
+
+    @patch('os.getenv', return_value='')
+    @patch('pymongo.MongoClient')
+    def test_single_server_pool(self, MongoClient, getenv):
+        MongoClient.return_value = Mock(
+            spec=[], _MongoClient__member=self.member(("db", 27017), 2, 10))
+
+        stats = Database(['db'], 27017, 'test').pool_stats()
+
+        assert_that(stats, is_([
+            {"host": "db:27017", "idle": 2, "max_size": 10}]))
+
+    @patch('os.getenv', return_value='test')
+    @patch('pymongo.MongoReplicaSetClient')
+    def test_replica_set_pools(self, MongoReplicaSetClient, getenv):
+        rs_state = Mock(members=set([
+            self.member(("db-2", 27017), 1, 10),
+            self.member(("db-1", 27017), 3, 10),
+        ]))
+        MongoReplicaSetClient.return_value = Mock(
+            spec=[], _MongoReplicaSetClient__rs_state=rs_state)
+
+        stats = Database(['db-1', 'db-2'], 27017, 'test').pool_stats()
+
+        assert_that([stat["host"] for stat in stats],
+                    is_(["db-1:27017", "db-2:27017"]))
+        assert_that([stat["idle"] for stat in stats], is_([3, 1]))
+
+    @patch('backdrop.core.database.statsd')
+    def test_pool_stats_are_sent_to_statsd(self, statsd):
+        db = Mock()
+        db.pool_stats.return_value = [
+            {"host": "db.internal:27017", "idle": 2, "max_size": 10}]
+
+        report_pool_stats(db, "read")
+
+        statsd.gauge.assert_any_call(
+            "db.pool.db_internal_27017.idle", 2, bucket="read")
+        statsd.gauge.assert_any_call(
+            "db.pool.db_internal_27017.max_size", 10, bucket="read")
+
+
 class TestMongoDriver(unittest.TestCase):
     def setUp(self):
         self.collection = Mock()
@@ -51,6 +152,18 @@ class TestMongoDriver(unittest.TestCase):
 
         assert_that(self.collection.save.call_count, is_(3))
 
+    def test_sort_can_be_on_several_keys(self):
+        assert_that(
+            self.driver._parse_sort([["_timestamp", "ascending"],
+                                     ["_id", "ascending"]]),
+            is_([("_timestamp", 1), ("_id", 1)]))
+
+    def test_find_passes_the_projection_to_mongo(self):
+        self.driver.find({}, fields={"name": 1})
+
+        self.collection.find.assert_called_once_with(
+            {}, fields={"name": 1}, sort=None, limit=0)
+
     def test_save_only_calls_once_on_success(self):
         self.collection.save.return_value = None
 
@@ -58,6 +171,93 @@ class TestMongoDriver(unittest.TestCase):
 
         assert_that(self.collection.save.call_count, is_(1))
 
+    def test_save_all_upserts_documents_with_an_id(self):
+        bulk = self.collection.initialize_unordered_bulk_op.return_value
+
+        self.driver.save_all([{"_id": "a", "name": "Groucho"}])
+
+        bulk.find.assert_called_once_with({"_id": "a"})
+        bulk.find.return_value.upsert.return_value.replace_one\
+            .assert_called_once_with({"_id": "a", "name": "Groucho"})
+        assert not bulk.insert.called
+
+    def test_save_all_inserts_documents_without_an_id(self):
+        bulk = self.collection.initialize_unordered_bulk_op.return_value
+
+        self.driver.save_all([{"name": "Harpo"}])
+
+        bulk.insert.assert_called_once_with({"name": "Harpo"})
+        assert not bulk.find.called
+
+    def test_save_all_sends_documents_in_chunks(self):
+        bulk = self.collection.initialize_unordered_bulk_op.return_value
+
+        self.driver.save_all([{"n": i} for i in range(5)], chunk_size=2)
+
+        assert_that(bulk.execute.call_count, is_(3))
+        assert_that(bulk.insert.call_count, is_(5))
+
+    def test_save_all_retries_a_chunk_on_auto_reconnect(self):
+        bulk = self.collection.initialize_unordered_bulk_op.return_value
+        bulk.execute.side_effect = [AutoReconnect, None]
+
+        self.driver.save_all([{"name": "Chico"}])
+
+        assert_that(bulk.execute.call_count, is_(2))
+
+    def test_save_all_reports_failures_per_record(self):
+        bulk = self.collection.initialize_unordered_bulk_op.return_value
+        bulk.execute.side_effect = [
+            None,
+            BulkWriteError({
+                "writeErrors": [{"index": 1, "errmsg": "too big"}],
+                "writeConcernErrors": []})
+        ]
+
+        try:
+            self.driver.save_all([{"n": i} for i in range(4)], chunk_size=2)
+            self.fail("Expected BulkSaveError")
+        except BulkSaveError as e:
+            assert_that(e.failures, is_([(3, "too big")]))
+
+    def test_save_all_saves_the_last_document_with_an_id(self):
+        bulk = self.collection.initialize_unordered_bulk_op.return_value
+        replace_one = bulk.find.return_value.upsert.return_value.replace_one
+
+        self.driver.save_all([{"_id": "a", "n": 1}, {"_id": "b", "n": 2},
+                              {"_id": "a", "n": 3}])
+
+        assert_that(replace_one.call_args_list, is_([
+            (({"_id": "b", "n": 2},), {}),
+            (({"_id": "a", "n": 3},), {}),
+        ]))
+
+    def test_save_all_reports_failures_by_their_index_in_the_list(self):
+        bulk = self.collection.initialize_unordered_bulk_op.return_value
+        bulk.execute.side_effect = BulkWriteError({
+            "writeErrors": [{"index": 1, "errmsg": "too big"}],
+            "writeConcernErrors": []})
+
+        try:
+            self.driver.save_all([{"_id": "a"}, {"_id": "a"}, {"n": 1}])
+            self.fail("Expected BulkSaveError")
+        except BulkSaveError as e:
+            assert_that(e.failures, is_([(2, "too big")]))
+
+    def test_group_runs_an_aggregation(self):
+        self.collection.aggregate.return_value = [
+            {"_id": {"k0": "wind"}, "_count": 2, "c0": ["high", "low"]}
+        ]
+
+        results = self.driver.group(["type"], {}, [("range", "set")])
+
+        pipeline = self.collection.aggregate.call_args[0][0]
+        assert_that(pipeline[0], is_(
+            {"$match": {"type": {"$ne": None}}}))
+        assert_that(results, is_([
+            {"type": "wind", "_count": 2, "range:set": ["high", "low"]}
+        ]))
+
 
 class TestRepository(unittest.TestCase):
     def setUp(self):
@@ -75,6 +275,56 @@ class TestRepository(unittest.TestCase):
             "_updated_at": d_tz(2013, 4, 9, 13, 32, 5)
         })
 
+    @patch('backdrop.core.timeutils.now')
+    def test_save_all_adds_timestamps_to_every_document(self, now):
+        now.return_value = d_tz(2013, 4, 9, 13, 32, 5)
+
+        self.repo.save_all([{"name": "Gummo"}, {"name": "Zeppo"}])
+
+        self.mongo.save_all.assert_called_once_with([
+            {"name": "Gummo", "_updated_at": d_tz(2013, 4, 9, 13, 32, 5)},
+            {"name": "Zeppo", "_updated_at": d_tz(2013, 4, 9, 13, 32, 5)},
+        ])
+
+    def test_top_groups_by_count_are_picked_by_the_database(self):
+        self.mongo.group.return_value = [
+            {"name": "a", "_count": 5}, {"name": "b", "_count": 3}]
+
+        results = self.repo.group("name", Query.create(),
+                                  sort=["_count", "descending"], limit=2)
+
+        self.mongo.group.assert_called_once_with(
+            ["name"], {}, [],
+            sort=["_count", "descending"], limit=2)
+        assert_that([result["name"] for result in results], is_(["a", "b"]))
+
+    def test_top_groups_are_not_picked_by_the_database_with_a_sum(self):
+        self.mongo.group.return_value = []
+
+        self.repo.group("name", Query.create(),
+                        sort=["_count", "descending"], limit=2,
+                        collect=[("value", "sum")])
+
+        self.mongo.group.assert_called_once_with(
+            ["name"], {}, [("value", "sum")])
+
+    def test_top_groups_of_multi_groups_are_picked_in_python(self):
+        self.mongo.group.return_value = [
+            {"a": 1, "b": 1, "_count": 1},
+            {"a": 2, "b": 1, "_count": 2},
+            {"a": 2, "b": 2, "_count": 2},
+            {"a": 3, "b": 1, "_count": 3},
+        ]
+
+        results = self.repo.multi_group("a", "b", Query.create(),
+                                        sort=["_count", "descending"],
+                                        limit=2)
+
+        self.mongo.group.assert_called_once_with(
+            ["a", "b"], {}, [])
+        assert_that([(result["a"], result["_count"]) for result in results],
+                    is_([(2, 4), (3, 3)]))
+
     # =========================
     # Tests for repository.find
     # =========================
@@ -122,6 +372,31 @@ class TestRepository(unittest.TestCase):
                                                 10)
         assert_that(results, is_("a_cursor"))
 
+    def test_find_pages_are_sorted_by_id_as_well(self):
+        self.mongo.find.return_value = "a_cursor"
+
+        self.repo.find(Query.create(limit=10), limit=10)
+
+        self.mongo.find.assert_called_once_with(
+            {}, [["_timestamp", "ascending"], ["_id", "ascending"]], 10)
+
+    def test_find_with_cursor_starts_after_the_cursor(self):
+        cursor = encode_cursor({"_timestamp": d_tz(2013, 4, 9), "_id": "b"})
+
+        self.repo.find(Query.create(limit=10, cursor=cursor,
+                                    sort_by=["_timestamp", "descending"]),
+                       sort=["_timestamp", "descending"], limit=10)
+
+        self.mongo.find.assert_called_once_with(
+            {"$and": [{}, after_cursor(cursor, "descending")]},
+            [["_timestamp", "descending"], ["_id", "descending"]], 10)
+
+    def test_find_only_fetches_the_selected_fields(self):
+        self.repo.find(Query.create(fields=["name"]))
+
+        self.mongo.find.assert_called_once_with(
+            {}, ["_timestamp", "ascending"], None, fields={"name": 1})
+
     def test_sort_raises_error_if_sort_does_not_have_two_elements(self):
         self.assertRaises(
             InvalidSortError,
@@ -135,3 +410,29 @@ class TestRepository(unittest.TestCase):
             self.repo.find,
             Query.create(), ["a_key", "blah"]
         )
+
+
+class TestTopGroups(unittest.TestCase):
+    def test_groups_are_sorted_by_a_key(self):
+        groups = [{"n": 2}, {"n": 3}, {"n": 1}]
+
+        assert_that(top_groups(groups, ["n", "descending"]),
+                    is_([{"n": 3}, {"n": 2}, {"n": 1}]))
+
+    def test_only_the_first_groups_are_kept(self):
+        groups = [{"n": 2}, {"n": 3}, {"n": 1}]
+
+        assert_that(top_groups(groups, ["n", "ascending"], 2),
+                    is_([{"n": 1}, {"n": 2}]))
+
+    def test_groups_that_tie_keep_their_order(self):
+        groups = [{"n": 1, "k": "a"}, {"n": 2, "k": "b"}, {"n": 1, "k": "c"}]
+
+        assert_that(top_groups(groups, ["n", "descending"], 2), is_([
+            {"n": 2, "k": "b"}, {"n": 1, "k": "a"}]))
+        assert_that(top_groups(groups, ["n", "ascending"], 2), is_([
+            {"n": 1, "k": "a"}, {"n": 1, "k": "c"}]))
+
+    def test_unknown_sort_keys_are_invalid(self):
+        self.assertRaises(InvalidSortError, top_groups,
+                          [{"n": 1}], ["m", "ascending"], 1)
@@ -0,0 +1,175 @@
+import unittest
+from hamcrest import assert_that, is_, contains
+from mock import Mock, patch
+from backdrop.core.bucket import BucketConfig
+from backdrop.core.indexes import bucket_indexes, reconcile_indexes, \
+    suggest_indexes, QueryShape, QueryShapeRecorder
+from backdrop.read.query import Query
+from backdrop.core.timeseries import WEEK
+from tests.support.test_helpers import d_tz
+
+
+class TestBucketIndexes(unittest.TestCase):
+    def test_every_bucket_has_the_default_indexes(self):
+        config = BucketConfig("foo", data_group="group", data_type="type")
+
+        assert_that(bucket_indexes(config), is_([
+            (("_timestamp", 1), ("_id", 1)),
+            (("_updated_at", -1),),
+        ]))
+
+    def test_configured_indexes_are_added_once(self):
+        config = BucketConfig("foo", data_group="group", data_type="type",
+                              indexes=[[["service", 1], ["_timestamp", 1]],
+                                       [["_timestamp", 1], ["_id", 1]]])
+
+        assert_that(bucket_indexes(config), is_([
+            (("_timestamp", 1), ("_id", 1)),
+            (("_updated_at", -1),),
+            (("service", 1), ("_timestamp", 1)),
+        ]))
+
+    def test_invalid_index_specs_are_rejected(self):
+        self.assertRaises(ValueError, BucketConfig, "foo", "group", "type",
+                          indexes=[[["service", "up"]]])
+
+
+class TestReconcileIndexes(unittest.TestCase):
+    def setUp(self):
+        self.driver = Mock()
+        self.driver.index_keys.return_value = [
+            [("_timestamp", 1.0)],
+            [("name", 1)],
+        ]
+
+    def test_missing_indexes_are_created(self):
+        created, dropped = reconcile_indexes(
+            self.driver, [(("_timestamp", 1),), (("_updated_at", -1),)])
+
+        self.driver.create_index.assert_called_once_with(
+            [("_updated_at", -1)])
+        assert_that(created, is_([(("_updated_at", -1),)]))
+        assert_that(dropped, is_([]))
+        assert not self.driver.drop_index.called
+
+    def test_unconfigured_indexes_are_dropped_when_pruning(self):
+        created, dropped = reconcile_indexes(
+            self.driver, [(("_timestamp", 1),)], prune=True)
+
+        self.driver.drop_index.assert_called_once_with([("name", 1)])
+        assert_that(dropped, is_([(("name", 1),)]))
+
+
+class TestQueryShape(unittest.TestCase):
+    def test_raw_query_shape(self):
+        query = Query.create(filter_by=[["service", "a"], ["channel", "b"]],
+                             start_at=d_tz(2013, 1, 1),
+                             sort_by=["name", "descending"])
+
+        assert_that(QueryShape.from_query(query), is_(QueryShape(
+            ("channel", "service"), ("name", "descending"), ("_timestamp",),
+            ())))
+
+    def test_grouped_queries_are_not_sorted_by_the_database(self):
+        query = Query.create(period=WEEK, group_by="service",
+                             sort_by=["_count", "descending"])
+
+        assert_that(QueryShape.from_query(query).sort, is_(None))
+
+    def test_group_and_period_keys_are_part_of_the_shape(self):
+        query = Query.create(period=WEEK, group_by="service",
+                             start_at=d_tz(2013, 1, 7),
+                             end_at=d_tz(2013, 2, 4))
+
+        shape = QueryShape.from_query(query)
+
+        assert_that(shape.group, is_(("service", "_week_start_at")))
+        assert_that(shape.key, is_("||_timestamp|service,_week_start_at"))
+        assert_that(shape.index_spec(), is_(
+            (("_timestamp", 1), ("service", 1), ("_week_start_at", 1))))
+
+    def test_index_spec_orders_equality_sort_range(self):
+        shape = QueryShape(("service",), ("name", "ascending"),
+                           ("_timestamp",), ())
+
+        assert_that(shape.index_spec(), is_(
+            (("service", 1), ("name", 1), ("_timestamp", 1))))
+
+
+class TestSuggestIndexes(unittest.TestCase):
+    def test_shapes_served_by_existing_indexes_are_skipped(self):
+        shapes = [(QueryShape((), None, ("_timestamp",), ()), 10)]
+
+        assert_that(suggest_indexes(shapes, [(("_timestamp", 1),)]),
+                    is_([]))
+
+    def test_prefixes_are_merged_into_longer_suggestions(self):
+        shapes = [
+            (QueryShape(("service",), None, (), ()), 3),
+            (QueryShape(("service",), None, ("_timestamp",), ()), 4),
+            (QueryShape(("channel",), None, ("_timestamp",), ()), 10),
+        ]
+
+        assert_that(suggest_indexes(shapes, []), contains(
+            ((("channel", 1), ("_timestamp", 1)), 10),
+            ((("service", 1), ("_timestamp", 1)), 7),
+        ))
+
+    def test_grouping_indexes_are_suggested(self):
+        shapes = [(QueryShape((), None, ("_timestamp",), ("service",)), 5)]
+
+        existing = [(("_timestamp", 1), ("_id", 1))]
+
+        assert_that(suggest_indexes(shapes, existing), is_([
+            ((("_timestamp", 1), ("service", 1)), 5)]))
+
+
+class TestQueryShapeRecorder(unittest.TestCase):
+    def setUp(self):
+        self.collection = Mock()
+        self.db = Mock()
+        self.db.get_collection.return_value = self.collection
+
+    def test_nothing_is_recorded_without_a_sample_rate(self):
+        QueryShapeRecorder(self.db, 0).record("foo", Query.create())
+
+        assert not self.collection.update.called
+
+    @patch("random.random", return_value=0.5)
+    def test_sampled_shapes_are_counted(self, random):
+        QueryShapeRecorder(self.db, 1).record(
+            "foo", Query.create(filter_by=[["service", "a"]]))
+
+        self.collection.update.assert_called_once_with(
+            {"_id": "foo/service|_timestamp:ascending||"},
+            {
+                "$set": {
+                    "bucket": "foo",
+                    "equality": ["service"],
+                    "sort": ["_timestamp", "ascending"],
+                    "range": [],
+                    "group": [],
+                },
+                "$inc": {"count": 1},
+            },
+            upsert=True)
+
+    def test_recorded_shapes_are_read_back(self):
+        self.collection.find.return_value = [{
+            "equality": ["service"], "sort": None,
+            "range": ["_timestamp"], "group": [], "count": 3}]
+
+        shapes = QueryShapeRecorder(self.db, 0).shapes("foo")
+
+        assert_that(shapes, is_([
+            (QueryShape(("service",), None, ("_timestamp",), ()), 3)]))
+
+    def test_group_keys_are_read_back(self):
+        self.collection.find.return_value = [{
+            "equality": [], "sort": None, "range": ["_timestamp"],
+            "group": ["service"], "count": 2}]
+
+        shapes = QueryShapeRecorder(self.db, 0).shapes("foo")
+
+        assert_that(shapes, is_([
+            (QueryShape((), None, ("_timestamp",), ("service",)), 2)]))
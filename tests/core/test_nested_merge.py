@@ -1,7 +1,9 @@
-from hamcrest import assert_that, is_, contains, has_entries, has_entry
+from hamcrest import assert_that, is_, contains, has_entries, has_entry, \
+    instance_of
 from backdrop.core.nested_merge import nested_merge, group_by, \
-    apply_collect_to_group, collect_all_values
+    apply_collect
 from backdrop.core.timeseries import WEEK, MONTH
+from backdrop.read.serialization import get_serializer
 
 
 def datum(name=None, place=None, age=None, stamp=None, count=1):
@@ -13,7 +15,7 @@ def datum(name=None, place=None, age=None, stamp=None, count=1):
     if place is not None:
         result['place'] = place
     if age is not None:
-        result['age'] = age
+        result['age:mean'] = age
     if stamp is not None:
         result['_timestamp'] = stamp
         result['_week_start_at'] = WEEK.start(stamp)
@@ -25,9 +27,9 @@ class TestNestedMerge(object):
 
     def test_one_level_grouping_with_collect(self):
         data = [
-            datum(name='Jill', age=[12, 45]),
-            datum(name='Jack', age=[34, 34]),
-            datum(name='John', age=[56, 65])
+            datum(name='Jill', age=(57, 2)),
+            datum(name='Jack', age=(68, 2)),
+            datum(name='John', age=(121, 2))
         ]
         results = nested_merge(['name'], [('age', 'mean')], data)
 
@@ -40,11 +42,11 @@ class TestNestedMerge(object):
 
     def test_two_level_grouping_with_collect(self):
         data = [
-            datum(name='Jill', place='Kettering', age=[34, 36], count=2),
-            datum(name='Jack', place='Kennington', age=[23], count=1),
-            datum(name='James', place='Keswick', age=[10, 21, 32], count=3),
-            datum(name='James', place='Kettering', age=[43, 87], count=2),
-            datum(name='Jill', place='Keswick', age=[76, 32], count=2),
+            datum(name='Jill', place='Kettering', age=(70, 2), count=2),
+            datum(name='Jack', place='Kennington', age=(23, 1), count=1),
+            datum(name='James', place='Keswick', age=(63, 3), count=3),
+            datum(name='James', place='Kettering', age=(130, 2), count=2),
+            datum(name='Jill', place='Keswick', age=(108, 2), count=2),
         ]
         results = nested_merge(['name', 'place'], [('age', 'mean')], data)
 
@@ -89,28 +91,72 @@ class TestNestedMerge(object):
                         }),
                     ))
 
+    def test_three_level_grouping_with_collect(self):
+        data = [
+            {'a': 1, 'b': 'x', 'c': 'p', '_count': 1, 'v:sum': 2},
+            {'a': 1, 'b': 'y', 'c': 'p', '_count': 2, 'v:sum': 3},
+            {'a': 1, 'b': 'x', 'c': 'q', '_count': 3, 'v:sum': 4},
+        ]
+        results = nested_merge(['a', 'b', 'c'], [('v', 'sum')], data)
+
+        assert_that(results, contains(has_entries({
+            'a': 1, 'v:sum': 9, '_count': 6, '_group_count': 2,
+            '_subgroup': contains(
+                has_entries({
+                    'b': 'x', 'v:sum': 6, '_count': 4,
+                    '_subgroup': contains(
+                        has_entries({'c': 'p', 'v:sum': 2}),
+                        has_entries({'c': 'q', 'v:sum': 4}),
+                    )}),
+                has_entries({'b': 'y', 'v:sum': 3, '_count': 2}),
+            )})))
+
+    def test_output_is_encoded_with_sorted_keys(self):
+        data = [
+            datum(name='Jill', place='Kettering', age=(70, 2), count=2),
+            datum(name='Jack', place='Kennington', age=(23, 1), count=1),
+            datum(name='Jill', place='Keswick', age=(108, 2), count=2),
+        ]
+        for row, tags in zip(data, [['b'], ['a'], ['a', 'c']]):
+            row['tags:set'] = tags
+
+        results = nested_merge(['name', 'place'],
+                               [('age', 'mean'), ('tags', 'default')], data)
+
+        assert_that(get_serializer("json").dumps(results), is_(
+            '[{"_count":1,"_group_count":1,"_subgroup":[{"_count":1,'
+            '"age:mean":23.0,"place":"Kennington","tags":["a"],'
+            '"tags:set":["a"]}],"age:mean":23.0,"name":"Jack",'
+            '"tags":["a"],"tags:set":["a"]},'
+            '{"_count":4,"_group_count":2,"_subgroup":[{"_count":2,'
+            '"age:mean":54.0,"place":"Keswick","tags":["a","c"],'
+            '"tags:set":["a","c"]},{"_count":2,"age:mean":35.0,'
+            '"place":"Kettering","tags":["b"],"tags:set":["b"]}],'
+            '"age:mean":44.5,"name":"Jill","tags":["a","b","c"],'
+            '"tags:set":["a","b","c"]}]'))
+
 
 class TestGroupBy(object):
     def test_one_level_grouping(self):
         data = [
-            datum(name='Jill', age=[12, 45]),
-            datum(name='Jack', age=[34, 34]),
-            datum(name='John', age=[56, 65])
+            datum(name='Jill', age=(57, 2)),
+            datum(name='Jack', age=(68, 2)),
+            datum(name='John', age=(121, 2))
         ]
         results = group_by(data, ['name'])
 
         assert_that(results,
                     contains(
-                        is_({'name': 'Jack', 'age': [34, 34], '_count': 1}),
-                        is_({'name': 'Jill', 'age': [12, 45], '_count': 1}),
-                        is_({'name': 'John', 'age': [56, 65], '_count': 1}),
+                        is_({'name': 'Jack', 'age:mean': (68, 2), '_count': 1}),
+                        is_({'name': 'Jill', 'age:mean': (57, 2), '_count': 1}),
+                        is_({'name': 'John', 'age:mean': (121, 2), '_count': 1}),
                     ))
 
     def test_two_level_grouping(self):
         data = [
-            datum(name='Jill', place='Kettering', age=[34, 36], count=2),
-            datum(name='James', place='Kettering', age=[43, 87], count=2),
-            datum(name='Jill', place='Keswick', age=[76, 32], count=2),
+            datum(name='Jill', place='Kettering', age=(70, 2), count=2),
+            datum(name='James', place='Kettering', age=(130, 2), count=2),
+            datum(name='Jill', place='Keswick', age=(108, 2), count=2),
         ]
         results = group_by(data, ['name', 'place'])
 
@@ -119,38 +165,99 @@ class TestGroupBy(object):
                         is_({
                             'name': 'James',
                             '_subgroup': [
-                                {'place': 'Kettering', 'age': [43, 87], '_count': 2}
+                                {'place': 'Kettering', 'age:mean': (130, 2), '_count': 2}
                             ]}),
                         is_({
                             'name': 'Jill',
                             '_subgroup': [
-                                {'place': 'Keswick', 'age': [76, 32], '_count': 2},
-                                {'place': 'Kettering', 'age': [34, 36], '_count': 2},
+                                {'place': 'Keswick', 'age:mean': (108, 2), '_count': 2},
+                                {'place': 'Kettering', 'age:mean': (70, 2), '_count': 2},
                             ]}),
                     ))
 
+    def test_groups_take_the_value_of_their_first_row(self):
+        data = [
+            {'name': 1, 'place': 'b', '_count': 1},
+            {'name': 1.0, 'place': 'a', '_count': 1},
+        ]
+        results = group_by(data, ['name', 'place'])
+
+        assert_that(results, is_([
+            {'name': 1, '_subgroup': [
+                {'place': 'a', '_count': 1},
+                {'place': 'b', '_count': 1},
+            ]},
+        ]))
+        assert_that(results[0]['name'], instance_of(int))
+
+    def test_grouping_by_values_that_cannot_be_hashed(self):
+        data = [
+            {'name': ['b'], 'place': 'Kettering', '_count': 1},
+            {'name': ['a'], 'place': 'Keswick', '_count': 1},
+            {'name': ['b'], 'place': 'Keswick', '_count': 1},
+        ]
+        results = group_by(data, ['name', 'place'])
+
+        assert_that(results, is_([
+            {'name': ['a'], '_subgroup': [
+                {'place': 'Keswick', '_count': 1}]},
+            {'name': ['b'], '_subgroup': [
+                {'place': 'Keswick', '_count': 1},
+                {'place': 'Kettering', '_count': 1}]},
+        ]))
+
+
+def collect_one(group, collect):
+    return apply_collect([group], collect)[0]
 
-class TestApplyCollectToGroup(object):
+
+class TestApplyCollect(object):
     def test_single_level_collect_sum(self):
-        group = {'name': 'Joanne', 'age': [34, 56]}
+        group = {'name': 'Joanne', 'age:sum': 90}
 
-        assert_that(apply_collect_to_group(group, [('age', 'sum')]),
+        assert_that(collect_one(group, [('age', 'sum')]),
                     has_entry('age:sum', 90))
 
     def test_single_level_collect_default(self):
-        group = {'name': 'Joanne', 'age': [34, 56]}
+        group = {'name': 'Joanne', 'age:set': [34, 56]}
 
-        assert_that(apply_collect_to_group(group, [('age', 'default')]),
+        assert_that(collect_one(group, [('age', 'default')]),
                     is_({
                         'name': 'Joanne', 'age:set': [34, 56], 'age': [34, 56]}))
 
+    def test_single_level_collect_mean(self):
+        group = {'name': 'Joanne', 'age:mean': (90, 2)}
+
+        assert_that(collect_one(group, [('age', 'mean')]),
+                    has_entry('age:mean', 45.0))
+
+    def test_same_field_collected_with_several_methods(self):
+        group = {'name': 'Joanne', 'age:mean': (90, 2), 'age:count': 2}
+
+        assert_that(collect_one(group, [('age', 'mean'),
+                                        ('age', 'count'),
+                                        ('age', 'mean')]),
+                    has_entries({'age:mean': 45.0, 'age:count': 2}))
+
+    def test_groups_are_collected_in_place(self):
+        group = {'name': 'Joanne', '_subgroup': [
+            {'place': 'Kettering', 'age:mean': (90, 2)},
+        ]}
+        subgroup = group['_subgroup'][0]
+
+        collected = collect_one(group, [('age', 'mean')])
+
+        assert_that(collected is group, is_(True))
+        assert_that(collected['_subgroup'][0] is subgroup, is_(True))
+        assert_that(subgroup, has_entry('age:mean', 45.0))
+
     def test_double_level_collect_sum(self):
         group = {'name': 'Joanne', '_subgroup': [
-            {'place': 'Kettering', 'age': [34, 56]},
-            {'place': 'Keswick', 'age': [87, 2]},
+            {'place': 'Kettering', 'age:sum': 90},
+            {'place': 'Keswick', 'age:sum': 89},
         ]}
 
-        collected = apply_collect_to_group(group, [('age', 'sum')])
+        collected = collect_one(group, [('age', 'sum')])
 
         # level one
         assert_that(collected, has_entry('age:sum', 179))
@@ -161,13 +268,28 @@ class TestApplyCollectToGroup(object):
                                              has_entry('age:sum', 89)
                                          )))
 
+    def test_double_level_collect_mean(self):
+        group = {'name': 'Joanne', '_subgroup': [
+            {'place': 'Kettering', 'age:mean': (90, 2)},
+            {'place': 'Keswick', 'age:mean': (89, 1)},
+        ]}
+
+        collected = collect_one(group, [('age', 'mean')])
+
+        assert_that(collected, has_entry('age:mean', 179 / 3.0))
+        assert_that(collected, has_entry('_subgroup',
+                                         contains(
+                                             has_entry('age:mean', 45.0),
+                                             has_entry('age:mean', 89.0)
+                                         )))
+
     def test_double_level_collect_default(self):
         group = {'name': 'Joanne', '_subgroup': [
-            {'place': 'Kettering', 'age': [34, 56]},
-            {'place': 'Keswick', 'age': [87, 2]},
+            {'place': 'Kettering', 'age:set': [34, 56]},
+            {'place': 'Keswick', 'age:set': [2, 87]},
         ]}
 
-        collected = apply_collect_to_group(group, [('age', 'default')])
+        collected = collect_one(group, [('age', 'default')])
 
         assert_that(collected, has_entries({
             'age:set': [2, 34, 56, 87],
@@ -185,21 +307,3 @@ class TestApplyCollectToGroup(object):
                                                  'age': [2, 87],
                                              }),
                                          )))
-
-
-class TestCollectAllValues(object):
-    def test_single_level_collect(self):
-        group = {
-            'age': [5]
-        }
-        assert_that(collect_all_values(group, 'age'), [5])
-
-    def test_double_level_collect(self):
-        group = {
-            'age': [5],  # This will be discarded as there are sub groups.
-            '_subgroup': [
-                {'age': [1, 2]},
-                {'age': [3, 4]},
-            ]
-        }
-        assert_that(collect_all_values(group, 'age'), [1, 2, 3, 4])
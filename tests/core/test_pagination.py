@@ -0,0 +1,62 @@
+import unittest
+
+from bson import ObjectId
+from hamcrest import assert_that, is_
+
+from backdrop.core.pagination import encode_cursor, decode_cursor, \
+    after_cursor, CursorError
+from tests.support.test_helpers import d_tz
+
+
+class TestCursors(unittest.TestCase):
+    def test_cursor_round_trips_a_timestamp_and_string_id(self):
+        cursor = encode_cursor({"_timestamp": d_tz(2013, 4, 1), "_id": "a"})
+
+        assert_that(decode_cursor(cursor), is_((d_tz(2013, 4, 1), "a")))
+
+    def test_cursor_round_trips_an_object_id(self):
+        _id = ObjectId("52a9d7fd2da9f2c6f26cfe20")
+        cursor = encode_cursor({"_timestamp": d_tz(2013, 4, 1), "_id": _id})
+
+        assert_that(decode_cursor(cursor), is_((d_tz(2013, 4, 1), _id)))
+
+    def test_cursor_can_be_used_in_a_query_string(self):
+        cursor = encode_cursor({"_timestamp": d_tz(2013, 4, 1), "_id": "ab"})
+
+        assert_that("=" in cursor or "+" in cursor or "/" in cursor,
+                    is_(False))
+
+    def test_tampered_cursors_are_rejected(self):
+        self.assertRaises(CursorError, decode_cursor, "WyJhIl0")
+        self.assertRaises(CursorError, decode_cursor, u"\u2603")
+
+
+class TestAfterCursor(unittest.TestCase):
+    def test_ascending_pages_start_after_the_cursor(self):
+        cursor = encode_cursor({"_timestamp": d_tz(2013, 4, 1), "_id": "a"})
+
+        assert_that(after_cursor(cursor), is_({"$or": [
+            {"_timestamp": d_tz(2013, 4, 1), "_id": {"$gt": "a"}},
+            {"_timestamp": d_tz(2013, 4, 1), "_id": {"$type": 7}},
+            {"_timestamp": {"$gt": d_tz(2013, 4, 1)}},
+        ]}))
+
+    def test_descending_pages_start_before_the_cursor(self):
+        _id = ObjectId("52a9d7fd2da9f2c6f26cfe20")
+        cursor = encode_cursor({"_timestamp": d_tz(2013, 4, 1), "_id": _id})
+
+        assert_that(after_cursor(cursor, "descending"), is_({"$or": [
+            {"_timestamp": d_tz(2013, 4, 1), "_id": {"$lt": _id}},
+            {"_timestamp": d_tz(2013, 4, 1), "_id": {"$type": 2}},
+            {"_timestamp": {"$lt": d_tz(2013, 4, 1)}},
+            {"_timestamp": None},
+        ]}))
+
+    def test_documents_without_a_timestamp_come_first(self):
+        cursor = encode_cursor({"_id": "a"})
+
+        assert_that(after_cursor(cursor), is_({"$or": [
+            {"_timestamp": None, "_id": {"$gt": "a"}},
+            {"_timestamp": None, "_id": {"$type": 7}},
+            {"_timestamp": {"$ne": None}},
+        ]}))
@@ -0,0 +1,85 @@
+import threading
+import unittest
+from hamcrest import assert_that, is_, contains, greater_than_or_equal_to
+from mock import patch
+from backdrop.core import phases
+from backdrop.core.phases import PhaseTimer
+
+
+class TestPhaseTimer(unittest.TestCase):
+
+    @patch('backdrop.core.phases.time')
+    def test_phases_are_timed_in_milliseconds(self, time):
+        time.time.side_effect = [10.0, 10.5, 10.75]
+        timer = PhaseTimer()
+
+        with timer.timed("mongo"):
+            pass
+
+        assert_that(timer.durations(), is_([("mongo", 250.0)]))
+
+    def test_phases_timed_again_are_added_up(self):
+        timer = PhaseTimer()
+        timer.add("mongo", 2)
+        timer.add("merge", 1)
+        timer.add("mongo", 3)
+
+        assert_that(timer.durations(), is_([("mongo", 5), ("merge", 1)]))
+
+    @patch('backdrop.core.phases.time')
+    def test_nested_phases_are_not_counted_twice(self, time):
+        time.time.side_effect = [0.0, 1.0, 1.25, 1.5, 2.0]
+        timer = PhaseTimer()
+
+        with timer.timed("fill"):
+            with timer.timed("mongo"):
+                pass
+
+        assert_that(timer.durations(),
+                    is_([("mongo", 250.0), ("fill", 750.0)]))
+
+    def test_summary_includes_the_total(self):
+        timer = PhaseTimer()
+        timer.add("mongo", 2)
+        timer.started_at, timer.stopped_at = 10.0, 10.5
+
+        assert_that(timer.summary(), is_({"mongo": 2, "total": 500.0}))
+
+
+class TestTimed(unittest.TestCase):
+
+    def tearDown(self):
+        while phases.current() is not None:
+            phases.stop()
+
+    def test_phases_are_not_timed_without_a_timer(self):
+        with phases.timed("mongo"):
+            pass
+
+        assert_that(phases.current(), is_(None))
+
+    def test_phases_are_timed_by_the_started_timer(self):
+        timer = phases.start()
+        with phases.timed("mongo"):
+            pass
+
+        assert_that(phases.stop(), is_(timer))
+        assert_that(timer.durations(), contains(
+            contains("mongo", greater_than_or_equal_to(0))))
+
+    def test_stopping_a_timer_restores_the_one_it_replaced(self):
+        outer = phases.start()
+        inner = phases.start()
+
+        assert_that(phases.stop(), is_(inner))
+        assert_that(phases.current(), is_(outer))
+
+    def test_timers_are_kept_per_thread(self):
+        phases.start()
+        found = []
+        thread = threading.Thread(
+            target=lambda: found.append(phases.current()))
+        thread.start()
+        thread.join()
+
+        assert_that(found, is_([None]))
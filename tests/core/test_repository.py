@@ -3,7 +3,7 @@ from collections import namedtuple
 from backdrop.core.bucket import BucketConfig
 from backdrop.core.repository import BucketConfigRepository, UserConfigRepository
 from hamcrest import assert_that, equal_to, is_, has_entries, match_equality
-from mock import Mock
+from mock import Mock, patch
 from nose.tools import *
 from backdrop.core.user import UserConfig
 
@@ -102,6 +102,79 @@ class TestBucketRepository(unittest.TestCase):
         assert_that(bucket, is_(None))
 
 
+class TestCachedBucketRepository(unittest.TestCase):
+    def setUp(self):
+        self.db = Mock()
+        self.buckets_collection = Mock()
+        self.db.get_collection.return_value = self.buckets_collection
+        self.buckets_collection.find.side_effect = lambda: [
+            {"_id": "foo", "name": "foo",
+             "data_group": "group", "data_type": "type"},
+            {"_id": "bar", "name": "bar",
+             "data_group": "group", "data_type": "other"},
+        ]
+        self.bucket_repo = BucketConfigRepository(self.db, ttl=60)
+
+    @patch('time.time')
+    def test_lookups_are_served_from_memory(self, time):
+        time.return_value = 100
+
+        foo = self.bucket_repo.retrieve("foo")
+        bar = self.bucket_repo.get_bucket_for_query("group", "other")
+        missing = self.bucket_repo.retrieve("baz")
+
+        assert_that(foo.name, is_("foo"))
+        assert_that(bar.name, is_("bar"))
+        assert_that(missing, is_(None))
+        assert_that(self.buckets_collection.find.call_count, is_(1))
+        assert not self.buckets_collection.find_one.called
+
+    @patch('time.time')
+    def test_configs_are_not_reloaded_within_the_ttl(self, time):
+        time.return_value = 100
+        self.bucket_repo.retrieve("foo")
+
+        time.return_value = 159
+        self.bucket_repo.retrieve("foo")
+
+        assert_that(self.buckets_collection.find.call_count, is_(1))
+
+    @patch('time.time')
+    def test_configs_are_reloaded_once_older_than_the_ttl(self, time):
+        time.return_value = 100
+        self.bucket_repo.retrieve("foo")
+
+        time.return_value = 160
+        self.bucket_repo.retrieve("foo")
+
+        assert_that(self.buckets_collection.find.call_count, is_(2))
+
+    def test_saving_a_bucket_reloads_the_configs(self):
+        self.bucket_repo.retrieve("foo")
+
+        self.bucket_repo.save(
+            BucketConfig("baz", data_group="group", data_type="baz"))
+        self.bucket_repo.retrieve("foo")
+
+        assert_that(self.buckets_collection.find.call_count, is_(2))
+
+    def test_cached_configs_cannot_be_changed_by_callers(self):
+        self.buckets_collection.find.side_effect = lambda: [
+            {"_id": "foo", "name": "foo",
+             "data_group": "group", "data_type": "type",
+             "auto_ids": ["key"], "indexes": [[["key", 1]]],
+             "rollups": [{"period": "week", "fields": ["value"]}]},
+        ]
+
+        foo = self.bucket_repo.retrieve("foo")
+
+        assert_that(foo.upload_filters, is_(
+            ("backdrop.core.upload.filters.first_sheet_filter",)))
+        assert_that(foo.auto_ids, is_(("key",)))
+        assert_that(foo.indexes, is_(((("key", 1),),)))
+        assert_that(foo.rollups[0]["fields"], is_(("value",)))
+
+
 class TestUserConfigRepository(object):
     def setUp(self):
         self.db = Mock()
@@ -0,0 +1,228 @@
+import unittest
+from hamcrest import assert_that, is_, has_entries, contains_inanyorder
+from mock import Mock
+from backdrop.core.bucket import BucketConfig
+from backdrop.core.rollups import Rollup, RollupDriver, BucketRollups
+from backdrop.core.timeseries import WEEK, MONTH
+from backdrop.read.query import Query
+from tests.support.test_helpers import d_tz
+
+
+WEEKLY_BY_CHANNEL = {"period": "week", "group_by": "channel",
+                     "fields": ["value"]}
+
+
+class TestRollupCoverage(unittest.TestCase):
+    def setUp(self):
+        self.rollup = Rollup.from_spec(WEEKLY_BY_CHANNEL)
+
+    def test_covers_period_group_queries_on_its_fields(self):
+        query = Query.create(period=WEEK, group_by="channel",
+                             start_at=d_tz(2013, 1, 7),
+                             end_at=d_tz(2013, 2, 4),
+                             collect=[("value", "sum"), ("value", "mean")])
+
+        assert_that(self.rollup.covers(query), is_(True))
+
+    def test_does_not_cover_other_periods_or_groups(self):
+        assert_that(self.rollup.covers(
+            Query.create(period=MONTH, group_by="channel")), is_(False))
+        assert_that(self.rollup.covers(
+            Query.create(period=WEEK, group_by="region")), is_(False))
+        assert_that(self.rollup.covers(
+            Query.create(period=WEEK)), is_(False))
+
+    def test_does_not_cover_filtered_queries(self):
+        query = Query.create(period=WEEK, group_by="channel",
+                             filter_by=[["region", "north"]])
+
+        assert_that(self.rollup.covers(query), is_(False))
+
+    def test_does_not_cover_ranges_off_period_boundaries(self):
+        query = Query.create(period=WEEK, group_by="channel",
+                             start_at=d_tz(2013, 1, 8))
+
+        assert_that(self.rollup.covers(query), is_(False))
+
+    def test_does_not_cover_sets_or_other_fields(self):
+        assert_that(self.rollup.covers(
+            Query.create(period=WEEK, group_by="channel",
+                         collect=[("value", "default")])), is_(False))
+        assert_that(self.rollup.covers(
+            Query.create(period=WEEK, group_by="channel",
+                         collect=[("other", "sum")])), is_(False))
+
+    def test_invalid_rollup_specs_are_rejected(self):
+        self.assertRaises(ValueError, BucketConfig, "foo", "group", "type",
+                          rollups=[{"period": "fortnight"}])
+
+
+class TestRollupUpdates(unittest.TestCase):
+    def setUp(self):
+        self.rollup = Rollup.from_spec(WEEKLY_BY_CHANNEL)
+
+    def test_documents_are_combined_per_period_and_group(self):
+        week = d_tz(2013, 1, 7)
+        updates = self.rollup.updates([
+            {"_week_start_at": week, "channel": "web", "value": 3},
+            {"_week_start_at": week, "channel": "web", "value": 5},
+            {"_week_start_at": week, "channel": "web"},
+            {"_week_start_at": week, "value": 100},
+        ])
+
+        assert_that(len(updates), is_(1))
+        query, update = updates[0]
+        assert_that(query["_id"], is_({"start_at": week, "group": "web"}))
+        assert_that(update, has_entries({
+            "$setOnInsert": {"_week_start_at": week, "channel": "web"},
+            "$inc": {
+                "_count": 3,
+                "fields.value.present": 2,
+                "fields.value.numeric": 2,
+                "fields.value.invalid": 0,
+                "fields.value.sum": 8,
+            },
+            "$min": {"fields.value.min": 3},
+            "$max": {"fields.value.max": 5},
+        }))
+
+    def test_non_numeric_values_are_counted_as_invalid(self):
+        _, update = self.rollup.updates([
+            {"_week_start_at": d_tz(2013, 1, 7), "channel": "web",
+             "value": "lots"},
+        ])[0]
+
+        assert_that(update["$inc"], has_entries({
+            "fields.value.present": 1,
+            "fields.value.invalid": 1,
+            "fields.value.sum": 0,
+        }))
+        assert_that("$min" in update, is_(False))
+
+
+class TestRollupDriver(unittest.TestCase):
+    def setUp(self):
+        self.mongo_driver = Mock()
+        self.driver = RollupDriver(self.mongo_driver,
+                                   Rollup.from_spec(WEEKLY_BY_CHANNEL))
+
+    def test_time_ranges_are_matched_on_the_period_start(self):
+        self.mongo_driver.aggregate.return_value = []
+
+        self.driver.group(["channel", "_week_start_at"],
+                          {"_timestamp": {"$gte": d_tz(2013, 1, 7)}},
+                          [("value", "sum")])
+
+        pipeline = self.mongo_driver.aggregate.call_args[0][0]
+        assert_that(pipeline[0], is_({
+            "$match": {"_week_start_at": {"$gte": d_tz(2013, 1, 7)}}}))
+        assert_that(pipeline[1]["$group"], has_entries({
+            "_count": {"$sum": "$_count"},
+            "c0": {"$sum": "$fields.value.sum"},
+            "c0_invalid": {"$sum": "$fields.value.invalid"},
+        }))
+
+    def test_top_groups_are_picked_from_the_rollup(self):
+        self.mongo_driver.aggregate.return_value = []
+
+        self.driver.group(["channel"], {}, [],
+                          sort=["_count", "ascending"], limit=5)
+
+        pipeline = self.mongo_driver.aggregate.call_args[0][0]
+        assert_that(pipeline[-2:], is_([
+            {"$sort": {"_count": 1, "_id.k0": 1}},
+            {"$limit": 5}]))
+
+    def test_results_have_the_shape_of_a_raw_group(self):
+        self.mongo_driver.aggregate.return_value = [{
+            "_id": {"k0": "web", "k1": d_tz(2013, 1, 7)},
+            "_count": 3, "c0": 8, "c0_values": 2, "c0_invalid": 0,
+        }]
+
+        results = self.driver.group(["channel", "_week_start_at"], {},
+                                    [("value", "mean")])
+
+        assert_that(results, is_([{
+            "channel": "web", "_week_start_at": d_tz(2013, 1, 7),
+            "_count": 3, "value:mean": (8, 2),
+        }]))
+
+
+class TestBucketRollups(unittest.TestCase):
+    def setUp(self):
+        self.collections = {}
+        self.db = Mock()
+        self.db.get_collection.side_effect = \
+            lambda name: self.collections.setdefault(name, Mock())
+        self.rollups = BucketRollups(self.db, "foo", [WEEKLY_BY_CHANNEL])
+        self.rollup_collection = self.db.get_collection(
+            "rollups.foo.week.channel")
+
+    def test_inserted_documents_are_added_in_place(self):
+        self.rollups.update([{"_week_start_at": d_tz(2013, 1, 7),
+                              "channel": "web", "value": 1}])
+
+        assert_that(self.rollup_collection.update_all.call_args[1],
+                    is_({"upsert": True}))
+        assert_that(self.rollup_collection.save_all.called, is_(False))
+
+    def test_periods_of_replaced_documents_are_recomputed(self):
+        week = d_tz(2013, 1, 7)
+        self.db.get_collection("foo").aggregate.return_value = [{
+            "_id": {"k0": week, "k1": "web"}, "_count": 1,
+            "c0_present": 1, "c0_numeric": 1, "c0_invalid": 0,
+            "c0_sum": 4, "c0_min": 4, "c0_max": 4,
+        }]
+
+        self.rollups.update([], [{"_id": "a", "_week_start_at": week,
+                                  "channel": "web", "value": 4}])
+
+        pipeline = self.db.get_collection("foo").aggregate.call_args[0][0]
+        assert_that(pipeline[0]["$match"], has_entries({
+            "_week_start_at": {"$in": [week]}}))
+        saved = self.rollup_collection.save_all.call_args[0][0]
+        assert_that(saved, contains_inanyorder(has_entries({
+            "_week_start_at": week, "channel": "web", "_count": 1,
+            "fields": {"value": {"present": 1, "numeric": 1, "invalid": 0,
+                                 "sum": 4, "min": 4, "max": 4}},
+        })))
+        self.rollup_collection.remove.assert_called_once_with({
+            "_week_start_at": {"$in": [week]},
+            "_id": {"$nin": [{"start_at": week, "group": "web"}]}})
+
+    def test_rebuilt_groups_are_saved_before_stale_ones_are_removed(self):
+        week = d_tz(2013, 1, 7)
+        self.db.get_collection("foo").aggregate.return_value = [{
+            "_id": {"k0": week, "k1": "web"}, "_count": 1,
+            "c0_present": 1, "c0_numeric": 1, "c0_invalid": 0,
+            "c0_sum": 4, "c0_min": 4, "c0_max": 4,
+        }]
+        calls = []
+        self.rollup_collection.save_all.side_effect = \
+            lambda docs: calls.append("save_all")
+        self.rollup_collection.remove.side_effect = \
+            lambda query: calls.append(("remove", query))
+
+        self.rollups.rebuild()
+
+        assert_that(calls, is_([
+            "save_all",
+            ("remove", {"_id": {"$nin": [{"start_at": week,
+                                          "group": "web"}]}})]))
+
+    def test_rebuilding_bumps_the_bucket_version(self):
+        self.db.get_collection("foo").aggregate.return_value = []
+
+        self.rollups.rebuild()
+
+        self.db.get_collection("bucket_metadata").update\
+            .assert_called_once_with(
+                {"_id": "foo"}, {"$inc": {"version": 1}}, upsert=True)
+
+    def test_only_covered_queries_use_a_rollup(self):
+        covered = Query.create(period=WEEK, group_by="channel")
+        uncovered = Query.create(period=WEEK)
+
+        assert_that(self.rollups.driver_for(covered).rollup.group_by,
+                    is_("channel"))
+        assert_that(self.rollups.driver_for(uncovered), is_(None))
@@ -1,7 +1,8 @@
 from unittest import TestCase
 import datetime
 from hamcrest import assert_that, is_, contains
-from backdrop.core.timeseries import timeseries, WEEK, MONTH, DAY, HOUR, QUARTER
+from backdrop.core.timeseries import timeseries, fill_timeseries, \
+    WEEK, MONTH, DAY, HOUR, QUARTER
 from tests.support.test_helpers import d, d_tz
 
 
@@ -54,6 +55,46 @@ class TestTimeseries(TestCase):
         ))
 
 
+class TestFillTimeseries(TestCase):
+    def setUp(self):
+        self.boundaries = WEEK.boundaries(d_tz(2013, 4, 1), d_tz(2013, 4, 22))
+
+    def test_unordered_data_is_put_in_its_periods(self):
+        data = [
+            {"_start_at": d_tz(2013, 4, 15), "value": 2},
+            {"_start_at": d_tz(2013, 4, 1), "value": 1},
+        ]
+
+        ts = fill_timeseries(self.boundaries, data, {"value": 0})
+
+        assert_that([entry["value"] for entry in ts], is_([1, 0, 2]))
+
+    def test_data_outside_the_periods_is_dropped(self):
+        data = [
+            {"_start_at": d_tz(2013, 3, 25), "value": 1},
+            {"_start_at": d_tz(2013, 4, 8), "value": 2},
+            {"_start_at": d_tz(2013, 4, 29), "value": 3},
+        ]
+
+        ts = fill_timeseries(self.boundaries, data, {"value": 0})
+
+        assert_that([entry["value"] for entry in ts], is_([0, 2, 0]))
+
+    def test_naive_timestamps_are_treated_as_utc(self):
+        data = [{"_start_at": d(2013, 4, 8), "value": 2}]
+
+        ts = fill_timeseries(self.boundaries, data, {"value": 0})
+
+        assert_that([entry["value"] for entry in ts], is_([0, 2, 0]))
+
+    def test_filled_entries_are_not_shared(self):
+        ts = fill_timeseries(self.boundaries, [], {"value": 0})
+
+        ts[0]["value"] = 5
+
+        assert_that(ts[1]["value"], is_(0))
+
+
 class TestWeek_start(TestCase):
     def test_that_it_returns_previous_monday_for_midweek(self):
         tuesday = datetime.datetime(2013, 4, 9)
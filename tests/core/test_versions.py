@@ -0,0 +1,68 @@
+import unittest
+import datetime
+from hamcrest import assert_that, is_
+from mock import Mock, patch
+from backdrop.core.versions import BucketVersions
+from tests.support.test_helpers import d_tz
+
+
+class TestBucketVersions(unittest.TestCase):
+    def setUp(self):
+        self.collection = Mock()
+        self.db = Mock()
+        self.db.get_collection.return_value = self.collection
+
+    def test_bump_increments_the_version(self):
+        BucketVersions(self.db).bump("foo")
+
+        self.collection.update.assert_called_once_with(
+            {"_id": "foo"}, {"$inc": {"version": 1}}, upsert=True)
+
+    def test_bump_moves_the_last_updated_watermark_forward(self):
+        updated_at = d_tz(2014, 1, 1)
+        BucketVersions(self.db).bump("foo", updated_at)
+
+        self.collection.update.assert_called_once_with(
+            {"_id": "foo"},
+            {"$inc": {"version": 1},
+             "$max": {"last_updated": updated_at}},
+            upsert=True)
+
+    def test_last_updated_returns_the_watermark_of_each_bucket(self):
+        self.collection.find.return_value = [
+            {"_id": "foo", "last_updated": datetime.datetime(2014, 1, 1)},
+        ]
+
+        last_updated = BucketVersions(self.db).last_updated()
+
+        assert_that(last_updated, is_({"foo": d_tz(2014, 1, 1)}))
+
+    def test_buckets_that_were_never_written_have_version_zero(self):
+        self.collection.find_one.return_value = None
+
+        assert_that(BucketVersions(self.db).get("foo"), is_(0))
+
+    @patch("time.time")
+    def test_versions_are_reused_within_the_ttl(self, time):
+        time.return_value = 100
+        self.collection.find_one.return_value = {"version": 3}
+        versions = BucketVersions(self.db, ttl=5)
+
+        versions.get("foo")
+        time.return_value = 104
+        version = versions.get("foo")
+
+        assert_that(version, is_(3))
+        assert_that(self.collection.find_one.call_count, is_(1))
+
+    @patch("time.time")
+    def test_versions_are_read_again_after_the_ttl(self, time):
+        time.return_value = 100
+        self.collection.find_one.return_value = {"version": 3}
+        versions = BucketVersions(self.db, ttl=5)
+
+        versions.get("foo")
+        time.return_value = 106
+        self.collection.find_one.return_value = {"version": 4}
+
+        assert_that(versions.get("foo"), is_(4))
@@ -1,5 +1,8 @@
+from StringIO import StringIO
+import sys
 import unittest
-from hamcrest import assert_that, only_contains, contains
+from hamcrest import assert_that, only_contains, contains, is_
+from mock import patch
 from backdrop.core.errors import ParseError
 
 from backdrop.core.upload.parse_excel import parse_excel, ExcelError, EXCEL_ERROR
@@ -59,3 +62,27 @@ class ParseExcelTestCase(unittest.TestCase):
                 [None, None, None],
                 ["The above row", "is full", "of nones"]
             )))
+
+    def test_parse_a_stream_that_is_not_on_disk(self):
+        with open(fixture_path("data.xlsx")) as f:
+            file_stream = StringIO(f.read())
+
+        assert_that(parse_excel(file_stream), contains(contains(
+            ["name", "age", "nationality"],
+            ["Pawel", 27, "Polish"],
+            ["Max", 35, "Italian"],
+        )))
+
+    # The package exports a function with the same name as the module
+    @patch.object(sys.modules['backdrop.core.upload.parse_excel'], 'statsd')
+    def test_timings_are_sent_once_per_sheet(self, statsd):
+        for sheet in self._parse_excel("multiple_sheets.xlsx"):
+            list(sheet)
+
+        stats = [args[0] for args, _ in statsd.timing.call_args_list]
+        assert_that(stats, is_([
+            'parse_excel.open_workbook',
+            'parse_excel.sheet',
+            'parse_excel.sheet',
+        ]))
+        statsd.incr.assert_any_call('parse_excel.rows', 4)
@@ -1,5 +1,5 @@
 import unittest
-from hamcrest import only_contains, assert_that
+from hamcrest import only_contains, assert_that, is_
 from backdrop.core.errors import ParseError
 from backdrop.core.upload.utils import make_dicts
 
@@ -71,3 +71,28 @@ class TestMakeRecords(unittest.TestCase):
             {"name": "val1", "size": 123},
             {"name": "val2", "size": 456},
         ))
+
+    def test_errors_give_the_row_number(self):
+        rows = [
+            ["name", "size"],
+            ["bottle", 123],
+            ["", ""],
+            ["screen"],
+        ]
+
+        try:
+            list(make_dicts(rows))
+            self.fail("Expected a ParseError")
+        except ParseError as e:
+            assert_that(e.message, is_(
+                "Row 4 in the file contains fewer values than columns"))
+
+    def test_rows_are_read_as_they_are_needed(self):
+        def rows():
+            yield ("name", "size")
+            yield ("bottle", 123)
+            raise AssertionError("Read too far")
+
+        records = make_dicts(rows())
+
+        assert_that(next(records), is_({"name": "bottle", "size": 123}))
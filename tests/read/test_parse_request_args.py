@@ -141,3 +141,13 @@ class Test_parse_request_args(unittest.TestCase):
         args = parse_request_args(request_args)
 
         assert_that(args['collect'], is_([("some_key", "mean")]))
+
+    def test_fields_are_split_on_commas(self):
+        request_args = MultiDict([
+            ("fields", "_timestamp,value"),
+            ("fields", "name"),
+        ])
+
+        args = parse_request_args(request_args)
+
+        assert_that(args['fields'], is_(["_timestamp", "value", "name"]))
@@ -1,10 +1,12 @@
 from datetime import datetime
 from freezegun import freeze_time
 from hamcrest import *
+from mock import Mock
 import pytz
 from unittest import TestCase
 
-from backdrop.core.timeseries import Day
+from backdrop.core.database import Repository
+from backdrop.core.timeseries import Day, WEEK
 from backdrop.read.query import Query
 from tests.support.test_helpers import d_tz
 
@@ -105,3 +107,91 @@ class TestBuild_query(TestCase):
         query = Query.create(filter_by= [[ "foo", "bar" ], ["foobar", "yes"]])
         assert_that(query.to_mongo_query(),
                     is_({ "foo": "bar", "foobar": "yes" }))
+
+    def test_whole_documents_are_fetched_without_fields(self):
+        assert_that(Query.create().projection, is_(None))
+
+    def test_fields_are_projected(self):
+        query = Query.create(fields=["value", "name"])
+        assert_that(query.projection, is_({"value": 1, "name": 1}))
+
+    def test_pages_keep_their_timestamp(self):
+        query = Query.create(fields=["value"], limit=10)
+        assert_that(query.projection, is_({"value": 1, "_timestamp": 1}))
+
+
+class TestRelativeQueries(TestCase):
+    def setUp(self):
+        self.driver = Mock()
+        self.repository = Repository(self.driver)
+
+    def test_blank_periods_at_the_start_are_skipped_in_one_scan(self):
+        self.driver.group.return_value = [
+            {"_week_start_at": datetime(2012, 12, 3), "_count": 1},
+            {"_week_start_at": datetime(2012, 12, 10), "_count": 4},
+            {"_week_start_at": datetime(2013, 2, 11), "_count": 7},
+        ]
+        query = Query.create(start_at=d_tz(2012, 11, 5), period=WEEK,
+                             duration=10)
+
+        data = query.execute(self.repository).data()
+
+        assert_that(self.driver.group.call_count, is_(1))
+        mongo_query = self.driver.group.call_args[0][1]
+        assert_that(mongo_query["_timestamp"], is_({
+            "$gte": d_tz(2012, 11, 5), "$lt": d_tz(2013, 3, 18)}))
+        assert_that(data, has_length(10))
+        assert_that(data[0], has_entries({
+            "_start_at": d_tz(2012, 12, 3), "_count": 1}))
+        assert_that(data[-1], has_entries({
+            "_start_at": d_tz(2013, 2, 4), "_count": 0}))
+
+    def test_blank_periods_at_the_end_are_skipped_in_one_scan(self):
+        self.driver.group.return_value = [
+            {"_week_start_at": datetime(2012, 10, 1), "_count": 3},
+            {"_week_start_at": datetime(2012, 12, 3), "_count": 1},
+            {"_week_start_at": datetime(2012, 12, 10), "_count": 4},
+        ]
+        query = Query.create(end_at=d_tz(2013, 2, 4), period=WEEK,
+                             duration=10)
+
+        data = query.execute(self.repository).data()
+
+        assert_that(self.driver.group.call_count, is_(1))
+        assert_that(data, has_length(10))
+        assert_that(data[0], has_entries({
+            "_start_at": d_tz(2012, 10, 8), "_count": 0}))
+        assert_that(data[-1], has_entries({
+            "_start_at": d_tz(2012, 12, 10), "_count": 4}))
+
+    def test_the_window_is_unchanged_without_data(self):
+        self.driver.group.return_value = []
+        query = Query.create(start_at=d_tz(2012, 11, 5), period=WEEK,
+                             duration=2)
+
+        data = query.execute(self.repository).data()
+
+        assert_that([datum["_start_at"] for datum in data],
+                    is_([d_tz(2012, 11, 5), d_tz(2012, 11, 12)]))
+
+    def test_grouped_queries_skip_periods_that_are_blank_in_every_group(self):
+        self.driver.group.return_value = [
+            {"name": "a", "_week_start_at": datetime(2012, 11, 19),
+             "_count": 1},
+            {"name": "b", "_week_start_at": datetime(2012, 11, 12),
+             "_count": 2},
+            {"name": "b", "_week_start_at": datetime(2012, 11, 26),
+             "_count": 5},
+        ]
+        query = Query.create(start_at=d_tz(2012, 11, 5), period=WEEK,
+                             duration=2, group_by="name")
+
+        data = query.execute(self.repository).data()
+
+        assert_that(self.driver.group.call_count, is_(1))
+        assert_that(data, contains(
+            has_entries({"name": "a", "_count": 1}),
+            has_entries({"name": "b", "_count": 2}),
+        ))
+        assert_that([datum["_start_at"] for datum in data[1]["values"]],
+                    is_([d_tz(2012, 11, 12), d_tz(2012, 11, 19)]))
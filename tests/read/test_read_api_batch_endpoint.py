@@ -0,0 +1,149 @@
+import json
+import unittest
+from hamcrest import assert_that, is_, has_entries
+from mock import patch, Mock
+from backdrop.core.bucket import BucketConfig
+from backdrop.core.nested_merge import InvalidOperationError
+from backdrop.read import api
+from backdrop.read.query import Query
+from tests.support.bucket import stub_bucket_retrieve_by_name
+from tests.support.test_helpers import has_status
+
+
+def query_result(data):
+    return Mock(data=Mock(return_value=data))
+
+
+class BatchApiTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = api.app.test_client()
+
+    def post_batch(self, entries):
+        response = self.app.post('/_batch', data=json.dumps(entries),
+                                 content_type='application/json')
+        return response, json.loads(response.data)
+
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.read.api.bucket_versions', Mock())
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_results_are_keyed_by_id(self, mock_query):
+        mock_query.return_value = query_result([{"name": "a", "_count": 1}])
+
+        response, body = self.post_batch([
+            {"id": "names", "bucket": "foo", "query": {"group_by": "name"}},
+            {"id": "more", "bucket": "foo",
+             "query": {"group_by": "name", "collect": ["value"]}},
+        ])
+
+        assert_that(response, has_status(200))
+        assert_that(body["results"]["names"], is_({
+            "status": 200, "body": {"data": [{"name": "a", "_count": 1}]}}))
+        assert_that(body["results"]["more"]["status"], is_(200))
+        mock_query.assert_any_call(
+            Query.create(group_by=u"name", collect=[(u"value", "default")]))
+
+    @patch('backdrop.core.repository.BucketConfigRepository'
+           '.get_bucket_for_query')
+    @patch('backdrop.read.api.bucket_versions', Mock())
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_buckets_can_be_found_by_data_group_and_type(
+            self, mock_query, get_bucket_for_query):
+        mock_query.return_value = query_result([])
+        get_bucket_for_query.return_value = BucketConfig(
+            "foo", data_group="some-group", data_type="some-type")
+
+        _, body = self.post_batch([
+            {"id": "a", "data_group": "some-group", "data_type": "some-type",
+             "query": {"group_by": "name"}},
+        ])
+
+        get_bucket_for_query.assert_called_once_with("some-group",
+                                                     "some-type")
+        assert_that(body["results"]["a"]["status"], is_(200))
+
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.read.api.bucket_versions', Mock())
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_each_query_has_its_own_errors(self, mock_query):
+        mock_query.return_value = query_result([])
+
+        _, body = self.post_batch([
+            {"id": "ok", "bucket": "foo", "query": {"group_by": "name"}},
+            {"id": "missing", "bucket": "bar", "query": {}},
+            {"id": "invalid", "bucket": "foo",
+             "query": {"group_by": "name", "limit": "-1"}},
+        ])
+
+        assert_that(body["results"]["ok"]["status"], is_(200))
+        assert_that(body["results"]["missing"], has_entries({
+            "status": 404,
+            "body": {"status": "error", "message": "bucket not found"}}))
+        assert_that(body["results"]["invalid"], has_entries({
+            "status": 400,
+            "body": {"status": "error",
+                     "message": "limit must be a positive integer"}}))
+
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.read.api.bucket_versions', Mock())
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_invalid_collect_functions_are_reported(self, mock_query):
+        mock_query.side_effect = InvalidOperationError("Unable to sum")
+
+        _, body = self.post_batch([
+            {"id": "sum", "bucket": "foo",
+             "query": {"group_by": "name", "collect": "value:sum"}},
+        ])
+
+        assert_that(body["results"]["sum"]["status"], is_(400))
+
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.read.api.bucket_versions', Mock())
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_ids_default_to_the_position_in_the_batch(self, mock_query):
+        mock_query.return_value = query_result([])
+
+        _, body = self.post_batch([
+            {"bucket": "foo", "query": {"group_by": "name"}},
+        ])
+
+        assert_that(body["results"]["0"]["status"], is_(200))
+
+    def test_batches_share_one_pool(self):
+        assert_that(api.batch_pool(), is_(api.batch_pool()))
+
+    @patch('backdrop.read.api.batch_pool')
+    @patch('backdrop.read.api.batch_result', Mock(return_value=(200, '[]')))
+    def test_batches_run_on_the_shared_pool(self, batch_pool):
+        batch_pool.return_value.map.side_effect = map
+
+        response, body = self.post_batch([{"bucket": "foo"},
+                                          {"bucket": "bar"}])
+
+        assert_that(batch_pool.return_value.map.call_count, is_(1))
+        assert_that(body["results"], has_entries({
+            "0": {"status": 200, "body": []},
+            "1": {"status": 200, "body": []}}))
+
+    def test_body_must_be_a_list_of_queries(self):
+        response, _ = self.post_batch({"bucket": "foo"})
+
+        assert_that(response, has_status(400))
+
+    def test_ids_must_be_unique(self):
+        response, _ = self.post_batch([{"id": "a"}, {"id": "a"}])
+
+        assert_that(response, has_status(400))
+
+    @patch.dict(api.app.config, {'BATCH_MAX_QUERIES': 1})
+    def test_batches_are_limited_in_size(self):
+        response, _ = self.post_batch([{"id": "a"}, {"id": "b"}])
+
+        assert_that(response, has_status(400))
+
+    def test_cors_preflight_allows_json_bodies(self):
+        response = self.app.open('/_batch', method='OPTIONS')
+
+        assert_that(response.headers['Access-Control-Allow-Headers'],
+                    is_('content-type'))
+        assert_that(response.headers['Access-Control-Allow-Origin'],
+                    is_('*'))
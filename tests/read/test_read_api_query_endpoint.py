@@ -1,12 +1,17 @@
 import unittest
 import urllib
+import json
 import datetime
 from hamcrest import *
 from mock import patch, Mock
 import pytz
+from backdrop.core.database import Database
+from backdrop.core.pagination import encode_cursor
 from backdrop.core.timeseries import WEEK
 from backdrop.read import api
 from backdrop.read.query import Query
+from backdrop.read.response import StreamingData
+from backdrop.read.result_cache import ResultCache
 from tests.support.bucket import stub_bucket_retrieve_by_name
 from tests.support.test_helpers import has_status
 
@@ -27,6 +32,7 @@ class QueryingApiTestCase(unittest.TestCase):
         self.app = api.app.test_client()
 
     @stub_bucket_retrieve_by_name("foo", raw_queries_allowed=True)
+    @patch('backdrop.read.api.bucket_versions', Mock())
     @patch('backdrop.core.bucket.Bucket.query')
     def test_filter_by_query_is_executed(self, mock_query):
         mock_query.return_value = NoneData()
@@ -34,7 +40,17 @@ class QueryingApiTestCase(unittest.TestCase):
         mock_query.assert_called_with(
             Query.create(filter_by=[[u'zombies', u'yes']]))
 
+    @stub_bucket_retrieve_by_name("foo", raw_queries_allowed=True)
+    @patch('backdrop.read.api.bucket_versions', Mock())
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_fields_are_passed_to_the_query(self, mock_query):
+        mock_query.return_value = NoneData()
+        self.app.get('/foo?fields=_timestamp,value')
+        mock_query.assert_called_with(
+            Query.create(fields=[u'_timestamp', u'value']))
+
     @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.read.api.bucket_versions', Mock())
     @patch('backdrop.core.bucket.Bucket.query')
     def test_group_by_query_is_executed(self, mock_query):
         mock_query.return_value = NoneData()
@@ -43,6 +59,7 @@ class QueryingApiTestCase(unittest.TestCase):
             Query.create(group_by=u'zombies'))
 
     @stub_bucket_retrieve_by_name("foo", raw_queries_allowed=True)
+    @patch('backdrop.read.api.bucket_versions', Mock())
     @patch('backdrop.core.bucket.Bucket.query')
     def test_query_with_start_and_end_is_executed(self, mock_query):
         mock_query.return_value = NoneData()
@@ -58,6 +75,7 @@ class QueryingApiTestCase(unittest.TestCase):
             Query.create(start_at=expected_start_at, end_at=expected_end_at))
 
     @stub_bucket_retrieve_by_name("foo", raw_queries_allowed=True)
+    @patch('backdrop.read.api.bucket_versions', Mock())
     @patch('backdrop.core.bucket.Bucket.query')
     def test_sort_query_is_executed(self, mock_query):
         mock_query.return_value = NoneData()
@@ -73,6 +91,85 @@ class QueryingApiTestCase(unittest.TestCase):
         mock_query.assert_called_with(
             Query.create(sort_by=["value", "descending"]))
 
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.read.api.bucket_versions')
+    @patch('backdrop.read.api.result_cache', ResultCache(1000))
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_repeated_queries_are_served_from_the_cache(self, mock_query,
+                                                        bucket_versions):
+        mock_query.return_value = NoneData()
+        bucket_versions.get.return_value = 1
+
+        first = self.app.get('/foo?group_by=zombies')
+        second = self.app.get('/foo?group_by=zombies')
+
+        assert_that(mock_query.call_count, is_(1))
+        assert_that(second.data, is_(first.data))
+        assert_that(second.headers['ETag'], is_(first.headers['ETag']))
+
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.read.api.bucket_versions')
+    @patch('backdrop.read.api.result_cache', ResultCache(1000))
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_writes_invalidate_cached_queries(self, mock_query,
+                                              bucket_versions):
+        mock_query.return_value = NoneData()
+        bucket_versions.get.return_value = 1
+        self.app.get('/foo?group_by=zombies')
+
+        bucket_versions.get.return_value = 2
+        self.app.get('/foo?group_by=zombies')
+
+        assert_that(mock_query.call_count, is_(2))
+
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.read.api.bucket_versions')
+    @patch('backdrop.read.api.result_cache', ResultCache(1000))
+    @patch.object(Database, 'reads_from_secondaries', True)
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_queries_read_from_secondaries_are_not_cached(self, mock_query,
+                                                          bucket_versions):
+        mock_query.return_value = NoneData()
+        etag = self.app.get('/foo?group_by=zombies').headers['ETag']
+
+        response = self.app.get('/foo?group_by=zombies',
+                                headers={'If-None-Match': etag})
+
+        assert_that(response, has_status(304))
+        assert_that(mock_query.call_count, is_(2))
+        assert_that(bucket_versions.get.called, is_(False))
+
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.read.api.bucket_versions')
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_matching_etags_skip_the_query(self, mock_query,
+                                           bucket_versions):
+        mock_query.return_value = NoneData()
+        bucket_versions.get.return_value = 1
+        etag = self.app.get('/foo?group_by=zombies').headers['ETag']
+
+        response = self.app.get('/foo?group_by=zombies',
+                                headers={'If-None-Match': etag})
+
+        assert_that(response, has_status(304))
+        assert_that(mock_query.call_count, is_(1))
+
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.read.api.bucket_versions')
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_etags_change_when_the_bucket_is_written(self, mock_query,
+                                                     bucket_versions):
+        mock_query.return_value = NoneData()
+        bucket_versions.get.return_value = 1
+        etag = self.app.get('/foo?group_by=zombies').headers['ETag']
+
+        bucket_versions.get.return_value = 2
+        response = self.app.get('/foo?group_by=zombies',
+                                headers={'If-None-Match': etag})
+
+        assert_that(response, has_status(200))
+        assert_that(mock_query.call_count, is_(2))
+
     @stub_bucket_retrieve_by_name("bucket", queryable=False)
     def test_returns_404_when_bucket_is_not_queryable(self):
         response = self.app.get('/bucket')
@@ -105,3 +202,109 @@ class PreflightChecksApiTestCase(unittest.TestCase):
         response = self.app.open('/bucket', method='OPTIONS')
         assert_that(response.headers['Access-Control-Allow-Headers'],
                     is_('cache-control'))
+
+
+class StreamingApiTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = api.app.test_client()
+
+    @stub_bucket_retrieve_by_name("foo", raw_queries_allowed=True)
+    @patch('backdrop.read.api.bucket_versions', Mock())
+    @patch.dict(api.app.config, {'STREAM_RAW_QUERIES': True})
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_raw_queries_are_streamed(self, mock_query):
+        mock_query.return_value = StreamingData(iter([
+            {"_timestamp": datetime.datetime(2014, 1, 1), "a": 1},
+            {"a": 2},
+        ]))
+
+        response = self.app.get('/foo')
+
+        mock_query.assert_called_once_with(Query.create(), stream=True)
+        assert_that(response, has_status(200))
+        assert_that(json.loads(response.data), is_({"data": [
+            {"_timestamp": "2014-01-01T00:00:00+00:00", "a": 1},
+            {"a": 2},
+        ]}))
+        assert_that(response.headers.get('ETag'), is_not(None))
+
+    def test_documents_are_written_in_chunks(self):
+        chunks = list(api.stream_json(
+            'data', [{"a": 1}, {"a": 2}, {"a": 3}], chunk_size=1))
+
+        assert_that(len(chunks), is_(4))
+        assert_that(json.loads(''.join(chunks)),
+                    is_({"data": [{"a": 1}, {"a": 2}, {"a": 3}]}))
+
+    def test_an_empty_result_is_an_empty_list(self):
+        chunks = api.stream_json('data', [])
+
+        assert_that(json.loads(''.join(chunks)), is_({"data": []}))
+
+    def test_trailer_fields_follow_the_documents(self):
+        chunks = api.stream_json('data', [{"a": 1}],
+                                 trailer=lambda: {"next": "abc"})
+
+        assert_that(json.loads(''.join(chunks)),
+                    is_({"data": [{"a": 1}], "next": "abc"}))
+
+    def test_streamed_output_is_as_compact_as_encoded_output(self):
+        chunks = api.stream_json('data', [{"a": 1}],
+                                 trailer=lambda: {"next": "abc"})
+
+        assert_that(''.join(chunks), is_('{"data":[{"a":1}],"next":"abc"}'))
+
+
+class PaginationApiTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = api.app.test_client()
+        self.documents = [
+            {"_id": "a", "_timestamp": datetime.datetime(
+                2014, 1, 1, tzinfo=pytz.UTC)},
+            {"_id": "b", "_timestamp": datetime.datetime(
+                2014, 1, 2, tzinfo=pytz.UTC)},
+        ]
+
+    @stub_bucket_retrieve_by_name("foo", raw_queries_allowed=True)
+    @patch('backdrop.read.api.bucket_versions', Mock())
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_full_pages_link_to_the_next_page(self, mock_query):
+        mock_query.return_value = Mock(data=Mock(return_value=self.documents))
+
+        response = self.app.get('/foo?limit=2')
+
+        assert_that(json.loads(response.data)["next"],
+                    is_(encode_cursor(self.documents[-1])))
+
+    @stub_bucket_retrieve_by_name("foo", raw_queries_allowed=True)
+    @patch('backdrop.read.api.bucket_versions', Mock())
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_the_last_page_has_no_next_page(self, mock_query):
+        mock_query.return_value = Mock(data=Mock(return_value=self.documents))
+
+        response = self.app.get('/foo?limit=3')
+
+        assert_that(json.loads(response.data), is_not(has_key("next")))
+
+    @stub_bucket_retrieve_by_name("foo", raw_queries_allowed=True)
+    @patch('backdrop.read.api.bucket_versions', Mock())
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_the_cursor_is_passed_to_the_query(self, mock_query):
+        mock_query.return_value = Mock(data=Mock(return_value=[]))
+        cursor = encode_cursor(self.documents[0])
+
+        self.app.get('/foo?limit=2&cursor=' + cursor)
+
+        mock_query.assert_called_with(Query.create(limit=2, cursor=cursor))
+
+    @stub_bucket_retrieve_by_name("foo", raw_queries_allowed=True)
+    @patch('backdrop.read.api.bucket_versions', Mock())
+    @patch.dict(api.app.config, {'STREAM_RAW_QUERIES': True})
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_streamed_pages_link_to_the_next_page(self, mock_query):
+        mock_query.return_value = StreamingData(iter(self.documents))
+
+        response = self.app.get('/foo?limit=2')
+
+        assert_that(json.loads(response.data)["next"],
+                    is_(encode_cursor(self.documents[-1])))
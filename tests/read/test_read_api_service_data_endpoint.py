@@ -4,6 +4,7 @@ import datetime
 from hamcrest import *
 from mock import patch, Mock
 import pytz
+from backdrop.core.bucket import BucketConfig
 from backdrop.core.timeseries import WEEK
 from backdrop.read import api
 from backdrop.read.query import Query
@@ -20,7 +21,28 @@ class QueryingApiTestCase(unittest.TestCase):
     def setUp(self):
         self.app = api.app.test_client()
 
+    @patch('backdrop.core.repository.BucketConfigRepository'
+           '.get_bucket_for_query')
+    @patch('backdrop.read.api.bucket_versions')
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_responses_are_conditional_on_the_etag(
+            self, mock_query, bucket_versions, get_bucket_for_query):
+        mock_query.return_value = NoneData()
+        bucket_versions.get.return_value = 1
+        get_bucket_for_query.return_value = BucketConfig(
+            "foo", data_group="some-group", data_type="some-type")
+
+        url = '/data/some-group/some-type?group_by=zombies'
+        first = self.app.get(url)
+        second = self.app.get(url,
+                              headers={'If-None-Match': first.headers['ETag']})
+
+        assert_that(first, has_status(200))
+        assert_that(second, has_status(304))
+        assert_that(mock_query.call_count, is_(1))
+
     @setup_bucket("foo", data_group="some-group", data_type="some-type")
+    @patch('backdrop.read.api.bucket_versions', Mock())
     @patch('backdrop.core.bucket.Bucket.query')
     def test_period_query_is_executed(self, mock_query):
         mock_query.return_value = NoneData()
@@ -35,6 +57,7 @@ class QueryingApiTestCase(unittest.TestCase):
                          end_at=d_tz(2012, 12, 3)))
 
     @setup_bucket("foo", data_group="some-group", data_type="some-type", raw_queries_allowed=True)
+    @patch('backdrop.read.api.bucket_versions', Mock())
     @patch('backdrop.core.bucket.Bucket.query')
     def test_filter_by_query_is_executed(self, mock_query):
         mock_query.return_value = NoneData()
@@ -43,6 +66,7 @@ class QueryingApiTestCase(unittest.TestCase):
             Query.create(filter_by=[[u'zombies', u'yes']]))
 
     @setup_bucket("foo", data_group="some-group", data_type="some-type")
+    @patch('backdrop.read.api.bucket_versions', Mock())
     @patch('backdrop.core.bucket.Bucket.query')
     def test_group_by_query_is_executed(self, mock_query):
         mock_query.return_value = NoneData()
@@ -51,6 +75,7 @@ class QueryingApiTestCase(unittest.TestCase):
             Query.create(group_by=u'zombies'))
 
     @setup_bucket("foo", data_group="some-group", data_type="some-type", raw_queries_allowed=True)
+    @patch('backdrop.read.api.bucket_versions', Mock())
     @patch('backdrop.core.bucket.Bucket.query')
     def test_query_with_start_and_end_is_executed(self, mock_query):
         mock_query.return_value = NoneData()
@@ -67,6 +92,7 @@ class QueryingApiTestCase(unittest.TestCase):
             Query.create(start_at=expected_start_at, end_at=expected_end_at))
 
     @setup_bucket("foo", data_group="some-group", data_type="some-type")
+    @patch('backdrop.read.api.bucket_versions', Mock())
     @patch('backdrop.core.bucket.Bucket.query')
     def test_group_by_with_period_is_executed(self, mock_query):
         mock_query.return_value = NoneData()
@@ -83,6 +109,7 @@ class QueryingApiTestCase(unittest.TestCase):
                          end_at=d_tz(2012, 12, 3)))
 
     @setup_bucket("foo", data_group="some-group", data_type="some-type", raw_queries_allowed=True)
+    @patch('backdrop.read.api.bucket_versions', Mock())
     @patch('backdrop.core.bucket.Bucket.query')
     def test_sort_query_is_executed(self, mock_query):
         mock_query.return_value = NoneData()
@@ -108,6 +135,49 @@ class QueryingApiTestCase(unittest.TestCase):
         assert_that(response, has_status(404))
 
 
+class PhaseTimingApiTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = api.app.test_client()
+
+    @patch('backdrop.core.repository.BucketConfigRepository'
+           '.get_bucket_for_query')
+    @patch('backdrop.read.api.bucket_versions')
+    @patch('backdrop.core.bucket.Bucket.query')
+    @patch('backdrop.read.api.statsd')
+    def test_phases_are_reported_for_the_bucket(
+            self, statsd, mock_query, bucket_versions, get_bucket_for_query):
+        mock_query.return_value = NoneData()
+        bucket_versions.get.return_value = 1
+        get_bucket_for_query.return_value = BucketConfig(
+            "foo", data_group="some-group", data_type="some-type")
+
+        response = self.app.get('/data/some-group/some-type?group_by=zombies')
+
+        phases = [timing.split(';')[0] for timing in
+                  response.headers['Server-Timing'].split(', ')]
+        assert_that(phases, is_(
+            ['config', 'validate', 'version', 'encode', 'total']))
+
+        timed = [call[0][0] for call in statsd.timing.call_args_list]
+        assert_that(sorted(timed), is_(sorted(
+            'read.phase.%s' % phase for phase in phases)))
+        for call in statsd.timing.call_args_list:
+            assert_that(call[1], is_({'bucket': 'foo'}))
+
+    @patch('backdrop.core.repository.BucketConfigRepository'
+           '.get_bucket_for_query')
+    @patch('backdrop.read.api.statsd')
+    def test_unknown_buckets_have_no_phases_sent_to_statsd(
+            self, statsd, get_bucket_for_query):
+        get_bucket_for_query.return_value = None
+
+        response = self.app.get('/data/some-group/some-type')
+
+        assert_that(response.headers['Server-Timing'],
+                    starts_with('config;dur='))
+        assert_that(statsd.timing.called, is_(False))
+
+
 class PreflightChecksApiTestCase(unittest.TestCase):
     def setUp(self):
         self.app = api.app.test_client()
@@ -135,12 +205,14 @@ class PreflightChecksApiTestCase(unittest.TestCase):
         assert_that(response, has_header('Access-Control-Allow-Headers', 'cache-control'))
 
     @setup_bucket("bucket", data_group="some-group", data_type="some-type", raw_queries_allowed=True)
+    @patch('backdrop.read.api.bucket_versions', Mock())
     def test_max_age_is_30_min_for_non_realtime_buckets(self):
         response = self.app.get('/data/some-group/some-type')
 
         assert_that(response, has_header('Cache-Control', 'max-age=1800, must-revalidate'))
 
     @setup_bucket("bucket", data_group="some-group", data_type="some-type", realtime=True, raw_queries_allowed=True)
+    @patch('backdrop.read.api.bucket_versions', Mock())
     def test_max_age_is_2_min_for_realtime_buckets(self):
         response = self.app.get('/data/some-group/some-type')
 
@@ -0,0 +1,63 @@
+import unittest
+import datetime
+from hamcrest import assert_that, is_
+from mock import patch
+from backdrop.core import timeutils
+from backdrop.core.bucket import BucketConfig
+from backdrop.read import api
+from tests.support.test_helpers import has_status
+
+
+class StatusEndpointTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = api.app.test_client()
+        self.now = timeutils.now()
+
+    def _ago(self, seconds):
+        return self.now - datetime.timedelta(seconds=seconds)
+
+    @patch('backdrop.read.api.bucket_versions')
+    @patch('backdrop.core.repository.BucketConfigRepository.get_all')
+    @patch('backdrop.core.bucket.Bucket.get_last_updated')
+    def test_fresh_watermarks_do_not_query_the_buckets(
+            self, get_last_updated, get_all, bucket_versions):
+        get_all.return_value = [
+            BucketConfig("foo", "group", "foo", max_age_expected=60)]
+        bucket_versions.last_updated.return_value = {"foo": self._ago(10)}
+
+        response = self.app.get('/_status/buckets')
+
+        assert_that(response, has_status(200))
+        assert_that(get_last_updated.called, is_(False))
+
+    @patch('backdrop.read.api.bucket_versions')
+    @patch('backdrop.core.repository.BucketConfigRepository.get_all')
+    @patch('backdrop.core.bucket.Bucket.get_last_updated')
+    def test_stale_watermarks_are_checked_against_the_bucket(
+            self, get_last_updated, get_all, bucket_versions):
+        get_all.return_value = [
+            BucketConfig("foo", "group", "foo", max_age_expected=60)]
+        bucket_versions.last_updated.return_value = {}
+        get_last_updated.return_value = self._ago(10)
+
+        response = self.app.get('/_status/buckets')
+
+        assert_that(response, has_status(200))
+        bucket_versions.set_last_updated.assert_called_once_with(
+            "foo", self._ago(10))
+
+    @patch('backdrop.read.api.bucket_versions')
+    @patch('backdrop.core.repository.BucketConfigRepository.get_all')
+    @patch('backdrop.core.bucket.Bucket.get_last_updated')
+    def test_out_of_date_buckets_fail(
+            self, get_last_updated, get_all, bucket_versions):
+        get_all.return_value = [
+            BucketConfig("foo", "group", "foo", max_age_expected=60),
+            BucketConfig("bar", "group", "bar", max_age_expected=None)]
+        bucket_versions.last_updated.return_value = {"foo": self._ago(100)}
+        get_last_updated.return_value = self._ago(100)
+
+        response = self.app.get('/_status/buckets')
+
+        assert_that(response, has_status(500))
+        assert_that(bucket_versions.set_last_updated.called, is_(False))
@@ -0,0 +1,80 @@
+import unittest
+from hamcrest import assert_that, is_
+from backdrop.read.query import Query
+from backdrop.core.timeseries import WEEK, Week
+from backdrop.read.result_cache import ResultCache, cache_key, query_etag
+
+
+class TestCacheKey(unittest.TestCase):
+    def test_equal_queries_have_equal_keys(self):
+        key1 = cache_key("foo", 1, Query.create(filter_by=[["a", "b"]]))
+        key2 = cache_key("foo", 1, Query.create(filter_by=[["a", "b"]]))
+
+        assert_that(key1, is_(key2))
+        assert_that(hash(key1), is_(hash(key2)))
+
+    def test_keys_change_with_the_bucket_version(self):
+        query = Query.create(group_by="a")
+
+        assert cache_key("foo", 1, query) != cache_key("foo", 2, query)
+
+
+class TestQueryEtag(unittest.TestCase):
+    def test_etags_do_not_depend_on_the_period_instance(self):
+        etag1 = query_etag("foo", 1, Query.create(period=Week()))
+        etag2 = query_etag("foo", 1, Query.create(period=Week()))
+
+        assert_that(etag1, is_(etag2))
+
+    def test_etags_change_with_the_bucket_version_and_query(self):
+        query = Query.create(period=WEEK, group_by="a")
+
+        etags = set([query_etag("foo", 1, query),
+                     query_etag("foo", 2, query),
+                     query_etag("foo", 1, query._replace(group_by="b"))])
+
+        assert_that(len(etags), is_(3))
+
+
+class TestResultCache(unittest.TestCase):
+    def test_missing_keys_return_none(self):
+        assert_that(ResultCache(100).get("foo"), is_(None))
+
+    def test_cached_bodies_are_returned(self):
+        cache = ResultCache(100)
+
+        cache.set("foo", "some json")
+
+        assert_that(cache.get("foo"), is_("some json"))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = ResultCache(10)
+        cache.set("a", "aaaa")
+        cache.set("b", "bbbb")
+        cache.get("a")
+
+        cache.set("c", "cccc")
+
+        assert_that(cache.get("b"), is_(None))
+        assert_that(cache.get("a"), is_("aaaa"))
+        assert_that(cache.get("c"), is_("cccc"))
+        assert_that(cache.size, is_(8))
+
+    def test_bodies_larger_than_the_cache_are_not_stored(self):
+        cache = ResultCache(4)
+
+        cache.set("a", "aaaaa")
+
+        assert_that(cache.get("a"), is_(None))
+        assert_that(cache.size, is_(0))
+
+    def test_replacing_an_entry_keeps_the_size_right(self):
+        cache = ResultCache(10)
+
+        cache.set("a", "aaaa")
+        cache.set("a", "aa")
+
+        assert_that(cache.size, is_(2))
+
+    def test_a_zero_sized_cache_is_disabled(self):
+        assert_that(ResultCache(0).enabled, is_(False))
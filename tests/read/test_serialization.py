@@ -0,0 +1,57 @@
+import unittest
+import datetime
+import json
+from bson import ObjectId
+from freezegun import freeze_time
+from hamcrest import assert_that, is_
+from mock import Mock
+from backdrop.read.serialization import JsonSerializer, get_serializer
+from tests.support.test_helpers import d_tz
+
+
+class TestJsonSerializer(unittest.TestCase):
+    def setUp(self):
+        self.serializer = get_serializer("json")
+
+    def test_output_is_compact(self):
+        assert_that(self.serializer.dumps({"data": [{"a": 1}]}),
+                    is_('{"data":[{"a":1}]}'))
+
+    def test_keys_are_sorted(self):
+        assert_that(self.serializer.dumps({"b": 1, "_id": 2, "a": 3}),
+                    is_('{"_id":2,"a":3,"b":1}'))
+
+    def test_datetimes_and_object_ids_are_encoded_as_strings(self):
+        encoded = self.serializer.dumps({
+            "_timestamp": d_tz(2014, 1, 1),
+            "_id": ObjectId("52a9d7fd2da9f2c6f26cfe20"),
+        })
+
+        assert_that(json.loads(encoded), is_({
+            "_timestamp": "2014-01-01T00:00:00+00:00",
+            "_id": "52a9d7fd2da9f2c6f26cfe20",
+        }))
+
+    @freeze_time("2014-01-01")
+    def test_datetime_subclasses_are_encoded(self):
+        encoded = self.serializer.dumps([datetime.datetime.now()])
+
+        assert_that(encoded, is_('["2014-01-01T00:00:00"]'))
+
+    def test_nested_datetimes_are_encoded_without_a_callback(self):
+        module = Mock()
+        serializer = JsonSerializer("mock", module)
+
+        start_at = d_tz(2014, 1, 1)
+        serializer.dumps({"data": ({"values": [{"_start_at": start_at}]},)})
+
+        args, kwargs = module.dumps.call_args
+        assert_that(args[0], is_({"data": [{"values": [
+            {"_start_at": "2014-01-01T00:00:00+00:00"}]}]}))
+        assert_that("default" in kwargs, is_(False))
+
+    def test_unknown_types_are_rejected(self):
+        self.assertRaises(TypeError, self.serializer.dumps, [object()])
+
+    def test_unavailable_backends_are_rejected(self):
+        self.assertRaises(ValueError, get_serializer, "yaml")
@@ -0,0 +1,41 @@
+import unittest
+from hamcrest import *
+from mock import Mock
+from backdrop.read.query import Query, STREAM_BATCH_SIZE
+from backdrop.read.response import StreamingData
+from tests.support.test_helpers import d_tz, d
+
+
+class TestStreamingData(unittest.TestCase):
+    def test_iterating_converts_timestamps_to_utc(self):
+        data = StreamingData(iter([{"_timestamp": d(2014, 1, 1)}]))
+
+        assert_that(list(data), contains(
+            has_entry("_timestamp", d_tz(2014, 1, 1))))
+
+    def test_documents_are_read_as_they_are_iterated(self):
+        cursor = iter([{"a": 1}, {"a": 2}])
+        data = iter(StreamingData(cursor))
+
+        next(data)
+
+        assert_that(list(cursor), is_([{"a": 2}]))
+
+    def test_streaming_raw_queries_reads_the_cursor_in_batches(self):
+        repository = Mock()
+        cursor = repository.find.return_value.batch_size.return_value
+        cursor.__iter__ = Mock(return_value=iter([{"a": 1}]))
+
+        result = Query.create(limit=5).execute(repository, stream=True)
+
+        repository.find.return_value.batch_size.assert_called_once_with(
+            STREAM_BATCH_SIZE)
+        assert_that(list(result), is_([{"a": 1}]))
+
+    def test_grouped_queries_are_not_streamed(self):
+        repository = Mock()
+        repository.group.return_value = []
+
+        result = Query.create(group_by="a").execute(repository, stream=True)
+
+        assert_that(result, is_not(instance_of(StreamingData)))
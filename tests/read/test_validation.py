@@ -1,5 +1,6 @@
 from unittest import TestCase
 from hamcrest import assert_that, is_
+from backdrop.core.pagination import encode_cursor
 from backdrop.read import validation
 from backdrop.read.api import validate_request_args as _validate_request_args
 from werkzeug.datastructures import MultiDict
@@ -473,6 +474,55 @@ class TestRequestValidationWithNoRawQueries(TestCase):
         assert_that(validation_result, is_valid())
 
 
+class TestCursorValidation(TestCase):
+    def setUp(self):
+        self.cursor = encode_cursor({"_timestamp": None, "_id": "abc"})
+
+    def test_cursor_is_allowed_on_raw_queries_with_a_limit(self):
+        assert_that(
+            validate_request_args({'limit': '10', 'cursor': self.cursor}),
+            is_valid())
+
+    def test_cursor_must_be_valid(self):
+        assert_that(
+            validate_request_args({'limit': '10', 'cursor': 'nonsense'}),
+            is_invalid_with_message("cursor is not valid"))
+
+    def test_cursor_needs_a_limit(self):
+        assert_that(
+            validate_request_args({'cursor': self.cursor}),
+            is_invalid_with_message("cursor can only be used with limit"))
+
+    def test_cursor_needs_a_timestamp_sort(self):
+        assert_that(
+            validate_request_args({'limit': '10', 'cursor': self.cursor,
+                                   'sort_by': 'name:ascending'}),
+            is_invalid_with_message(
+                "cursor can only be used with queries sorted by _timestamp"))
+
+    def test_cursor_is_not_allowed_on_grouped_queries(self):
+        assert_that(
+            validate_request_args({'limit': '10', 'cursor': self.cursor,
+                                   'group_by': 'name'}),
+            is_invalid_with_message("cursor can only be used with raw queries"))
+
+
+class TestFieldsValidation(TestCase):
+    def test_fields_are_allowed_on_raw_queries(self):
+        assert_that(validate_request_args({'fields': '_timestamp,value'}),
+                    is_valid())
+
+    def test_fields_must_be_valid_field_names(self):
+        assert_that(
+            validate_request_args({'fields': 'value,$where'}),
+            is_invalid_with_message("Cannot select an invalid field name"))
+
+    def test_fields_are_not_allowed_on_grouped_queries(self):
+        assert_that(
+            validate_request_args({'fields': 'value', 'group_by': 'name'}),
+            is_invalid_with_message("fields can only be used with raw queries"))
+
+
 class TestValidationHelpers(TestCase):
     def test_timestamp_is_valid_method(self):
         result = validation.value_is_valid_datetime_string(
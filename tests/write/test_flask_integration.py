@@ -1,10 +1,13 @@
 from datetime import datetime
 import json
+import shutil
+import tempfile
 import unittest
 
 from hamcrest import *
 import pytz
-from mock import patch
+from mock import patch, Mock
+from backdrop.core.database import BulkSaveError
 from backdrop.core.records import Record
 from tests.support.bucket import stub_bucket_retrieve_by_name
 
@@ -12,6 +15,7 @@ from tests.support.test_helpers import is_bad_request, is_ok, \
     is_error_response, has_status, is_not_found
 from tests.support.test_helpers import is_unauthorized
 from backdrop.write import api
+from backdrop.write.spool import WriteSpool
 
 
 class PostDataTestCase(unittest.TestCase):
@@ -174,6 +178,79 @@ class PostDataTestCase(unittest.TestCase):
 
         statsd.incr.assert_called_with("write.error", bucket="foo")
 
+    @patch("backdrop.core.bucket.Bucket.store")
+    @stub_bucket_retrieve_by_name("foo", bearer_token="foo-bearer-token")
+    def test_failed_records_are_reported(self, store):
+        store.side_effect = BulkSaveError([(1, "document too large")])
+
+        response = self.app.post(
+            "/foo",
+            data='[{"foo": 1}, {"foo": 2}]',
+            content_type='application/json',
+            headers=[('Authorization', 'Bearer foo-bearer-token')]
+        )
+
+        assert_that(response, has_status(500))
+        assert_that(response, is_error_response())
+        assert_that(json.loads(response.data)["errors"], is_([
+            {"index": 1, "message": "document too large"}
+        ]))
+
+
+class SpooledWritesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = api.app.test_client()
+
+    def post(self, data):
+        return self.app.post(
+            '/foo',
+            data=data,
+            content_type="application/json",
+            headers=[('Authorization', 'Bearer foo-bearer-token')],
+        )
+
+    @stub_bucket_retrieve_by_name("foo", bearer_token="foo-bearer-token")
+    @patch("backdrop.write.api.write_spool")
+    @patch("backdrop.core.bucket.Bucket.store")
+    def test_writes_are_spooled_instead_of_stored(self, store, write_spool):
+        response = self.post('{"foo": "bar"}')
+
+        assert_that(response, is_ok())
+        write_spool.append.assert_called_once_with("foo", [{"foo": "bar"}])
+        assert not store.called
+
+    @stub_bucket_retrieve_by_name("foo", bearer_token="foo-bearer-token")
+    def test_writes_with_timestamps_are_spooled_as_posted(self):
+        directory = tempfile.mkdtemp()
+        store = Mock()
+        spool = WriteSpool(directory, store, interval=None)
+        try:
+            with patch("backdrop.write.api.write_spool", spool):
+                response = self.post(
+                    '{"_timestamp": "2014-01-01T00:00:00+00:00"}')
+            spool.flush()
+        finally:
+            shutil.rmtree(directory)
+
+        assert_that(response, is_ok())
+        store.assert_called_once_with(
+            "foo", [{"_timestamp": "2014-01-01T00:00:00+00:00"}])
+
+    @stub_bucket_retrieve_by_name("foo", bearer_token="foo-bearer-token")
+    @patch("backdrop.write.api.write_spool")
+    def test_invalid_writes_are_not_spooled(self, write_spool):
+        response = self.post('{"_id": "f o o"}')
+
+        assert_that(response, is_bad_request())
+        assert not write_spool.append.called
+
+    @stub_bucket_retrieve_by_name("foo")
+    @patch("backdrop.core.bucket.Bucket.store")
+    def test_spooled_writes_are_stored_in_their_bucket(self, store):
+        api.store_spooled("foo", [{"foo": "bar"}])
+
+        store.assert_called_once_with([Record({"foo": "bar"})])
+
 
 class ApiHealthCheckTestCase(unittest.TestCase):
     def setUp(self):
@@ -0,0 +1,221 @@
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from hamcrest import assert_that, is_
+from mock import Mock, patch
+
+from backdrop.core.database import BulkSaveError
+from backdrop.core.errors import ValidationError
+from backdrop.write.spool import WriteSpool
+
+
+class TestWriteSpool(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = Mock()
+        self.spool = WriteSpool(self.directory, self.store, interval=None)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def spool_files(self):
+        return sorted(os.listdir(self.directory))
+
+    def write_file(self, name, writes, tail=""):
+        with open(os.path.join(self.directory, name), "w") as spool_file:
+            for bucket, data in writes:
+                spool_file.write(json.dumps({
+                    "bucket": bucket, "data": data, "spooled_at": 0}) + "\n")
+            spool_file.write(tail)
+
+    def test_writes_are_stored_in_batches_by_bucket(self):
+        self.spool.append("foo", [{"a": 1}])
+        self.spool.append("bar", [{"b": 1}])
+        self.spool.append("foo", [{"a": 2}, {"a": 3}])
+
+        stored = self.spool.flush()
+
+        assert_that(stored, is_(3))
+        assert_that(self.store.call_args_list, is_([
+            (("foo", [{"a": 1}, {"a": 2}, {"a": 3}]), {}),
+            (("bar", [{"b": 1}]), {}),
+        ]))
+        assert_that(self.spool_files(), is_([]))
+
+    def test_nothing_is_stored_twice(self):
+        self.spool.append("foo", [{"a": 1}])
+        self.spool.flush()
+        self.spool.flush()
+
+        assert_that(self.store.call_count, is_(1))
+
+    def test_writes_after_a_flush_go_to_a_new_file(self):
+        self.spool.append("foo", [{"a": 1}])
+        self.spool.flush()
+        self.spool.append("foo", [{"a": 2}])
+        self.spool.flush()
+
+        self.store.assert_called_with("foo", [{"a": 2}])
+
+    def test_files_left_by_a_crashed_process_are_recovered(self):
+        self.write_file("1-0-1.ready", [("foo", [{"a": 1}])])
+        self.write_file("2-0-1.spool", [("foo", [{"a": 2}])])
+
+        self.spool.flush()
+
+        assert_that(self.store.call_args_list, is_([
+            (("foo", [{"a": 1}]), {}),
+            (("foo", [{"a": 2}]), {}),
+        ]))
+        assert_that(self.spool_files(), is_([]))
+
+    def test_files_in_use_by_another_process_are_left_alone(self):
+        self.write_file("2-0-1.spool", [("foo", [{"a": 2}])])
+        in_use = open(os.path.join(self.directory, "2-0-1.spool"))
+        fcntl.flock(in_use, fcntl.LOCK_EX)
+        try:
+            self.spool.flush()
+        finally:
+            in_use.close()
+
+        assert not self.store.called
+        assert_that(self.spool_files(), is_(["2-0-1.spool"]))
+
+    def test_partial_writes_from_a_crash_are_skipped(self):
+        self.write_file("1-0-1.ready", [("foo", [{"a": 1}])],
+                        tail='{"bucket": "foo", "da')
+
+        stored = self.spool.flush()
+
+        assert_that(stored, is_(1))
+        self.store.assert_called_once_with("foo", [{"a": 1}])
+
+    def read_failed(self):
+        directory = os.path.join(self.directory, "failed")
+        writes = []
+        for name in sorted(os.listdir(directory)):
+            with open(os.path.join(directory, name)) as failed_file:
+                writes.extend(json.loads(line) for line in failed_file)
+        return writes
+
+    def test_writes_are_kept_if_they_cannot_be_stored(self):
+        self.store.side_effect = [IOError("database is down"), None]
+        self.spool.append("foo", [{"a": 1}])
+
+        assert_that(self.spool.flush(), is_(0))
+        assert_that(len(self.spool_files()), is_(2))
+        assert_that(self.spool.flush(), is_(1))
+
+        assert_that(self.store.call_count, is_(2))
+        assert_that(self.spool_files(), is_([]))
+
+    def test_stored_batches_are_not_sent_again(self):
+        self.store.side_effect = [None, IOError("database is down"), None]
+        self.write_file("1-0-1.ready", [("foo", [{"a": 1}]),
+                                        ("bar", [{"b": 1}])])
+
+        self.spool.flush()
+        self.spool.flush()
+
+        assert_that(self.store.call_args_list, is_([
+            (("foo", [{"a": 1}]), {}),
+            (("bar", [{"b": 1}]), {}),
+            (("bar", [{"b": 1}]), {}),
+        ]))
+        assert_that(self.spool_files(), is_([]))
+
+    def test_later_batches_for_a_failing_bucket_wait(self):
+        self.store.side_effect = [IOError("database is down"), None,
+                                  None, None]
+        self.write_file("1-0-1.ready", [("foo", [{"a": 1}])])
+        self.write_file("1-0-2.ready", [("foo", [{"a": 2}]),
+                                        ("bar", [{"b": 1}])])
+
+        self.spool.flush()
+        self.spool.flush()
+
+        assert_that(self.store.call_args_list, is_([
+            (("foo", [{"a": 1}]), {}),
+            (("bar", [{"b": 1}]), {}),
+            (("foo", [{"a": 1}]), {}),
+            (("foo", [{"a": 2}]), {}),
+        ]))
+        assert_that(self.spool_files(), is_([]))
+
+    def test_batches_that_keep_failing_are_moved_aside(self):
+        spool = WriteSpool(self.directory, self.store, interval=None,
+                           max_attempts=2)
+        self.store.side_effect = IOError("database is down")
+        self.write_file("1-0-1.ready", [("foo", [{"a": 1}])])
+
+        spool.flush()
+        spool.flush()
+        spool.flush()
+
+        assert_that(self.store.call_count, is_(2))
+        assert_that(self.spool_files(), is_(["failed"]))
+        failed = self.read_failed()
+        assert_that(len(failed), is_(1))
+        assert_that(failed[0]["bucket"], is_("foo"))
+        assert_that(failed[0]["data"], is_([{"a": 1}]))
+
+    def test_writes_that_can_never_be_stored_are_moved_aside(self):
+        self.store.side_effect = [ValidationError("bad record"), None]
+        self.write_file("1-0-1.ready", [("foo", [{"a": 1}])])
+        self.write_file("1-0-2.ready", [("bar", [{"b": 1}])])
+
+        stored = self.spool.flush()
+
+        assert_that(stored, is_(1))
+        self.store.assert_called_with("bar", [{"b": 1}])
+        assert_that(self.spool_files(), is_(["failed"]))
+        assert_that(self.read_failed()[0]["data"], is_([{"a": 1}]))
+
+    def test_only_records_a_bulk_save_rejected_are_moved_aside(self):
+        self.store.side_effect = BulkSaveError([(1, "duplicate key")])
+        self.write_file("1-0-1.ready", [("foo", [{"a": 1}, {"a": 2}])])
+
+        self.spool.flush()
+        self.spool.flush()
+
+        assert_that(self.store.call_count, is_(1))
+        assert_that(self.spool_files(), is_(["failed"]))
+        assert_that(self.read_failed()[0]["data"], is_([{"a": 2}]))
+
+    def test_writes_are_moved_aside_as_they_were_spooled(self):
+        def parse_and_fail(bucket_name, data):
+            data[0]["_timestamp"] = object()
+            raise ValidationError("bad record")
+        self.store.side_effect = parse_and_fail
+        self.write_file("1-0-1.ready", [("foo", [{"_timestamp": "x"}])])
+
+        self.spool.flush()
+
+        assert_that(self.read_failed()[0]["data"], is_([{"_timestamp": "x"}]))
+
+    def test_failed_writes_can_be_spooled_again(self):
+        self.store.side_effect = [ValidationError("bad record"), None]
+        self.spool.append("foo", [{"a": 1}])
+        self.spool.flush()
+
+        failed = os.path.join(self.directory, "failed")
+        for name in os.listdir(failed):
+            os.rename(os.path.join(failed, name),
+                      os.path.join(self.directory, name))
+        self.spool.flush()
+
+        self.store.assert_called_with("foo", [{"a": 1}])
+
+    @patch("backdrop.write.spool.statsd")
+    def test_lag_is_reported(self, statsd):
+        self.spool.append("foo", [{"a": 1}])
+
+        self.spool.flush()
+
+        statsd.incr.assert_called_once_with(
+            "write.spool.stored", 1, bucket="foo")
+        assert_that(statsd.timing.call_args[0][0], is_("write.spool.lag"))
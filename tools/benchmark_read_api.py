@@ -0,0 +1,259 @@
+"""
+Benchmark the read api against a local mongod
+
+A synthetic bucket is written through the write api, then each shape of
+read query is requested through the read api's test client. Latency
+percentiles and throughput are reported for every shape and can be saved
+as a JSON baseline, or compared with one to spot regressions.
+
+The apps use the config for GOVUK_ENV, which defaults to test here.
+
+Usage: python tools/benchmark_read_api.py [--records N] [--cardinality N]
+           [--days N] [--repeat N] [--save FILE] [--compare FILE]
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import random
+import sys
+import time
+from urllib import urlencode
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault("GOVUK_ENV", "test")
+
+from backdrop.core.bucket import BucketConfig
+from backdrop.read import api as read_api
+from backdrop.write import api as write_api
+
+BUCKET_NAME = "benchmark_read_api"
+BEARER_TOKEN = "benchmark-token"
+
+# Records are spread over the days before this Monday, so that period
+# queries over the same data always cover the same weeks
+END_AT = datetime.datetime(2014, 6, 2)
+
+# Records sent to the write api in each request
+WRITE_BATCH_SIZE = 1000
+
+PERCENTILES = [50, 90, 99]
+
+
+def synthetic_records(count, cardinality, days, seed=0):
+    """Yield records with two grouping fields and a numeric value"""
+    rnd = random.Random(seed)
+    span = days * 24 * 60 * 60
+    for index in range(count):
+        timestamp = END_AT - datetime.timedelta(seconds=rnd.randrange(span))
+        yield {
+            "_timestamp": timestamp.isoformat() + "+00:00",
+            "channel": "channel-{0}".format(rnd.randrange(cardinality)),
+            "region": "region-{0}".format(rnd.randrange(cardinality)),
+            "value": rnd.randrange(1000),
+        }
+
+
+def batches(records, size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def create_bucket(name):
+    config = BucketConfig(name, data_group="benchmark", data_type=name,
+                          raw_queries_allowed=True,
+                          bearer_token=BEARER_TOKEN)
+    write_api.bucket_repository.save(config)
+    write_api.db.get_collection(name).remove({})
+
+
+def write_records(name, records):
+    """Write records through the write api, return the seconds it took"""
+    client = write_api.app.test_client()
+    started = time.time()
+    for batch in batches(records, WRITE_BATCH_SIZE):
+        response = client.post(
+            "/{0}".format(name), data=json.dumps(batch),
+            content_type="application/json",
+            headers=[("Authorization", "Bearer " + BEARER_TOKEN)])
+        if response.status_code != 200:
+            raise RuntimeError("Write failed: {0}".format(response.data))
+    if write_api.write_spool is not None:
+        write_api.write_spool.flush()
+    return time.time() - started
+
+
+def query_shapes(days):
+    """Return (name, query parameters) for each shape of read query"""
+    start_at = END_AT - datetime.timedelta(weeks=max(days // 7, 1))
+    time_range = {
+        "start_at": start_at.isoformat() + "+00:00",
+        "end_at": END_AT.isoformat() + "+00:00",
+    }
+
+    def shape(name, **params):
+        return name, params
+
+    return [
+        shape("raw", limit=100),
+        shape("raw_filtered", filter_by="channel:channel-0", limit=100),
+        shape("grouped", group_by="channel"),
+        shape("grouped_top", group_by="channel",
+              sort_by="_count:descending", limit=10),
+        shape("collect", group_by="channel",
+              collect=["value:sum", "value:mean", "region"]),
+        shape("period", period="week", **time_range),
+        shape("period_grouped", period="week", group_by="region",
+              **time_range),
+        shape("period_grouped_collect", period="week", group_by="region",
+              collect=["value:sum"], **time_range),
+        shape("duration", period="week", duration=12,
+              end_at=time_range["end_at"]),
+        shape("duration_grouped", period="week", duration=12,
+              group_by="channel", end_at=time_range["end_at"]),
+    ]
+
+
+def percentile(sorted_values, percent):
+    """Return the nearest rank percentile of a sorted list
+
+    >>> percentile([1, 2, 3, 4], 50)
+    2
+    >>> percentile([1, 2, 3, 4], 99)
+    4
+    """
+    rank = int(math.ceil(percent / 100.0 * len(sorted_values)))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def time_requests(client, url, repeat):
+    """Request a url repeat times, return the latencies in milliseconds"""
+    response = client.get(url)
+    if response.status_code != 200:
+        raise RuntimeError("{0} failed: {1}".format(url, response.data))
+
+    latencies = []
+    for _ in range(repeat):
+        started = time.time()
+        client.get(url)
+        latencies.append((time.time() - started) * 1000)
+    return latencies
+
+
+def summarise(latencies):
+    latencies = sorted(latencies)
+    summary = dict(("p{0}".format(percent), percentile(latencies, percent))
+                   for percent in PERCENTILES)
+    summary["max"] = latencies[-1]
+    summary["requests_per_second"] = len(latencies) / (
+        sum(latencies) / 1000.0)
+    return summary
+
+
+def run_queries(name, shapes, repeat):
+    client = read_api.app.test_client()
+    results = {}
+    for shape, params in shapes:
+        url = "/{0}?{1}".format(name, urlencode(params, doseq=True))
+        results[shape] = summarise(time_requests(client, url, repeat))
+    return results
+
+
+def print_results(results, baseline=None):
+    columns = ["p{0}".format(percent) for percent in PERCENTILES] + ["max"]
+    print("{0:<24}".format("query") +
+          "".join("{0:>10}".format(column) for column in columns) +
+          "{0:>10}".format("req/s") +
+          ("{0:>10}".format("p50 diff") if baseline else ""))
+
+    for shape in sorted(results):
+        summary = results[shape]
+        line = "{0:<24}".format(shape) + "".join(
+            "{0:>10.1f}".format(summary[column]) for column in columns)
+        line += "{0:>10.1f}".format(summary["requests_per_second"])
+        if baseline and shape in baseline:
+            line += "{0:>+9.0%} ".format(change(baseline[shape], summary))
+        print(line)
+
+
+def change(before, after, column="p50"):
+    """Return the relative change in a latency column
+
+    >>> change({"p50": 10.0}, {"p50": 12.5})
+    0.25
+    """
+    return (after[column] - before[column]) / before[column]
+
+
+def regressions(baseline, results, tolerance):
+    return [shape for shape in sorted(results)
+            if shape in baseline and
+            change(baseline[shape], results[shape]) > tolerance]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--records", type=int, default=20000,
+                        help="Number of records in the bucket")
+    parser.add_argument("--cardinality", type=int, default=50,
+                        help="Distinct values of each grouping field")
+    parser.add_argument("--days", type=int, default=364,
+                        help="Number of days the records are spread over")
+    parser.add_argument("--repeat", type=int, default=20,
+                        help="Number of requests timed for each query")
+    parser.add_argument("--save", metavar="FILE",
+                        help="Save the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="Compare the results with a JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Relative p50 increase counted as a "
+                             "regression when comparing")
+    args = parser.parse_args()
+
+    settings = {
+        "records": args.records,
+        "cardinality": args.cardinality,
+        "days": args.days,
+        "repeat": args.repeat,
+    }
+
+    create_bucket(BUCKET_NAME)
+    write_seconds = write_records(BUCKET_NAME, synthetic_records(
+        args.records, args.cardinality, args.days))
+    print("Wrote {0} records in {1:.1f}s ({2:.0f} records/s)".format(
+        args.records, write_seconds, args.records / write_seconds))
+
+    results = run_queries(BUCKET_NAME, query_shapes(args.days), args.repeat)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            saved = json.load(f)
+        if saved["settings"] != settings:
+            print("Warning: the baseline was run with {0}".format(
+                saved["settings"]))
+        baseline = saved["results"]
+
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"settings": settings, "results": results}, f,
+                      indent=2, sort_keys=True)
+
+    if baseline is not None:
+        slower = regressions(baseline, results, args.tolerance)
+        if slower:
+            print("Slower than the baseline: {0}".format(", ".join(slower)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Compare encoding a large grouped read api response the way Flask's
+jsonify does it with the serializers in backdrop.read.serialization
+
+Usage: python tools/benchmark_serialization.py [groups] [periods]
+"""
+import datetime
+import json
+import os
+import sys
+import timeit
+
+import pytz
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from backdrop.read.serialization import BACKENDS, default, get_serializer
+
+
+class JsonEncoder(json.JSONEncoder):
+    def default(self, obj):
+        return default(obj)
+
+
+def period_value(group, period):
+    start = datetime.datetime(2013, 1, 7, tzinfo=pytz.UTC)
+    week = datetime.timedelta(days=7)
+    return {
+        "_start_at": start + week * period,
+        "_end_at": start + week * (period + 1),
+        "_count": 3,
+        "value:sum": group * period * 1.5,
+    }
+
+
+def group_value(group, periods):
+    return {
+        "channel": "channel-{0}".format(group),
+        "_count": periods * 3,
+        "_group_count": periods,
+        "values": [period_value(group, period) for period in range(periods)],
+    }
+
+
+def grouped_response(groups, periods):
+    """Return a response like a period grouped query with a collect"""
+    return {"data": [group_value(group, periods) for group in range(groups)]}
+
+
+def jsonify_dumps(obj):
+    # Flask 0.10 jsonify indents responses to requests that are not XHR
+    # and sorts keys (JSON_SORT_KEYS)
+    return json.dumps(obj, cls=JsonEncoder, indent=2, sort_keys=True)
+
+
+def best_time(func, repeat=5):
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def main(groups=200, periods=52):
+    response = grouped_response(groups, periods)
+    encoders = [("jsonify", jsonify_dumps)] + [
+        (name, get_serializer(name).dumps)
+        for name, module in sorted(BACKENDS.items()) if module is not None]
+
+    results = [(name, len(dumps(response)),
+                best_time(lambda: dumps(response)))
+               for name, dumps in encoders]
+    _, baseline_bytes, baseline_ms = results[0]
+
+    print("{0} groups x {1} periods".format(groups, periods))
+    print("{0:<12} {1:>10} {2:>10} {3:>10} {4:>10}".format(
+        "encoder", "bytes", "saved", "ms", "saved"))
+    for name, size, ms in results:
+        print("{0:<12} {1:>10} {2:>10} {3:>10.1f} {4:>10.1f}".format(
+            name, size, baseline_bytes - size, ms, baseline_ms - ms))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])